@@ -0,0 +1,3 @@
+# Shared helpers for the aws-audit scripts
+# Keep heavy imports (boto3, requests) inside the modules that need them so
+# each script only pays for what it uses
@@ -0,0 +1,134 @@
+# On-disk TTL cache for downloaded data and AWS inventory snapshots
+# One JSON file per key under the cache dir, each entry keeps the time it was saved
+# plus any HTTP validators (ETag/Last-Modified) so stale URLs can be revalidated cheaply
+
+import os
+import re
+import json
+import time
+import logging
+import tempfile
+import threading
+
+try:
+    from urllib2 import Request, urlopen, HTTPError
+except ImportError:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+
+# seconds each source stays fresh, overridden with --max-age
+# bucket regions only change when a bucket is deleted and recreated, cached entries are checked against its creation date
+DEFAULT_TTLS = {'default': 900, 'cf-ips': 3600, 's3-regions': 86400}
+
+
+def parse_max_age(value, defaults=None):
+    """
+    Parse --max-age, either one number for every source "900"
+    or per source "cf-ips=86400,route53=300", returns dict of source: seconds
+    """
+    ttls = dict(defaults or DEFAULT_TTLS)
+    if not value:
+        return ttls
+    for item in value.replace(" ", "").split(","):
+        if '=' in item:
+            source, seconds = item.split('=', 1)
+            ttls[source] = int(seconds)
+        else:
+            ttls = dict((source, int(item)) for source in ttls)
+    return ttls
+
+
+class FileCache(object):
+    """
+    JSON file cache, e.g. FileCache('~/.cache/aws-audit', {'route53': 300})
+    refresh=True ignores what is on disk but still saves new results
+    """
+
+    def __init__(self, cache_dir, ttls=None, refresh=False):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def ttl(self, source):
+        return self.ttls.get(source, self.ttls['default'])
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', key) + '.json')
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def read(self, key):
+        """ Return the raw entry {'saved', 'meta', 'data'} or None, ignoring age """
+        try:
+            with open(self.path(key)) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def fresh(self, entry, source):
+        return not self.refresh and entry is not None and time.time() - entry['saved'] < self.ttl(source)
+
+    def write(self, key, data, meta=None):
+        """ Save atomically so an interrupted run never leaves a half written entry """
+        entry = {'saved': time.time(), 'meta': meta or {}, 'data': data}
+        handle, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(handle, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        os.rename(tmp_path, self.path(key))
+
+    def fetch(self, key, loader, source=None):
+        """ Return cached data for key if still fresh, otherwise call loader() and save it """
+        entry = self.read(key)
+        if self.fresh(entry, source or key):
+            self.count('hits')
+            logging.debug("cache hit: %s", key)
+            return entry['data']
+        self.count('misses')
+        logging.debug("cache miss: %s", key)
+        data = loader()
+        self.write(key, data)
+        return data
+
+    def fetch_url(self, key, url, parse=json.loads, source=None):
+        """
+        Like fetch for an HTTP resource, a stale entry is revalidated with
+        If-None-Match/If-Modified-Since and reused on 304 Not Modified
+        """
+        entry = self.read(key)
+        if self.fresh(entry, source or key):
+            self.count('hits')
+            logging.debug("cache hit: %s", key)
+            return entry['data']
+        request = Request(url)
+        if entry is not None:
+            if entry['meta'].get('etag'):
+                request.add_header('If-None-Match', entry['meta']['etag'])
+            if entry['meta'].get('last_modified'):
+                request.add_header('If-Modified-Since', entry['meta']['last_modified'])
+        try:
+            response = urlopen(request)
+        except HTTPError as e:
+            if e.code != 304 or entry is None:
+                raise
+            self.count('revalidated')
+            logging.debug("cache revalidated: %s", key)
+            self.write(key, entry['data'], entry['meta'])
+            return entry['data']
+        self.count('misses')
+        logging.debug("cache miss: %s", key)
+        data = parse(response.read())
+        headers = response.info()
+        self.write(key, data, {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')})
+        return data
+
+    def stats(self):
+        return "cache: %d hits, %d misses, %d revalidated" % (self.hits, self.misses, self.revalidated)
@@ -0,0 +1,72 @@
+# CloudFront inventory collection
+# Streams aliases from every distribution page by page into a set, with
+# wildcard aliases (*.example.com) kept apart so lookups stay O(labels)
+
+import logging
+
+
+def iter_distributions(client):
+    """ Yield every distribution summary, following Marker pagination """
+    paginator = client.get_paginator('list_distributions')
+    for page in paginator.paginate():
+        # Items is left out entirely when an account has no distributions
+        for dist in page['DistributionList'].get('Items', []):
+            yield dist
+
+
+def iter_aliases(client):
+    """ Yield the DNS aliases (CNAMEs) of every distribution """
+    for dist in iter_distributions(client):
+        aliases = dist.get('Aliases', {}).get('Items', [])
+        if aliases:
+            logging.debug(dist['Id'] + ": " + str(aliases))
+        for alias in aliases:
+            yield alias
+
+
+class AliasSet(object):
+    """
+    Set of CloudFront aliases, e.g. 'www.example.com' in AliasSet(['*.example.com'])
+    Matching is case insensitive, ignores a trailing dot, and a wildcard alias
+    covers any name below it but not the bare domain, the same as CloudFront
+    """
+
+    def __init__(self, aliases=()):
+        self.exact = set()
+        self.wildcards = set()
+        self.update(aliases)
+
+    @staticmethod
+    def normalize(name):
+        return name.lower().rstrip('.')
+
+    def add(self, alias):
+        alias = self.normalize(alias)
+        if alias.startswith('*.'):
+            self.wildcards.add(alias[2:])
+        else:
+            self.exact.add(alias)
+
+    def update(self, aliases):
+        for alias in aliases:
+            self.add(alias)
+
+    def __contains__(self, name):
+        name = self.normalize(name)
+        if name in self.exact:
+            return True
+        if self.wildcards:
+            labels = name.split('.')
+            for idx in range(1, len(labels)):
+                if '.'.join(labels[idx:]) in self.wildcards:
+                    return True
+        return False
+
+    def __iter__(self):
+        for alias in self.exact:
+            yield alias
+        for domain in self.wildcards:
+            yield '*.' + domain
+
+    def __len__(self):
+        return len(self.exact) + len(self.wildcards)
@@ -0,0 +1,186 @@
+# S3 bucket discovery shared by the s3 scripts
+# Buckets are listed with a single list_buckets call (optionally cached on disk so
+# back to back runs don't list the account again), matched by name against compiled
+# patterns, and optionally filtered by region and tags. Scripts get plain Bucket
+# records (name, region, created) instead of a boto3 resource object per bucket.
+
+import re
+import fnmatch
+import logging
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import botocore
+from auditlib.cache import FileCache, parse_max_age
+
+# region is None unless it was needed for a region filter or asked for
+Bucket = namedtuple('Bucket', ['name', 'region', 'created'])
+
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+def add_arguments(parser):
+    """ Add the shared bucket selection and inventory cache arguments to a script's ArgumentParser """
+    parser.add_argument('--match', action='append', default=[],
+                        help='bucket name pattern, replaces --pattern, repeat for more: '
+                             'glob "static-*", regex "re:^app-[0-9]+$" or plain text to find in the name')
+    parser.add_argument('--bucket-region', action='append', default=[],
+                        help='only buckets in this region, repeat for more')
+    parser.add_argument('--bucket-tag', action='append', default=[],
+                        help='only buckets with this tag, key=value or just key, repeat to require more')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory to cache the bucket inventory in, e.g. ~/.cache/aws-audit')
+    parser.add_argument('--max-age', default=None,
+                        help='Seconds cached data stays fresh, "900" for all or per source "s3-buckets=900,s3-regions=86400"')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Ignore the cached inventory and list buckets again, still updates the cache')
+
+
+def compile_patterns(patterns):
+    """
+    Return a function name -> bool matching any of patterns, compiled once
+    're:' prefix is a regex, anything with * ? [ is a glob on the whole name,
+    otherwise the text has to appear in the name. No patterns match every bucket
+    """
+    patterns = [pattern for pattern in patterns or [] if pattern]
+    if not patterns:
+        return lambda name: True
+    substrings = []
+    regexes = []
+    for pattern in patterns:
+        if pattern.startswith('re:'):
+            regexes.append('(?:%s)' % pattern[3:])
+        elif GLOB_CHARS.search(pattern):
+            regexes.append('(?:%s)' % fnmatch.translate(pattern))
+        else:
+            substrings.append(pattern)
+    regex = re.compile('|'.join(regexes)).search if regexes else None
+
+    def matches(name):
+        for text in substrings:
+            if text in name:
+                return True
+        return regex is not None and regex(name) is not None
+    return matches
+
+
+def parse_tag_filters(values):
+    """ ['env=prod', 'owner'] -> {'env': 'prod', 'owner': None}, None means any value """
+    filters = {}
+    for value in values or []:
+        key, _, tag_value = value.partition('=')
+        filters[key] = tag_value if '=' in value else None
+    return filters
+
+
+def list_buckets(client):
+    """ Every bucket in the account from one list_buckets call, as plain dicts """
+    return [{'name': bucket['Name'], 'created': str(bucket.get('CreationDate', ''))}
+            for bucket in client.list_buckets()['Buckets']]
+
+
+def bucket_tags(clients, bucket):
+    """ dict of key: value for a bucket, empty when it has none or they can't be read """
+    try:
+        tag_set = clients.bucket_client(bucket).get_bucket_tagging(Bucket=bucket)['TagSet']
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchTagSet':
+            logging.warn("Can't read tags on bucket %s: %s", bucket, e)
+        return {}
+    return dict((tag['Key'], tag['Value']) for tag in tag_set)
+
+
+def tags_match(tags, filters):
+    for key, value in filters.items():
+        if key not in tags or (value is not None and tags[key] != value):
+            return False
+    return True
+
+
+def resolve_regions(clients, records, workers, cache=None, profile='default'):
+    """
+    dict of bucket name: region, looked up concurrently through the S3ClientPool,
+    which is seeded with the results so scripts don't look them up again
+    A bucket can't change region without being recreated, so cached regions are
+    kept per name and creation date
+    """
+    key = 's3-regions-' + profile
+    known = {}
+    if cache:
+        entry = cache.read(key)
+        if cache.fresh(entry, 's3-regions'):
+            known = entry['data']
+    regions = {}
+    missing = []
+    for record in records:
+        cached = known.get(record['name'])
+        if cached and cached[0] == record['created']:
+            regions[record['name']] = cached[1]
+            clients.set_region(record['name'], cached[1])
+        else:
+            missing.append(record)
+
+    def lookup(record):
+        try:
+            return record['name'], clients.region(record['name'])
+        except botocore.exceptions.ClientError as e:
+            logging.warn("Can't find region of bucket %s: %s", record['name'], e)
+            return record['name'], None
+
+    if missing:
+        pool = ThreadPool(max(1, workers))
+        try:
+            regions.update(pool.map(lookup, missing))
+        finally:
+            pool.close()
+            pool.join()
+        if cache:
+            created = dict((record['name'], record['created']) for record in records)
+            known.update((name, [created[name], region]) for name, region in regions.items() if region)
+            cache.write(key, known)
+    return regions
+
+
+def discover(clients, patterns=None, regions=None, tags=None, cache=None, workers=20,
+             profile='default', with_regions=False):
+    """
+    List of Bucket records sorted by name
+    clients is an S3ClientPool, patterns as in compile_patterns, regions a list of
+    region names, tags a dict from parse_tag_filters, cache a FileCache for the inventory
+    """
+    if cache:
+        records = cache.fetch('s3-buckets-' + profile, lambda: list_buckets(clients.client()), 's3-buckets')
+    else:
+        records = list_buckets(clients.client())
+    matches = compile_patterns(patterns)
+    records = sorted((record for record in records if matches(record['name'])), key=lambda record: record['name'])
+    logging.info("%d buckets matching %s", len(records), patterns)
+
+    found = {}
+    if regions or with_regions:
+        found = resolve_regions(clients, records, workers, cache, profile)
+        if regions:
+            records = [record for record in records if found.get(record['name']) in regions]
+
+    if tags:
+        pool = ThreadPool(max(1, workers))
+        try:
+            bucket_tag_sets = pool.map(lambda record: bucket_tags(clients, record['name']), records)
+        finally:
+            pool.close()
+            pool.join()
+        records = [record for record, tag_set in zip(records, bucket_tag_sets) if tags_match(tag_set, tags)]
+
+    return [Bucket(record['name'], found.get(record['name']), record['created']) for record in records]
+
+
+def from_args(args, clients, patterns, workers=20, profile='default', with_regions=False):
+    """ discover() with the --match/--bucket-region/--bucket-tag/--cache-dir arguments, patterns is the script's default """
+    cache = None
+    if args.cache_dir:
+        cache = FileCache(args.cache_dir, parse_max_age(args.max_age), args.refresh)
+    # with a cache, cached regions are loaded up front so the scripts skip those lookups
+    found = discover(clients, args.match or patterns, args.bucket_region, parse_tag_filters(args.bucket_tag),
+                     cache, workers, profile or 'default', with_regions or cache is not None)
+    if cache:
+        logging.info(cache.stats())
+    return found
@@ -0,0 +1,341 @@
+# CNAME chain resolution with a shared TTL cache
+# gethostbyname_ex flattens the chain and folds every failure into one error, so a record
+# whose CNAME points at a name that no longer exists (the subdomain takeover case) looks
+# like any other lookup failure. This asks the nameserver directly (plain DNS over UDP,
+# TCP when truncated), caches every hop of every answer for its TTL, NXDOMAIN/NODATA for
+# the zone's negative TTL, and walks each record's chain hop by hop through that cache,
+# so records sharing a target only cost one query for it, across all records and profiles.
+
+import time
+import random
+import socket
+import struct
+import logging
+import threading
+from collections import namedtuple
+
+TYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'AAAA': 28}
+NOERROR, SERVFAIL, NXDOMAIN = 0, 2, 3
+# status of a Resolution
+OK, DANGLING, NOT_FOUND, NO_ADDRESS, SERVER_FAILURE, TIMEOUT, LOOP, ERROR = (
+    'ok', 'dangling', 'nxdomain', 'nodata', 'servfail', 'timeout', 'loop', 'error')
+
+# one resource record, value is an ip string for A, a name for CNAME and (ttl, minimum) for SOA
+RR = namedtuple('RR', ['name', 'rrtype', 'ttl', 'value'])
+Message = namedtuple('Message', ['id', 'rcode', 'truncated', 'answers', 'authority'])
+
+
+class Resolution(namedtuple('Resolution', ['name', 'chain', 'ips', 'status'])):
+    """
+    Result of walking one name, chain is the name followed by every CNAME target in order
+    status is ok, dangling (a CNAME target is NXDOMAIN), nxdomain (the name itself),
+    nodata, servfail, timeout, loop or error
+    """
+
+    def answer(self):
+        """ (host, cnames, ips) like gethostbyname_ex, ips is empty for a dangling chain """
+        return self.chain[-1], self.chain[:-1], list(self.ips)
+
+
+def normalize(name):
+    return name.lower().rstrip('.')
+
+
+def read_nameservers(path='/etc/resolv.conf'):
+    """ nameserver addresses from resolv.conf """
+    servers = []
+    try:
+        with open(path) as resolv:
+            for line in resolv:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    servers.append(fields[1])
+    except (IOError, OSError):
+        pass
+    return servers
+
+
+def parse_nameserver(value):
+    """ 'host', 'host:port' or '[v6]:port' -> (host, port) """
+    if value.startswith('['):
+        host, _, port = value[1:].partition(']:')
+        return host.rstrip(']'), int(port or 53)
+    if value.count(':') == 1:
+        host, port = value.split(':')
+        return host, int(port)
+    return value, 53
+
+
+def encode_name(name):
+    labels = [label.encode('idna') for label in normalize(name).split('.') if label]
+    return b''.join(struct.pack('>B', len(label)) + label for label in labels) + b'\0'
+
+
+def build_query(query_id, name, rrtype='A'):
+    """ Wire format query with recursion desired """
+    return struct.pack('>HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + encode_name(name) + struct.pack('>HH', TYPES[rrtype], 1)
+
+
+def read_name(data, offset):
+    """ (name, offset after it), following compression pointers """
+    labels = []
+    end = None
+    for _ in range(128):
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+        elif length == 0:
+            return '.'.join(labels).lower(), end if end is not None else offset + 1
+        else:
+            labels.append(bytes(data[offset + 1:offset + 1 + length]).decode('ascii', 'replace'))
+            offset += 1 + length
+    raise ValueError('DNS name compression loop')
+
+
+def read_records(data, offset, count):
+    records = []
+    names = dict((number, name) for name, number in TYPES.items())
+    for _ in range(count):
+        name, offset = read_name(data, offset)
+        rrtype, _, ttl, length = struct.unpack('>HHIH', bytes(data[offset:offset + 10]))
+        offset += 10
+        rdata = offset
+        offset += length
+        rrtype = names.get(rrtype, rrtype)
+        if rrtype == 'A':
+            value = '.'.join(str(byte) for byte in data[rdata:rdata + 4])
+        elif rrtype == 'CNAME':
+            value = read_name(data, rdata)[0]
+        elif rrtype == 'SOA':
+            end = read_name(data, read_name(data, rdata)[1])[1]
+            value = (ttl, struct.unpack('>5I', bytes(data[end:end + 20]))[4])
+        else:
+            value = None
+        records.append(RR(name, rrtype, ttl, value))
+    return records, offset
+
+
+def parse_message(data):
+    data = bytearray(data)
+    query_id, flags, questions, answers, authority, _ = struct.unpack('>HHHHHH', bytes(data[:12]))
+    offset = 12
+    for _ in range(questions):
+        offset = read_name(data, offset)[1] + 4
+    answer_records, offset = read_records(data, offset, answers)
+    authority_records, offset = read_records(data, offset, authority)
+    return Message(query_id, flags & 0xF, bool(flags & 0x0200), answer_records, authority_records)
+
+
+class DnsClient(object):
+    """
+    Sends one question to the nameservers in turn, e.g. DnsClient(['10.0.0.2']).query('www.example.com')
+    A server that times out or can't be reached (refused, unreachable, reset) is skipped for the next one,
+    raises socket.timeout when none of them answers, so callers retry it like a timeout
+    """
+
+    def __init__(self, nameservers=None, timeout=5.0):
+        self.nameservers = [parse_nameserver(server) for server in (nameservers or read_nameservers())]
+        if not self.nameservers:
+            raise ValueError('No nameservers, pass some or add them to /etc/resolv.conf')
+        self.timeout = timeout or None
+
+    def query(self, name, rrtype='A'):
+        query_id = random.randint(0, 0xFFFF)
+        packet = build_query(query_id, name, rrtype)
+        for server in self.nameservers:
+            try:
+                message = self.query_udp(server, packet, query_id)
+                if message.truncated:
+                    message = self.query_tcp(server, packet)
+                return message
+            except socket.timeout:
+                logging.debug("%s: no answer from %s", name, server[0])
+            except socket.error as e:
+                logging.debug("%s: can't query %s: %s", name, server[0], e)
+        raise socket.timeout("no nameserver answered for " + name)
+
+    def query_udp(self, server, packet, query_id):
+        family = socket.AF_INET6 if ':' in server[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.sendto(packet, server)
+            while True:
+                data, _ = sock.recvfrom(65535)
+                # ignore late answers to an earlier query on a reused port
+                if len(data) >= 12 and struct.unpack('>H', data[:2])[0] == query_id:
+                    return parse_message(data)
+        finally:
+            sock.close()
+
+    def query_tcp(self, server, packet):
+        sock = socket.create_connection(server, self.timeout)
+        try:
+            sock.sendall(struct.pack('>H', len(packet)) + packet)
+            data = b''
+            while len(data) < 2 or len(data) < 2 + struct.unpack('>H', data[:2])[0]:
+                chunk = sock.recv(65535)
+                if not chunk:
+                    raise socket.error('connection closed by ' + server[0])
+                data += chunk
+            return parse_message(data[2:])
+        finally:
+            sock.close()
+
+
+class ChainResolver(object):
+    """
+    Walks CNAME chains hop by hop through a TTL cache shared by every caller, e.g.
+    chain = ChainResolver(DnsClient(timeout=5))
+    chain.resolve('www.example.com') -> Resolution('www.example.com', ['www.example.com', 'd1.cloudfront.net'], [...], 'ok')
+    Each hop is queried at most once at a time, threads wanting the same name wait for that answer
+    """
+
+    def __init__(self, client, max_hops=16, negative_ttl=300, clock=time.time):
+        self.client = client
+        self.max_hops = max_hops
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.cache = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.counts = {'lookups': 0, 'queries': 0, 'hits': 0, 'dangling': 0, 'nxdomain': 0,
+                       'servfail': 0, 'timeout': 0}
+
+    def seed(self, name, target=None, ips=None):
+        """
+        Record a CNAME target or A addresses known from elsewhere (e.g. Route53) for the whole run,
+        so the name itself is never queried, only where it points
+        """
+        with self.lock:
+            if target:
+                self.cache[normalize(name)] = ('CNAME', normalize(target), float('inf'))
+            else:
+                self.cache[normalize(name)] = ('A', list(ips), float('inf'))
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def resolve(self, name):
+        """ Resolution of name, never raises for DNS failures """
+        self.count('lookups')
+        chain = [normalize(name)]
+        try:
+            for _ in range(self.max_hops):
+                kind, value = self.hop(chain[-1])
+                if kind == 'CNAME':
+                    if value in chain:
+                        return Resolution(chain[0], chain + [value], [], LOOP)
+                    chain.append(value)
+                elif kind == 'A':
+                    return Resolution(chain[0], chain, value, OK)
+                elif kind == NOT_FOUND and len(chain) > 1:
+                    self.count('dangling')
+                    return Resolution(chain[0], chain, [], DANGLING)
+                else:
+                    if kind == NOT_FOUND:
+                        self.count('nxdomain')
+                    return Resolution(chain[0], chain, [], kind)
+            return Resolution(chain[0], chain, [], LOOP)
+        except socket.timeout:
+            self.count('timeout')
+            return Resolution(chain[0], chain, [], TIMEOUT)
+        except (socket.error, ValueError, struct.error) as e:
+            logging.debug("%s: %s", chain[-1], e)
+            return Resolution(chain[0], chain, [], ERROR)
+
+    def gethostbyname_ex(self, name):
+        """
+        Drop-in for socket.gethostbyname_ex, e.g. DnsPool(resolve=chain.gethostbyname_ex)
+        A dangling chain is returned (host, cnames, []) instead of raising, so callers can see it,
+        SERVFAIL raises EAI_AGAIN and timeouts socket.timeout, which DnsPool retries
+        """
+        result = self.resolve(name)
+        if result.status in (OK, DANGLING):
+            return result.answer()
+        if result.status == TIMEOUT:
+            raise socket.timeout("timed out resolving " + name)
+        if result.status == SERVER_FAILURE:
+            raise socket.gaierror(getattr(socket, 'EAI_AGAIN', -3), 'SERVFAIL resolving ' + result.chain[-1])
+        raise socket.gaierror(getattr(socket, 'EAI_NONAME', -2), '%s resolving %s' % (result.status, result.chain[-1]))
+
+    def cached(self, name):
+        entry = self.cache.get(name)
+        if entry and entry[2] > self.clock():
+            return entry[0], entry[1]
+        return None
+
+    def hop(self, name):
+        """ (kind, value) for one name: ('CNAME', target), ('A', ips), ('nxdomain'|'nodata'|'servfail', None) """
+        while True:
+            with self.lock:
+                entry = self.cached(name)
+                if entry:
+                    self.counts['hits'] += 1
+                    return entry
+                waiting = self.pending.get(name)
+                if waiting is None:
+                    self.pending[name] = threading.Event()
+                    break
+            waiting.wait()
+        try:
+            self.count('queries')
+            message = self.client.query(name, 'A')
+            if message.rcode not in (NOERROR, NXDOMAIN):
+                self.count('servfail')
+                return SERVER_FAILURE, None
+            with self.lock:
+                self.store(name, message)
+                entry = self.cached(name)
+            # a zero TTL answer isn't cached but still answers this hop
+            return entry or self.terminal(name, message)
+        finally:
+            with self.lock:
+                self.pending.pop(name).set()
+
+    def terminal(self, name, message):
+        cnames = dict((rr.name, rr.value) for rr in message.answers if rr.rrtype == 'CNAME')
+        if name in cnames:
+            return 'CNAME', cnames[name]
+        ips = [rr.value for rr in message.answers if rr.rrtype == 'A' and rr.name == name]
+        if ips:
+            return 'A', ips
+        return (NOT_FOUND if message.rcode == NXDOMAIN else NO_ADDRESS), None
+
+    def store(self, name, message):
+        """ Cache every hop in the answer, and the end of the chain as NXDOMAIN/NODATA if it has no address """
+        now = self.clock()
+        addresses = {}
+        cnames = {}
+        for rr in message.answers:
+            if rr.rrtype == 'CNAME':
+                cnames[rr.name] = rr.value
+                self.cache[rr.name] = ('CNAME', rr.value, now + rr.ttl)
+            elif rr.rrtype == 'A':
+                ips, ttl = addresses.get(rr.name, ([], rr.ttl))
+                addresses[rr.name] = (ips + [rr.value], min(ttl, rr.ttl))
+        for owner, (ips, ttl) in addresses.items():
+            self.cache[owner] = ('A', ips, now + ttl)
+        # only this answer's CNAMEs are followed, older (maybe expired) entries must not pick the name
+        last = name
+        seen = set()
+        while last in cnames:
+            if last in seen:
+                # a loop in the answer, its CNAMEs are cached and the walk in resolve() reports it
+                return
+            seen.add(last)
+            last = cnames[last]
+        if last not in addresses:
+            # negative answers live for min(SOA ttl, SOA minimum), RFC 2308
+            soa = [min(rr.value) for rr in message.authority if rr.rrtype == 'SOA']
+            kind = NOT_FOUND if message.rcode == NXDOMAIN else NO_ADDRESS
+            self.cache[last] = (kind, None, now + (soa[0] if soa else self.negative_ttl))
+
+    def stats(self):
+        with self.lock:
+            return ("DNS chains: %(lookups)d lookups, %(queries)d queries, %(hits)d cached hops, "
+                    "%(dangling)d dangling, %(nxdomain)d nxdomain, %(servfail)d servfail, %(timeout)d timeouts"
+                    % self.counts)
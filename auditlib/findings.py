@@ -0,0 +1,117 @@
+# Structured findings output shared by the audit scripts
+# Each finding is written and flushed as soon as it is produced, as plain text
+# (the scripts' original lines), JSON lines or CSV, so a SIEM can start ingesting
+# before a long multi-account scan finishes
+
+import sys
+import csv
+import copy
+import json
+import datetime
+import threading
+
+FORMATS = ['text', 'jsonl', 'csv']
+FIELDS = ['timestamp', 'script', 'profile', 'resource', 'severity', 'detail']
+
+try:
+    TEXT_TYPE = unicode
+except NameError:
+    TEXT_TYPE = str
+
+
+def add_arguments(parser):
+    """ Add --output/--output-file to a script's ArgumentParser """
+    parser.add_argument('-o', '--output', default='text', choices=FORMATS,
+                        help='findings format, text (default), jsonl or csv')
+    parser.add_argument('--output-file', default=None,
+                        help='write findings to this file instead of stdout, appends if it exists')
+
+
+def from_args(args, script, profile=''):
+    """ FindingsWriter for the parsed --output/--output-file arguments """
+    stream = sys.stdout
+    if args.output_file:
+        stream = open(args.output_file, 'a')
+        stream.seek(0, 2)
+    return FindingsWriter(script, args.output, stream, profile)
+
+
+class FindingsWriter(object):
+    """
+    Writes one record per finding, e.g.
+    writer = FindingsWriter('s3ListPublic', 'jsonl')
+    writer.emit('my-bucket', 'high', 'my-bucket Read - AllUsers Access: List Objects')
+    Progress messages go through note(), which keeps them out of jsonl/csv output
+    counts has the number of findings per (profile, severity)
+    """
+
+    def __init__(self, script, fmt='text', stream=None, profile=''):
+        if fmt not in FORMATS:
+            raise ValueError('Invalid findings format: %s' % fmt)
+        self.script = script
+        self.fmt = fmt
+        self.stream = stream or sys.stdout
+        self.profile = profile
+        self.count = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.csv = None
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(self.stream, FIELDS)
+            # header only at the start of a file, so appending runs to one csv keeps it valid
+            if self.position() == 0:
+                self.csv.writeheader()
+
+    def scoped(self, script, profile=''):
+        """
+        Writer for another script sharing this one's stream, lock and csv header, with its own counts,
+        so several checks in one process (aws-audit.py) write one report
+        """
+        writer = copy.copy(self)
+        writer.script = script
+        writer.profile = profile
+        writer.count = 0
+        writer.counts = {}
+        return writer
+
+    def position(self):
+        try:
+            return self.stream.tell()
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def record(self, resource, severity, detail, profile=None):
+        return {
+            'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'script': self.script,
+            'profile': self.profile if profile is None else profile,
+            'resource': resource,
+            'severity': severity,
+            'detail': detail,
+        }
+
+    def emit(self, resource, severity, detail, profile=None):
+        """ Write and flush one finding, detail is the line the script printed before """
+        record = self.record(resource, severity, detail, profile)
+        with self.lock:
+            if self.fmt == 'text':
+                self.stream.write(detail + '\n')
+            elif self.fmt == 'jsonl':
+                self.stream.write(json.dumps(record, sort_keys=True) + '\n')
+            else:
+                if TEXT_TYPE is not str:
+                    # python 2 csv only writes byte strings
+                    record = dict((key, value.encode('utf-8') if isinstance(value, TEXT_TYPE) else value)
+                                  for key, value in record.items())
+                self.csv.writerow(record)
+            self.stream.flush()
+            self.count += 1
+            key = (record['profile'], severity)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def note(self, text):
+        """ Progress message, on stdout for text output and stderr otherwise """
+        stream = self.stream if self.fmt == 'text' else sys.stderr
+        with self.lock:
+            stream.write(text + '\n')
+            stream.flush()
@@ -0,0 +1,90 @@
+# State kept between audit runs for incremental mode
+# Remembers each record's signature (type + target), its last DNS answer, the
+# CloudFront alias set and the RISK findings, so the next run only re-resolves
+# records that changed or whose name or CNAMEs match an added or removed alias,
+# plus a rotating sample of the unchanged ones
+
+import os
+import json
+import logging
+import tempfile
+from auditlib.cloudfront import AliasSet
+
+
+class AuditState(object):
+    """
+    Previous run loaded from a JSON file, e.g. AuditState('~/.cache/aws-audit/state.json', 5)
+    sample_percent of the unchanged records are re-resolved each run, in rotation,
+    so every record is re-checked at least once every 100 / sample_percent runs
+    """
+
+    def __init__(self, path, sample_percent=5):
+        self.path = os.path.expanduser(path)
+        self.sample_percent = sample_percent
+        self.records = {}
+        self.resolved = {}
+        self.aliases = []
+        self.findings = []
+        self.cursor = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as state_file:
+                state = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            logging.info("No previous audit state at %s, auditing everything", self.path)
+            return
+        self.records = state.get('records', {})
+        self.resolved = state.get('resolved', {})
+        self.aliases = state.get('aliases', [])
+        self.findings = state.get('findings', [])
+        self.cursor = state.get('cursor', 0)
+
+    def save(self, records, resolved, aliases, findings):
+        """ Write the state for the next run atomically """
+        state = {'records': records, 'resolved': resolved, 'aliases': sorted(aliases),
+                 'findings': findings, 'cursor': self.cursor}
+        state_dir = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        handle, tmp_path = tempfile.mkstemp(dir=state_dir)
+        with os.fdopen(handle, 'w') as state_file:
+            json.dump(state, state_file)
+        os.rename(tmp_path, self.path)
+
+    def plan(self, records, aliases=()):
+        """
+        Pass dict of name: signature for the current inventory and this run's CloudFront aliases
+        returns (changed, sampled) names to re-resolve, the rest can reuse self.resolved
+        A failed lookup (timeout, SERVFAIL, ...) counts as changed, so it is retried every run
+        instead of standing in for the record until the sample comes round to it, and so does
+        a record whose name or CNAMEs match an alias added or removed since the last run, as
+        its distribution (and so its DNS answer) probably changed with it
+        """
+        moved = AliasSet(set(aliases).symmetric_difference(self.aliases))
+        changed = sorted(name for name, signature in records.items()
+                         if self.records.get(name) != signature or not self.resolved.get(name, [False])[0]
+                         or (moved and any(alias in moved for alias in [name] + self.resolved[name][1])))
+        changed_set = set(changed)
+        unchanged = sorted(name for name in records if name not in changed_set)
+        sampled = []
+        if unchanged and self.sample_percent > 0:
+            size = min(len(unchanged), max(1, len(unchanged) * self.sample_percent // 100))
+            start = self.cursor % len(unchanged)
+            sampled = (unchanged[start:] + unchanged[:start])[:size]
+            self.cursor = start + size
+        logging.info("Incremental audit: %d added/modified, %d aliases added/removed, %d of %d unchanged sampled",
+                     len(changed), len(moved), len(sampled), len(unchanged))
+        return changed, sampled
+
+    def diff_findings(self, findings):
+        """
+        Pass list of (resource, finding) pairs for this run
+        returns (new, resolved) pairs compared to the previous run
+        """
+        previous = set(tuple(finding) for finding in self.findings)
+        current = set(tuple(finding) for finding in findings)
+        new = [tuple(finding) for finding in findings if tuple(finding) not in previous]
+        resolved = [tuple(finding) for finding in self.findings if tuple(finding) not in current]
+        return new, resolved
@@ -0,0 +1,222 @@
+# Integer range helpers for CIDR blocks
+# Blocks are converted once to (first, last) integer ranges, merged, and kept sorted
+# so an address lookup is a single bisect instead of one IPNetwork build per block.
+# The same ranges can be written back out as the fewest blocks using only the prefix
+# lengths an AWS WAF IPSet accepts, without ever listing individual addresses
+
+import bisect
+import binascii
+import socket
+
+ADDRESS_BITS = {4: 32, 6: 128}
+# prefix lengths a WAF IPSet accepts, http://docs.aws.amazon.com/waf/latest/APIReference/API_IPSetDescriptor.html
+WAF_PREFIXES = {4: (8, 16, 24, 32), 6: (16, 24, 32, 48, 56, 64, 128)}
+
+
+def ip_to_int(ip):
+    """ Return (version, integer value) for an IPv4 or IPv6 address string """
+    try:
+        return 4, int(binascii.hexlify(socket.inet_pton(socket.AF_INET, str(ip))), 16)
+    except socket.error:
+        return 6, int(binascii.hexlify(socket.inet_pton(socket.AF_INET6, str(ip))), 16)
+
+
+def int_to_ip(version, value):
+    """ Address string for an integer, the reverse of ip_to_int """
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, binascii.unhexlify('%08x' % value))
+    return socket.inet_ntop(socket.AF_INET6, binascii.unhexlify('%032x' % value))
+
+
+def block_to_range(block):
+    """ Return (version, first, last) for a CIDR block string, a bare address is a single address block """
+    ip, _, mask = str(block).strip().partition('/')
+    version, value = ip_to_int(ip)
+    bits = ADDRESS_BITS[version]
+    mask = int(mask) if mask else bits
+    if mask < 0 or mask > bits:
+        raise ValueError('Invalid mask in block: %s' % block)
+    size = 1 << (bits - mask)
+    first = value - value % size
+    return version, first, first + size - 1
+
+
+def iter_merged(ranges):
+    """ Lazily collapse (first, last) ranges that are already sorted by first, constant memory """
+    current = None
+    for first, last in ranges:
+        if current is not None and first < current[0]:
+            raise ValueError('Ranges are not sorted: %d after %d' % (first, current[0]))
+        if current is not None and first <= current[1] + 1:
+            if last > current[1]:
+                current = (current[0], last)
+        else:
+            if current is not None:
+                yield current
+            current = (first, last)
+    if current is not None:
+        yield current
+
+
+def merge_ranges(ranges):
+    """ Collapse overlapping, adjacent and duplicate (first, last) ranges into a sorted list """
+    return list(iter_merged(sorted(ranges)))
+
+
+def range_to_prefixes(first, last, prefixes, bits=32):
+    """
+    Yield (network, prefix length) for the fewest blocks of the allowed prefix lengths
+    that exactly cover first..last, e.g. a /17 becomes 128 /24s and a /25 128 /32s
+    At each step the largest allowed block that is aligned and still fits is taken
+    """
+    allowed = sorted(prefixes)
+    if bits not in allowed:
+        raise ValueError('Allowed prefixes must include /%d to cover any range' % bits)
+    while first <= last:
+        for prefixlen in allowed:
+            size = 1 << (bits - prefixlen)
+            if first % size == 0 and first + size - 1 <= last:
+                break
+        yield first, prefixlen
+        first += size
+
+
+def count_prefixes(first, last, prefixes, bits=32):
+    """
+    Number of blocks range_to_prefixes yields for first..last, without listing them
+    Runs of equal blocks are counted at once, up to the next boundary of a larger allowed block,
+    so e.g. an IPv6 /100 (2^28 /128s) costs a few steps
+    """
+    allowed = sorted(prefixes)
+    if bits not in allowed:
+        raise ValueError('Allowed prefixes must include /%d to cover any range' % bits)
+    count = 0
+    while first <= last:
+        for idx, prefixlen in enumerate(allowed):
+            size = 1 << (bits - prefixlen)
+            if first % size == 0 and first + size - 1 <= last:
+                break
+        steps = (last - first + 1) // size
+        if idx > 0:
+            larger = 1 << (bits - allowed[idx - 1])
+            if first % larger:
+                steps = min(steps, (larger - first % larger) // size)
+        count += steps
+        first += steps * size
+    return count
+
+
+def range_to_blocks(version, first, last, prefixes=None):
+    """ Yield CIDR strings for one range using only prefixes (WAF_PREFIXES by default) """
+    allowed = (prefixes or WAF_PREFIXES)[version]
+    for network, prefixlen in range_to_prefixes(first, last, allowed, ADDRESS_BITS[version]):
+        yield '%s/%d' % (int_to_ip(version, network), prefixlen)
+
+
+def compact_blocks(blocks, prefixes=None, presorted=False, limit=None, oversized=None):
+    """
+    Yield CIDR strings covering exactly the same addresses as blocks, after merging
+    duplicate, overlapping and adjacent blocks, using only prefixes (WAF_PREFIXES by default)
+    """
+    return compact_ranges((block_to_range(blk) for blk in blocks), prefixes, presorted, limit, oversized)
+
+
+def compact_ranges(ranges, prefixes=None, presorted=False, limit=None, oversized=None):
+    """
+    compact_blocks for (version, first, last) ranges from block_to_range
+    Merging needs every input range in memory (never the expanded addresses), with
+    presorted=True ranges sorted by address are merged as they arrive in constant memory
+    A merged range needing more than limit blocks (an IPv6 /100 is 2^28 /128s) is left out,
+    oversized(version, first, last, count) is called for it if given
+    """
+    def blocks(version, first, last):
+        if limit is not None:
+            count = count_prefixes(first, last, (prefixes or WAF_PREFIXES)[version], ADDRESS_BITS[version])
+            if count > limit:
+                if oversized is not None:
+                    oversized(version, first, last, count)
+                return iter(())
+        return range_to_blocks(version, first, last, prefixes)
+
+    if presorted:
+        current = {}
+        for version, first, last in ranges:
+            previous = current.get(version)
+            if previous is not None and first < previous[0]:
+                raise ValueError('Blocks are not sorted: %s' % int_to_ip(version, first))
+            if previous is not None and first <= previous[1] + 1:
+                current[version] = (previous[0], max(previous[1], last))
+                continue
+            if previous is not None:
+                for block in blocks(version, previous[0], previous[1]):
+                    yield block
+            current[version] = (first, last)
+        for version in sorted(current):
+            for block in blocks(version, current[version][0], current[version][1]):
+                yield block
+        return
+    by_version = {4: [], 6: []}
+    for version, first, last in ranges:
+        by_version[version].append((first, last))
+    for version in (4, 6):
+        for first, last in iter_merged(sorted(by_version.pop(version))):
+            for block in blocks(version, first, last):
+                yield block
+
+
+class PrefixIndex(object):
+    """
+    Sorted, merged IPv4/IPv6 ranges built once from a list of CIDR blocks
+    e.g. PrefixIndex(get_cf_blks()) then '13.32.0.1' in index
+    """
+
+    def __init__(self, blocks):
+        ranges = {4: [], 6: []}
+        for blk in blocks:
+            version, first, last = block_to_range(blk)
+            ranges[version].append((first, last))
+        self.starts = {}
+        self.ends = {}
+        for version, rngs in ranges.items():
+            merged = merge_ranges(rngs)
+            self.starts[version] = [rng[0] for rng in merged]
+            self.ends[version] = [rng[1] for rng in merged]
+
+    def __len__(self):
+        return len(self.starts[4]) + len(self.starts[6])
+
+    def __contains__(self, ip):
+        return self.contains(ip)
+
+    def contains(self, ip):
+        """ True if ip falls in one of the indexed blocks, O(log n) """
+        version, value = ip_to_int(ip)
+        idx = bisect.bisect_right(self.starts[version], value) - 1
+        return idx >= 0 and value <= self.ends[version][idx]
+
+    def any_in(self, ips):
+        """ True as soon as one ip of the list is in an indexed block """
+        for ip in ips:
+            if self.contains(ip):
+                return True
+        return False
+
+    def classify(self, ips):
+        """
+        Batch lookup, returns dict of ip: True/False for a whole list of resolved IPs
+        Sorts the addresses once and sweeps them against the ranges in a single pass
+        """
+        result = {}
+        by_version = {4: [], 6: []}
+        for ip in ips:
+            version, value = ip_to_int(ip)
+            by_version[version].append((value, ip))
+        for version, values in by_version.items():
+            starts = self.starts[version]
+            ends = self.ends[version]
+            idx = 0
+            for value, ip in sorted(values):
+                while idx < len(ends) and ends[idx] < value:
+                    idx += 1
+                result[ip] = idx < len(starts) and starts[idx] <= value
+        return result
@@ -0,0 +1,63 @@
+# Append-only progress journal for long rollouts
+# One JSON line per finished item is written and flushed as soon as it completes,
+# so a rollout that is interrupted (ctrl-c, expired credentials, crashed host)
+# can be started again with the same journal and skip what it already did
+
+import os
+import json
+import logging
+import datetime
+import threading
+
+
+class ProgressJournal(object):
+    """
+    Journal of items already handled, e.g.
+    journal = ProgressJournal('~/.cache/aws-audit/versioning.jsonl')
+    if not journal.finished('my-bucket', days=90): ... journal.record('my-bucket', 'applied', days=90)
+    Later lines win, so an item that failed and then succeeded counts as done
+    """
+
+    # statuses that mean the item doesn't need to be looked at again, anything else (failed, or
+    # blocked waiting for someone to review the bucket) is checked again on the next run
+    FINISHED = ('applied', 'compliant')
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a partly written last line from an interrupted run
+                        continue
+                    self.entries[entry['item']] = entry
+        except (IOError, OSError):
+            logging.info("No progress journal at %s, starting from scratch", self.path)
+
+    def finished(self, item, **fields):
+        """ True when item was finished by a previous run with the same fields (e.g. days=90) """
+        entry = self.entries.get(item)
+        if not entry or entry.get('status') not in self.FINISHED:
+            return False
+        return all(entry.get(key) == value for key, value in fields.items())
+
+    def record(self, item, status, **fields):
+        """ Append and flush one entry """
+        entry = dict(fields, item=item, status=status,
+                     timestamp=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'))
+        with self.lock:
+            journal_dir = os.path.dirname(self.path)
+            if journal_dir and not os.path.isdir(journal_dir):
+                os.makedirs(journal_dir)
+            with open(self.path, 'a') as journal_file:
+                journal_file.write(json.dumps(entry, sort_keys=True) + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            self.entries[item] = entry
@@ -0,0 +1,70 @@
+# Small local HTTP endpoint for long running scripts
+# Serves a few read-only routes (e.g. /metrics in Prometheus text format and /status as json)
+# from a daemon thread, each route is a function returning (content type, body)
+
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4'
+JSON_TYPE = 'application/json'
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def parse_listen(value):
+    """ 'host:port' or just 'port' (localhost) -> (host, port) """
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def label_value(value):
+    """ Escape a Prometheus label value """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def sample(name, labels, value):
+    """ One Prometheus exposition line, labels is a dict """
+    if labels:
+        text = ','.join('%s="%s"' % (key, label_value(labels[key])) for key in sorted(labels))
+        return '%s{%s} %s' % (name, text, value)
+    return '%s %s' % (name, value)
+
+
+def serve(listen, routes):
+    """
+    Start serving routes (dict of path: function returning (content type, body)) on listen,
+    e.g. serve('127.0.0.1:9101', {'/metrics': metrics}), returns the server, stop it with shutdown()
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            route = routes.get(self.path.split('?', 1)[0])
+            if route is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            content_type, body = route()
+            body = body.encode('utf-8') if not isinstance(body, bytes) else body
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingServer(parse_listen(listen), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,244 @@
+# Bucket policy analysis
+# Each policy document is parsed once into normalized statements (principals, expanded
+# actions, restricting conditions) and cached by its text, then classified as public,
+# conditionally public (restricted by e.g. aws:SourceIp/aws:SourceVpce) or not public.
+# Public Deny statements are applied to the Allows whose resources they cover: unconditional
+# ones remove actions, negated conditions on restricting keys (StringNotEquals aws:SourceVpce ...)
+# restrict them. A Deny on only part of an Allow's resources leaves its actions exposed.
+
+import re
+import json
+import fnmatch
+from collections import namedtuple
+
+# actions used to expand wildcards like s3:Get* and NotAction, unknown actions are kept as written
+S3_ACTIONS = [
+    's3:AbortMultipartUpload', 's3:BypassGovernanceRetention', 's3:CreateBucket', 's3:DeleteBucket',
+    's3:DeleteBucketPolicy', 's3:DeleteBucketWebsite', 's3:DeleteObject', 's3:DeleteObjectTagging',
+    's3:DeleteObjectVersion', 's3:DeleteObjectVersionTagging', 's3:GetAccelerateConfiguration',
+    's3:GetAnalyticsConfiguration', 's3:GetBucketAcl', 's3:GetBucketCORS', 's3:GetBucketLocation',
+    's3:GetBucketLogging', 's3:GetBucketNotification', 's3:GetBucketObjectLockConfiguration',
+    's3:GetBucketPolicy', 's3:GetBucketPolicyStatus', 's3:GetBucketPublicAccessBlock',
+    's3:GetBucketRequestPayment', 's3:GetBucketTagging', 's3:GetBucketVersioning', 's3:GetBucketWebsite',
+    's3:GetEncryptionConfiguration', 's3:GetInventoryConfiguration', 's3:GetLifecycleConfiguration',
+    's3:GetMetricsConfiguration', 's3:GetObject', 's3:GetObjectAcl', 's3:GetObjectLegalHold',
+    's3:GetObjectRetention', 's3:GetObjectTagging', 's3:GetObjectTorrent', 's3:GetObjectVersion',
+    's3:GetObjectVersionAcl', 's3:GetObjectVersionTagging', 's3:GetObjectVersionTorrent',
+    's3:GetReplicationConfiguration', 's3:ListBucket', 's3:ListBucketMultipartUploads',
+    's3:ListBucketVersions', 's3:ListMultipartUploadParts', 's3:ObjectOwnerOverrideToBucketOwner',
+    's3:PutAccelerateConfiguration', 's3:PutAnalyticsConfiguration', 's3:PutBucketAcl', 's3:PutBucketCORS',
+    's3:PutBucketLogging', 's3:PutBucketNotification', 's3:PutBucketObjectLockConfiguration',
+    's3:PutBucketPolicy', 's3:PutBucketPublicAccessBlock', 's3:PutBucketRequestPayment',
+    's3:PutBucketTagging', 's3:PutBucketVersioning', 's3:PutBucketWebsite', 's3:PutEncryptionConfiguration',
+    's3:PutInventoryConfiguration', 's3:PutLifecycleConfiguration', 's3:PutMetricsConfiguration',
+    's3:PutObject', 's3:PutObjectAcl', 's3:PutObjectLegalHold', 's3:PutObjectRetention',
+    's3:PutObjectTagging', 's3:PutObjectVersionAcl', 's3:PutObjectVersionTagging',
+    's3:PutReplicationConfiguration', 's3:ReplicateDelete', 's3:ReplicateObject', 's3:ReplicateTags',
+    's3:RestoreObject',
+]
+ALL_ACTIONS = frozenset(action.lower() for action in S3_ACTIONS)
+CANONICAL = dict((action.lower(), action) for action in S3_ACTIONS)
+
+# condition keys that limit who can use a statement to a network, account or organization
+RESTRICTING_KEYS = frozenset(key.lower() for key in [
+    'aws:SourceIp', 'aws:SourceVpce', 'aws:SourceVpc', 'aws:SourceArn', 'aws:SourceAccount',
+    'aws:SourceOwner', 'aws:PrincipalOrgID', 'aws:PrincipalOrgPaths', 'aws:PrincipalAccount',
+    'aws:PrincipalArn', 'aws:userid', 'aws:username', 's3:DataAccessPointAccount', 's3:DataAccessPointArn',
+])
+OPEN_NETWORKS = frozenset(['0.0.0.0/0', '::/0'])
+
+PUBLIC = 'public'
+RESTRICTED = 'restricted'
+NOT_PUBLIC = 'not_public'
+
+# sid, effect, public principal?, raw principal, expanded actions, raw action, resource patterns,
+# restricting condition keys, and for Deny statements the keys of negated conditions (deny everyone except ...)
+Statement = namedtuple('Statement', ['sid', 'effect', 'public', 'principal', 'actions', 'raw_action',
+                                     'resources', 'restrictions', 'except_keys', 'conditional'])
+
+# one exposure per public Allow statement left after Deny statements are applied
+# actions is dict of action: frozenset of condition keys it is restricted by (empty = open to anyone)
+Exposure = namedtuple('Exposure', ['level', 'sid', 'principal', 'raw_action', 'actions', 'restrictions', 'complete'])
+
+_PATTERNS = {}
+_ANALYSES = {}
+MAX_CACHED = 50000
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def expand_action(pattern):
+    """ Expand one action pattern (s3:Get*) against S3_ACTIONS, cached """
+    pattern = pattern.lower()
+    if pattern not in _PATTERNS:
+        if pattern == '*' or pattern == 's3:*':
+            _PATTERNS[pattern] = ALL_ACTIONS
+        elif '*' in pattern or '?' in pattern:
+            regex = re.compile(fnmatch.translate(pattern))
+            matched = frozenset(action for action in ALL_ACTIONS if regex.match(action))
+            _PATTERNS[pattern] = matched or frozenset([pattern])
+        else:
+            _PATTERNS[pattern] = frozenset([pattern])
+    return _PATTERNS[pattern]
+
+
+def expand_actions(statement):
+    """ Expanded lowercase actions of a statement, NotAction is everything else """
+    actions = set()
+    for pattern in as_list(statement.get('Action')):
+        actions.update(expand_action(pattern))
+    if 'NotAction' in statement:
+        excluded = set()
+        for pattern in as_list(statement['NotAction']):
+            excluded.update(expand_action(pattern))
+        actions = set(ALL_ACTIONS) - excluded
+    return frozenset(actions)
+
+
+def action_name(action):
+    """ Original casing of an expanded (lowercase) action, s3:getobject -> s3:GetObject """
+    return CANONICAL.get(action, action)
+
+
+def is_public_principal(principal):
+    """ '*', {'AWS': '*'} and lists containing '*' or arn:aws:iam::*:root are public """
+    if principal is None:
+        return False
+    if not isinstance(principal, dict):
+        principal = {'AWS': principal}
+    for values in principal.values():
+        for value in as_list(values):
+            if value == '*' or value == 'arn:aws:iam::*:root':
+                return True
+    return False
+
+
+def condition_keys(condition, negated):
+    """
+    Restricting condition keys in a Condition block
+    negated=False finds positive tests (IpAddress aws:SourceIp 10.0.0.0/8) used to restrict an Allow,
+    negated=True finds tests like StringNotEquals aws:SourceVpce used by a Deny to allow only that source
+    Wildcard, open network and ...IfExists tests don't restrict anything
+    """
+    keys = set()
+    for operator, block in (condition or {}).items():
+        op = operator.lower()
+        if op.endswith('ifexists'):
+            continue
+        if op.startswith('forallvalues:') or op.startswith('foranyvalue:'):
+            op = op.split(':', 1)[1]
+        if ('not' in op) != negated or op == 'null' or op == 'bool':
+            continue
+        for key, values in block.items():
+            if key.lower() not in RESTRICTING_KEYS:
+                continue
+            values = [str(value) for value in as_list(values)]
+            if not values or '*' in values:
+                continue
+            if 'ipaddress' in op and OPEN_NETWORKS.intersection(values):
+                continue
+            keys.add(key)
+    return frozenset(keys)
+
+
+def statement_resources(statement):
+    """
+    Resource patterns of a statement, as written
+    NotResource (everything except ...) is '*' for an Allow and nothing for a Deny, so a Deny
+    with NotResource never counts as covering an Allow
+    """
+    if 'NotResource' in statement:
+        return ('*',) if statement.get('Effect', 'Allow') == 'Allow' else ()
+    return tuple(as_list(statement.get('Resource', '*')))
+
+
+def covers(deny, allow):
+    """ True if every resource pattern of the Allow matches one of the Deny's, arn:aws:s3:::b/* covers b/private/* """
+    return all(any(fnmatch.fnmatchcase(resource, pattern) for pattern in deny.resources)
+               for resource in allow.resources)
+
+
+def parse_statement(raw):
+    effect = raw.get('Effect', 'Allow')
+    if 'NotPrincipal' in raw:
+        # everyone except the listed principals, public for Allow, can't be narrowed for Deny
+        principal = {'NotPrincipal': raw['NotPrincipal']}
+        public = effect == 'Allow'
+    else:
+        principal = raw.get('Principal')
+        public = is_public_principal(principal)
+    condition = raw.get('Condition')
+    return Statement(
+        sid=raw.get('Sid', ''), effect=effect, public=public, principal=principal,
+        actions=expand_actions(raw), raw_action=raw.get('Action', raw.get('NotAction')),
+        resources=statement_resources(raw), restrictions=condition_keys(condition, False), except_keys=condition_keys(condition, True),
+        conditional=bool(condition))
+
+
+def parse_policy(policy):
+    """ List of Statements from a policy document (JSON text or already loaded dict) """
+    if not isinstance(policy, dict):
+        policy = json.loads(policy)
+    return [parse_statement(raw) for raw in as_list(policy.get('Statement'))]
+
+
+def evaluate(statements):
+    """
+    Apply public Deny statements to public Allow statements, returns list of Exposures
+    A Deny only applies to an Allow when it covers all of the Allow's resources
+    """
+    denies = [st for st in statements
+              if st.effect == 'Deny' and st.public and (not st.conditional or st.except_keys)]
+    exposures = []
+    for st in statements:
+        if st.effect != 'Allow' or not st.public:
+            continue
+        denied = set()
+        deny_except = {}
+        for deny in denies:
+            if not covers(deny, st):
+                continue
+            if not deny.conditional:
+                denied.update(deny.actions)
+            else:
+                for action in deny.actions:
+                    deny_except[action] = deny_except.get(action, frozenset()) | deny.except_keys
+        actions = {}
+        for action in st.actions:
+            if action in denied:
+                continue
+            actions[action] = st.restrictions | deny_except.get(action, frozenset())
+        if not actions:
+            continue
+        restrictions = frozenset().union(*actions.values())
+        level = PUBLIC if any(not keys for keys in actions.values()) else RESTRICTED
+        exposures.append(Exposure(level, st.sid, st.principal, st.raw_action, actions,
+                                  restrictions, len(actions) == len(st.actions)))
+    return exposures
+
+
+def analyze(policy_text):
+    """ Exposures for a policy document, cached by its text so shared policies are parsed once """
+    result = _ANALYSES.get(policy_text)
+    if result is None:
+        if len(_ANALYSES) >= MAX_CACHED:
+            _ANALYSES.clear()
+        result = evaluate(parse_policy(policy_text))
+        _ANALYSES[policy_text] = result
+    return result
+
+
+def classify(policy_text):
+    """ PUBLIC, RESTRICTED or NOT_PUBLIC for a whole policy """
+    levels = [exposure.level for exposure in analyze(policy_text)]
+    if PUBLIC in levels:
+        return PUBLIC
+    if RESTRICTED in levels:
+        return RESTRICTED
+    return NOT_PUBLIC
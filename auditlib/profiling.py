@@ -0,0 +1,265 @@
+# Optional timing and AWS call accounting for the audit scripts
+# Timers (a context manager and a decorator) keep a latency histogram per phase, botocore
+# event hooks count calls, retries, throttles and errors per service/operation, and the
+# report is written when the script exits. Off by default: phase() hands back a shared
+# no-op, timed() costs one attribute check, and no botocore hooks are registered.
+
+import sys
+import json
+import time
+import atexit
+import bisect
+import threading
+from functools import wraps
+
+# histogram bucket upper bounds in milliseconds, the last bucket is everything slower
+BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+# error codes AWS answers with when callers should slow down, shared with auditlib.s3clients
+THROTTLE_CODES = frozenset(['SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                            'TooManyRequestsException', 'ServiceUnavailable', 'RequestThrottled',
+                            'ProvisionedThroughputExceededException'])
+
+
+def add_arguments(parser):
+    """ Add --profile-report to a script's ArgumentParser """
+    parser.add_argument('--profile-report', nargs='?', const='-', default=None, metavar='FILE',
+                        help='time each phase and count AWS calls, report on stderr at exit '
+                             'or to FILE (json if it ends in .json)')
+
+
+class Histogram(object):
+    """ Count, total, max and log-spaced buckets of durations in seconds """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BOUNDS_MS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BOUNDS_MS, seconds * 1000.0)] += 1
+
+    def percentile(self, fraction):
+        """ Upper bound in ms of the bucket holding this fraction of the samples (max for the last one) """
+        rank = fraction * self.count
+        max_ms = round(self.max * 1000.0, 3)
+        seen = 0
+        for idx, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(BOUNDS_MS[idx], max_ms) if idx < len(BOUNDS_MS) else max_ms
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_s': round(self.total, 6),
+            'mean_ms': round(self.total * 1000.0 / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p90_ms': self.percentile(0.9),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max * 1000.0, 3),
+            'buckets': dict(('<=%dms' % bound if idx < len(BOUNDS_MS) else '>%dms' % BOUNDS_MS[-1], count)
+                            for idx, (bound, count) in enumerate(zip(BOUNDS_MS + (None,), self.buckets))
+                            if count),
+        }
+
+
+class NullTimer(object):
+    """ What phase() returns when profiling is off """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+class Timer(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.time() - self.start)
+        return False
+
+
+class Profiler(object):
+    """
+    Collects phase timings and AWS call counts, e.g.
+    PROFILE = Profiler()
+    @PROFILE.timed('dns lookup')
+    def lookup(name): ...
+    with PROFILE.phase('collect profiles'): ...
+    PROFILE.start('-') in main() turns it on, PROFILE.instrument(session) counts that session's calls
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.phases = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def start(self, destination='-'):
+        """ Turn profiling on and write the report to destination ('-' is stderr) at exit """
+        self.enabled = True
+        self.started = time.time()
+        atexit.register(self.write, destination)
+
+    def join(self, other):
+        """
+        Make another Profiler, e.g. the PROFILE of a script loaded by aws-audit.py, record into this one,
+        functions it already decorated with timed() included. Call after start()
+        """
+        other.enabled = self.enabled
+        other.started = self.started
+        other.phases = self.phases
+        other.calls = self.calls
+        other.lock = self.lock
+
+    def phase(self, name):
+        """ Context manager timing the block under name """
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def timed(self, name):
+        """ Decorator timing every call of the function under name """
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.time()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.time() - start)
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.phases:
+                self.phases[name] = Histogram()
+            self.phases[name].add(seconds)
+
+    def instrument(self, session):
+        """
+        Register the call counting hooks on a boto3 Session (before its clients are created),
+        does nothing while profiling is off, returns the session
+        """
+        if not self.enabled:
+            return session
+        session.events.register_first('before-parameter-build', self._before_call)
+        session.events.register('needs-retry', self._needs_retry)
+        session.events.register('after-call', self._after_call)
+        session.events.register('after-call-error', self._after_call_error)
+        return session
+
+    def _before_call(self, context=None, **kwargs):
+        if context is not None:
+            context['profile_start'] = time.time()
+
+    def _needs_retry(self, response=None, request_dict=None, **kwargs):
+        # sees every attempt, so throttles that are retried away are counted too
+        if not response or not request_dict:
+            return None
+        parsed = response[1] or {}
+        if parsed.get('Error', {}).get('Code') in THROTTLE_CODES:
+            context = request_dict.get('context', {})
+            context['profile_throttles'] = context.get('profile_throttles', 0) + 1
+        return None
+
+    def _after_call(self, http_response=None, parsed=None, model=None, context=None, **kwargs):
+        parsed = parsed or {}
+        context = context or {}
+        code = parsed.get('Error', {}).get('Code')
+        throttles = context.get('profile_throttles', 0)
+        if not throttles and code in THROTTLE_CODES:
+            throttles = 1
+        self._count(model, context, parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                    throttles, 1 if code else 0)
+
+    def _after_call_error(self, model=None, context=None, **kwargs):
+        context = context or {}
+        self._count(model, context, 0, context.get('profile_throttles', 0), 1)
+
+    def _count(self, model, context, retries, throttles, errors):
+        name = model.service_model.service_name + '.' + model.name if model else 'unknown'
+        start = context.get('profile_start')
+        with self.lock:
+            if name not in self.calls:
+                self.calls[name] = {'calls': 0, 'retries': 0, 'throttles': 0, 'errors': 0,
+                                    'latency': Histogram()}
+            counts = self.calls[name]
+            counts['calls'] += 1
+            counts['retries'] += retries
+            counts['throttles'] += throttles
+            counts['errors'] += errors
+            if start:
+                counts['latency'].add(time.time() - start)
+
+    def report(self):
+        """ dict of wall time, phase summaries and per operation call summaries """
+        with self.lock:
+            calls = {}
+            for name, counts in self.calls.items():
+                calls[name] = dict((key, value) for key, value in counts.items() if key != 'latency')
+                calls[name].update(counts['latency'].summary())
+                del calls[name]['count']
+            return {
+                'wall_s': round(time.time() - self.started, 3),
+                'phases': dict((name, histogram.summary()) for name, histogram in self.phases.items()),
+                'aws_calls': calls,
+            }
+
+    def format(self, report=None):
+        """ The report as an aligned text table """
+        report = report or self.report()
+        lines = ['profile report: %.3fs wall time' % report['wall_s']]
+        if report['phases']:
+            lines.append('%-32s %8s %10s %9s %9s %9s %9s %10s' % (
+                'phase', 'count', 'total s', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+            for name, phase in sorted(report['phases'].items(), key=lambda item: -item[1]['total_s']):
+                lines.append('%-32s %8d %10.3f %9.3f %9g %9g %9g %10.3f' % (
+                    name, phase['count'], phase['total_s'], phase['mean_ms'], phase['p50_ms'],
+                    phase['p90_ms'], phase['p99_ms'], phase['max_ms']))
+                lines.append('%-32s %s' % ('', ' '.join('%s:%d' % (bucket, count) for bucket, count in
+                                                       sorted(phase['buckets'].items(), key=bucket_order))))
+        if report['aws_calls']:
+            lines.append('%-40s %7s %7s %9s %7s %10s %9s %10s' % (
+                'aws call', 'calls', 'retries', 'throttles', 'errors', 'total s', 'p90 ms', 'max ms'))
+            for name, call in sorted(report['aws_calls'].items()):
+                lines.append('%-40s %7d %7d %9d %7d %10.3f %9g %10.3f' % (
+                    name, call['calls'], call['retries'], call['throttles'], call['errors'],
+                    call['total_s'], call['p90_ms'], call['max_ms']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, destination='-'):
+        """ Write the report to stderr ('-'), a .json file, or a text file """
+        if destination in (None, '-'):
+            sys.stderr.write(self.format())
+            return
+        with open(destination, 'w') as report_file:
+            if destination.endswith('.json'):
+                json.dump(self.report(), report_file, indent=2, sort_keys=True)
+                report_file.write('\n')
+            else:
+                report_file.write(self.format())
+
+
+def bucket_order(item):
+    bucket = item[0]
+    return int(bucket.strip('<=>ms')) + (1 if bucket.startswith('>') else 0)
@@ -0,0 +1,130 @@
+# Bounded-concurrency DNS resolution
+# gethostbyname_ex blocks for the full resolver latency, so records are resolved
+# on a thread pool and the results handed back as a dict for in-order auditing
+# add_arguments/from_args give the scripts the same resolver options, the chain
+# resolver (auditlib/dnschain.py) by default or the OS resolver
+
+import socket
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+from auditlib.dnschain import ChainResolver, DnsClient
+
+# resolver errors worth another attempt, anything else (e.g. NXDOMAIN) is final
+RETRY_ERRORS = [getattr(socket, 'EAI_AGAIN', -3)]
+FAILED = (False, False, False)
+
+
+def add_arguments(parser):
+    """ Add the DNS resolver arguments to a script's ArgumentParser """
+    parser.add_argument(
+        '--dns-timeout', default=5.0, type=float,
+        help='Seconds to wait for each DNS lookup, 0 to wait forever')
+    parser.add_argument(
+        '--dns-retries', default=2, type=int,
+        help='Retries for DNS lookups that time out or fail temporarily')
+    parser.add_argument(
+        '--resolver', default='chain', choices=['chain', 'system'],
+        help='chain (default) asks the nameservers and walks CNAME chains, reporting dangling records, '
+             'system uses the OS resolver like before')
+    parser.add_argument(
+        '--nameservers', default=None,
+        help='Comma separated nameservers for --resolver chain, host or host:port, default from /etc/resolv.conf')
+    parser.add_argument(
+        '--no-route53-seed', action='store_true',
+        help='Query every record instead of taking its CNAME target or addresses from Route53')
+
+
+def from_args(args, workers=20, profiler=None):
+    """
+    (DnsPool, ChainResolver or None) for the parsed resolver arguments
+    the resolver itself is timed as 'dns lookup' when a Profiler is given, apart from pool waits
+    """
+    chain = None
+    if args.resolver == 'chain':
+        nameservers = [server for server in (args.nameservers or '').replace(" ", "").split(",") if server]
+        chain = ChainResolver(DnsClient(nameservers, args.dns_timeout))
+        resolve = chain.gethostbyname_ex
+        # the client times out each query itself, no need for a watchdog thread per lookup
+        timeout = 0
+    else:
+        resolve = socket.gethostbyname_ex
+        timeout = args.dns_timeout
+    if profiler is not None:
+        resolve = profiler.timed('dns lookup')(resolve)
+    return DnsPool(workers, timeout, args.dns_retries, resolve), chain
+
+
+class DnsPool(object):
+    """
+    Resolve many names in parallel with a per-query timeout and retries, never more than
+    workers lookups running at once, counting ones a timeout gave up waiting for
+    resolve is any function shaped like socket.gethostbyname_ex (host, cnames, ips),
+    pass a stub to benchmark without network
+    """
+
+    def __init__(self, workers=20, timeout=5.0, retries=2, resolve=socket.gethostbyname_ex):
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.retries = max(0, int(retries))
+        self.resolve = resolve
+        # one per lookup thread still running, including ones a timeout gave up on
+        self.slots = threading.BoundedSemaphore(self.workers)
+
+    def _call(self, name):
+        """ Run resolve(name), raising socket.timeout if it takes longer than self.timeout """
+        if not self.timeout:
+            return self.resolve(name)
+        result = {}
+
+        def run():
+            try:
+                result['value'] = self.resolve(name)
+            except Exception as e:
+                result['error'] = e
+            finally:
+                self.slots.release()
+        # gethostbyname_ex can't be interrupted, so wait on it from a daemon thread
+        # an abandoned lookup keeps its slot until it returns, so retries wait for one to free
+        # up and no more than workers lookups are ever running
+        self.slots.acquire()
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            raise socket.timeout("timed out resolving " + name)
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def lookup(self, name):
+        """ Resolve one name, returns host, cnames, ips or False, False, False on failure """
+        for attempt in range(self.retries + 1):
+            try:
+                host, cnames, ipx = self._call(name)
+                return host, cnames, ipx
+            except socket.timeout as e:
+                logging.debug("attempt %d: %s", attempt + 1, e)
+            except socket.gaierror as e:
+                if e.args[0] not in RETRY_ERRORS:
+                    logging.debug("%s: %s", name, e)
+                    break
+                logging.debug("attempt %d: %s: %s", attempt + 1, name, e)
+            except Exception as e:
+                logging.debug("%s: %s", name, e)
+                break
+        return FAILED
+
+    def resolve_all(self, names):
+        """ Resolve a list of names concurrently, returns dict of name: (host, cnames, ips) """
+        unique = sorted(set(names))
+        if not unique:
+            return {}
+        pool = ThreadPool(min(self.workers, len(unique)))
+        try:
+            results = pool.map(self.lookup, unique, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(unique, results))
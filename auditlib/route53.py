@@ -0,0 +1,49 @@
+# Route53 inventory collection
+# Pages through every hosted zone and every record set exactly once,
+# splitting records by type in the same sweep
+
+import logging
+from collections import namedtuple
+
+RRTYPES = ('A', 'CNAME')
+
+# compact record: zone id, record name, type, its target(s) joined as one string, and whether
+# the zone is private (only answered inside its VPCs, so public DNS knows nothing about it)
+Record = namedtuple('Record', ['zone_id', 'name', 'rrtype', 'value', 'private'])
+Record.__new__.__defaults__ = (False,)
+
+
+def record_value(rrset):
+    """ Target of a record set, alias DNSName or sorted ResourceRecords values """
+    if 'AliasTarget' in rrset:
+        return 'ALIAS ' + rrset['AliasTarget']['DNSName']
+    values = [rr['Value'] for rr in rrset.get('ResourceRecords', [])]
+    return ','.join(sorted(values))
+
+
+def list_zones(client):
+    """ Yield every hosted zone, following pagination """
+    paginator = client.get_paginator('list_hosted_zones')
+    for page in paginator.paginate():
+        for zone in page['HostedZones']:
+            yield zone
+
+
+def zone_records(client, zone_id, rrtypes=RRTYPES, private=False):
+    """ Yield Records of the given types in a zone, following pagination """
+    paginator = client.get_paginator('list_resource_record_sets')
+    for page in paginator.paginate(HostedZoneId=zone_id):
+        for rrset in page['ResourceRecordSets']:
+            if rrset['Type'] in rrtypes:
+                yield Record(zone_id, rrset['Name'], rrset['Type'], record_value(rrset), private)
+
+
+def collect_records(client, rrtypes=RRTYPES):
+    """ Single pass over all zones, returns dict of rrtype: [Record] """
+    records = dict((rrtype, []) for rrtype in rrtypes)
+    for zone in list_zones(client):
+        logging.info("Retrieving R53 Zone: " + str(zone['Name']) + " " + str(zone['Id']))
+        private = zone.get('Config', {}).get('PrivateZone', False)
+        for rec in zone_records(client, zone['Id'], rrtypes, private):
+            records[rec.rrtype].append(rec)
+    return records
@@ -0,0 +1,109 @@
+# Region-aware s3 clients shared by the s3 scripts
+# A client for one region sends requests for buckets in other regions to the wrong
+# endpoint, costing a redirect (or a PermanentRedirect error) per call. The pool looks
+# up each bucket's region once, caches it, and hands out one client per region with a
+# connection pool sized for the script's worker threads and adaptive retries.
+
+import sys
+import threading
+import botocore
+from botocore.client import Config
+from auditlib.profiling import THROTTLE_CODES
+
+# us-east-1 buckets have no LocationConstraint and very old eu-west-1 buckets report 'EU'
+LOCATIONS = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}
+REDIRECT_CODES = frozenset(['PermanentRedirect', 'TemporaryRedirect', 'AuthorizationHeaderMalformed',
+                            'IllegalLocationConstraintException'])
+
+
+def client_config(pool_size=10, max_attempts=10):
+    """ s3v4 Config with max_pool_connections and adaptive retries (standard retries on older botocore) """
+    try:
+        return Config(signature_version='s3v4', max_pool_connections=pool_size,
+                      retries={'max_attempts': max_attempts, 'mode': 'adaptive'})
+    except botocore.exceptions.BotoCoreError:
+        return Config(signature_version='s3v4', max_pool_connections=pool_size,
+                      retries={'max_attempts': max_attempts})
+
+
+class S3ClientPool(object):
+    """
+    One s3 client per region from a single session, e.g.
+    pool = S3ClientPool(boto3.session.Session(), pool_size=20)
+    pool.bucket_client('my-bucket').get_bucket_acl(Bucket='my-bucket')
+    Safe to share between threads, clients are only created under the lock
+    """
+
+    def __init__(self, session, pool_size=10, max_attempts=10, default_region='us-east-1'):
+        self.session = session
+        self.config = client_config(max(10, pool_size), max_attempts)
+        self.default_region = default_region
+        self.clients = {}
+        self.regions = {}
+        self.counts = {'calls': 0, 'retries': 0, 'redirects': 0, 'throttles': 0, 'location_lookups': 0}
+        self.lock = threading.Lock()
+
+    def client(self, region=None):
+        """ Client for region, created on first use """
+        region = region or self.default_region
+        with self.lock:
+            if region not in self.clients:
+                client = self.session.client('s3', region_name=region, config=self.config)
+                client.meta.events.register('needs-retry.s3', self._count_response)
+                client.meta.events.register('after-call.s3', self._count_call)
+                self.clients[region] = client
+            return self.clients[region]
+
+    def set_region(self, bucket, region):
+        """ Remember a region found some other way, e.g. from a cached inventory """
+        with self.lock:
+            self.regions[bucket] = region
+
+    def region(self, bucket):
+        """ Bucket's region, from get_bucket_location the first time """
+        with self.lock:
+            if bucket in self.regions:
+                return self.regions[bucket]
+        location = self.client(self.default_region).get_bucket_location(Bucket=bucket)['LocationConstraint']
+        region = LOCATIONS.get(location, location)
+        with self.lock:
+            self.counts['location_lookups'] += 1
+            self.regions[bucket] = region
+        return region
+
+    def bucket_client(self, bucket):
+        """ Client in the bucket's own region """
+        return self.client(self.region(bucket))
+
+    def _count_response(self, response=None, attempts=None, **kwargs):
+        # needs-retry sees every response before the retry handlers decide, only count here
+        if not response:
+            return None
+        http_response, parsed = response
+        code = parsed.get('Error', {}).get('Code') if parsed else None
+        with self.lock:
+            if code in REDIRECT_CODES or getattr(http_response, 'status_code', None) in (301, 307):
+                self.counts['redirects'] += 1
+            elif code in THROTTLE_CODES:
+                self.counts['throttles'] += 1
+        return None
+
+    def _count_call(self, parsed=None, **kwargs):
+        retries = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        with self.lock:
+            self.counts['calls'] += 1
+            self.counts['retries'] += retries
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['regions'] = len(self.clients)
+            stats['buckets'] = len(self.regions)
+        return stats
+
+    def report(self, stream=None):
+        """ One line of client stats on stderr, so it stays out of the findings """
+        stream = stream or sys.stderr
+        stream.write("s3 clients: %(regions)d regions, %(buckets)d buckets (%(location_lookups)d location lookups), "
+                     "%(calls)d calls, %(retries)d retries, %(redirects)d redirects, %(throttles)d throttles\n"
+                     % self.stats())
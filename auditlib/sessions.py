@@ -0,0 +1,54 @@
+# One boto3 session per profile and one client per (profile, service, region) for a whole run
+# Creating a session reads the credentials and config files and loads botocore's data,
+# and every client brings its own connection pool, so scripts running several checks
+# (aws-audit.py) share them instead of each check starting over. boto3 and botocore
+# are only imported when the first session is created.
+
+import threading
+
+
+class SessionPool(object):
+    """
+    e.g. SESSIONS = SessionPool(PROFILE)
+    SESSIONS.client('prod', 'route53').list_hosted_zones()
+    SESSIONS.s3('prod', 20).bucket_client('my-bucket')
+    profile None uses the default credential chain (AWS_PROFILE etc), sessions are instrumented
+    with the Profiler if one is given. Safe to share between threads, sessions and clients are never
+    shared between profiles, so each profile can be collected in its own thread
+    """
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.sessions = {}
+        self.clients = {}
+        self.s3_pools = {}
+        self.lock = threading.Lock()
+
+    def session(self, profile=None):
+        """ boto3 Session for profile, created on first use """
+        with self.lock:
+            if profile not in self.sessions:
+                import boto3
+                session = boto3.Session(profile_name=profile)
+                if self.profiler is not None:
+                    session = self.profiler.instrument(session)
+                self.sessions[profile] = session
+            return self.sessions[profile]
+
+    def client(self, profile, service, region=None):
+        """ Client for profile and service (in region, default the profile's), created on first use """
+        key = (profile, service, region)
+        session = self.session(profile)
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = session.client(service, region_name=region) if region else session.client(service)
+            return self.clients[key]
+
+    def s3(self, profile=None, pool_size=10):
+        """ S3ClientPool for profile, one client per region and one region lookup per bucket for the run """
+        from auditlib.s3clients import S3ClientPool
+        session = self.session(profile)
+        with self.lock:
+            if profile not in self.s3_pools:
+                self.s3_pools[profile] = S3ClientPool(session, pool_size)
+            return self.s3_pools[profile]
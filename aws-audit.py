@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+# Run the audits in one process and one report, e.g. the nightly s3ListPublic.py, s3Tag.py
+# (audit only) and cloudfront-subdomain-audit.py for several accounts
+#   s3-public   buckets with public ACLs or policies, as s3ListPublic.py
+#   s3-tags     tags of every bucket, as s3Tag.py --addtags no
+#   cloudfront  Route53 records pointing at CloudFront without a registered alias, as cloudfront-subdomain-audit.py
+# Each profile gets one boto3 session and one set of clients for all checks, its buckets (and their
+# regions), CloudFront distributions and Route53 zones are listed once and handed to the checks that
+# need them, and a check's script (with its policy or DNS code) is only loaded when it is selected.
+# Findings keep the script name of the check in jsonl/csv output, a summary per check ends the report
+# ./aws-audit.py --profiles 'dev,stage,prod' all
+# ./aws-audit.py --profiles dev --match 'static-*' s3-public s3-tags --output jsonl
+
+import os
+import imp
+import time
+import logging
+import argparse
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from auditlib import discovery
+from auditlib import findings
+from auditlib import profiling
+from auditlib import resolver
+from auditlib.cache import FileCache, parse_max_age
+from auditlib.sessions import SessionPool
+
+PARSER = argparse.ArgumentParser()
+PARSER.add_argument(
+    'checks', nargs='+', metavar='CHECK', choices=['s3-public', 's3-tags', 'cloudfront', 'all'],
+    help='s3-public, s3-tags, cloudfront or all, run in that order')
+PARSER.add_argument(
+    '--profiles', default='default',
+    help='List of comma separated aws profiles "dev,stage,prod"')
+PARSER.add_argument(
+    '--profile-workers', default=8, type=int,
+    help='Number of AWS profiles to list buckets, distributions and zones from at once')
+PARSER.add_argument(
+    '-w', '--workers', default=20, type=int,
+    help='Number of buckets scanned and DNS lookups at once')
+PARSER.add_argument(
+    '-l', '--log', default='ERROR',
+    help='loglevel, eg DEBUG, INFO (shows inventory and cache stats), WARNING, ERROR')
+discovery.add_arguments(PARSER)
+resolver.add_arguments(PARSER)
+findings.add_arguments(PARSER)
+profiling.add_arguments(PARSER)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# phase timings and AWS call counts for every check, only collected with --profile-report
+PROFILE = profiling.Profiler()
+
+# sessions and clients of every profile, shared by all checks
+SESSIONS = SessionPool(PROFILE)
+
+def load_script(script):
+    """ Import one of the audit scripts next to this one as a module, without running its main() """
+    module = imp.load_source(script.replace('-', '_'), os.path.join(ROOT, script + '.py'))
+    # the script's timers and botocore hooks report into this run's profile
+    PROFILE.join(module.PROFILE)
+    return module
+
+def collect_profile(profile, modules, args, cache=None):
+    """
+    List what the selected checks need from one profile, once
+    returns dict with 'buckets': [bucket names] and/or 'cloudfront': (cf_aliases, records)
+    """
+    found = {}
+    if 's3-public' in modules or 's3-tags' in modules:
+        clients = SESSIONS.s3(profile, args.workers)
+        # with a cache, regions are loaded up front and seed the client pool for both s3 checks
+        buckets = discovery.discover(clients, args.match, args.bucket_region,
+                                     discovery.parse_tag_filters(args.bucket_tag), cache, args.workers,
+                                     profile, cache is not None)
+        found['buckets'] = [bucket.name for bucket in buckets]
+    if 'cloudfront' in modules:
+        found['cloudfront'] = modules['cloudfront'].collect_profile(profile, cache)
+    return found
+
+def collect_inventory(profiles, modules, args, cache=None):
+    """ Collect all profiles concurrently, returns OrderedDict of profile: collect_profile() """
+    pool = ThreadPool(max(1, min(args.profile_workers, len(profiles))))
+    try:
+        results = pool.map(lambda profile: collect_profile(profile, modules, args, cache), profiles, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return OrderedDict(zip(profiles, results))
+
+def s3_public(module, inventory, writer, args, cache=None):
+    """ ACL and policy findings for every profile's buckets """
+    for profile in inventory:
+        clients = SESSIONS.s3(profile, args.workers)
+        for bucket, bucket_findings in module.scanBuckets(clients, inventory[profile]['buckets'], args.workers):
+            for severity, finding in bucket_findings:
+                writer.emit(bucket, severity, finding, profile)
+
+def s3_tags(module, inventory, writer, args, cache=None):
+    """ Tags of every profile's buckets, nothing is changed """
+    module.FINDINGS = writer
+    for profile in inventory:
+        buckets = inventory[profile]['buckets']
+        if not buckets:
+            writer.note("No buckets found in " + profile)
+            continue
+        writer.profile = profile
+        module.printTags(buckets, module.fetchTags(SESSIONS.s3(profile, args.workers), buckets, args.workers))
+
+def cloudfront(module, inventory, writer, args, cache=None):
+    """ Subdomain takeover findings for every profile's records against the CF aliases of all of them """
+    module.FINDINGS = writer
+    with PROFILE.phase('cloudfront ips'):
+        cfcidrblocks = module.PrefixIndex(module.get_cf_blks(cache))
+    dns, chain = resolver.from_args(args, args.workers, PROFILE)
+    records = OrderedDict((profile, inventory[profile]['cloudfront']) for profile in inventory)
+    module.audit_inventory(records, cfcidrblocks, dns, chain, not args.no_route53_seed)
+
+# check: (script it runs the code of, function running it on the inventory)
+CHECKS = OrderedDict([
+    ('s3-public', ('s3ListPublic', s3_public)),
+    ('s3-tags', ('s3Tag', s3_tags)),
+    ('cloudfront', ('cloudfront-subdomain-audit', cloudfront)),
+])
+
+def summary(results, profiles):
+    """ One line per check with its findings per profile and severity, results is [(check, writer, seconds)] """
+    lines = []
+    for check, writer, elapsed in results:
+        per_profile = []
+        for profile in profiles:
+            counts = sorted((severity, count) for (found_in, severity), count in writer.counts.items()
+                            if found_in == profile)
+            per_profile.append(profile + ": " + (", ".join("%d %s" % (count, severity) for severity, count in counts)
+                                                 or "none"))
+        lines.append("SUMMARY: %s: %d findings in %.1fs (%s)" % (check, writer.count, elapsed, "; ".join(per_profile)))
+    return lines
+
+def main():
+    """
+    Lists every profile's inventory once for the selected checks, runs them in order
+    on one session pool, and ends the combined report with a summary
+    """
+    args = PARSER.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.WARN))
+    logging.getLogger('boto3').setLevel(logging.WARN)
+    logging.getLogger('botocore').setLevel(logging.WARN)
+    if args.profile_report:
+        PROFILE.start(args.profile_report)
+    checks = [check for check in CHECKS if check in args.checks or 'all' in args.checks]
+    profiles = args.profiles.replace(" ", "").split(",")
+    report = findings.from_args(args, 'aws-audit')
+    cache = None
+    if args.cache_dir:
+        cache = FileCache(args.cache_dir, parse_max_age(args.max_age), args.refresh)
+
+    modules = OrderedDict((check, load_script(CHECKS[check][0])) for check in checks)
+    if 'cloudfront' in modules:
+        modules['cloudfront'].SESSIONS = SESSIONS
+    report.note("Collecting inventory for " + ", ".join(checks) + " from AWS profiles: " + ", ".join(profiles))
+    start = time.time()
+    with PROFILE.phase('collect inventory'):
+        inventory = collect_inventory(profiles, modules, args, cache)
+    logging.info("Collected %d profiles in %.1fs", len(profiles), time.time() - start)
+    if cache:
+        logging.info(cache.stats())
+
+    results = []
+    for check in checks:
+        report.note("Running " + check)
+        script, run = CHECKS[check]
+        writer = report.scoped(script)
+        start = time.time()
+        with PROFILE.phase(check):
+            run(modules[check], inventory, writer, args, cache)
+        results.append((check, writer, time.time() - start))
+    for line in summary(results, profiles):
+        report.note(line)
+    for clients in SESSIONS.s3_pools.values():
+        clients.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Benchmark: CloudFront alias loading and lookup
+# Pages thousands of stubbed distributions through iter_aliases() with botocore's Stubber,
+# checks every alias comes back (empty pages and wildcard aliases included),
+# then compares list membership (the old cf_aliases list) with AliasSet lookups
+# ./bench/bench_cfaliases.py --distributions 5000 --lookups 40000
+
+import os
+import sys
+import random
+import argparse
+import timeit
+import warnings
+import boto3
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auditlib.cloudfront import AliasSet, iter_aliases
+from synthetic import distribution
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--distributions', default=5000, type=int)
+parser.add_argument('--page-size', default=100, type=int, help='MaxItems per list_distributions page')
+parser.add_argument('--lookups', default=40000, type=int, help='record names to look up')
+parser.add_argument('--seed', default=1, type=int)
+
+
+def stubbed_client(dists, page_size):
+    client = boto3.client('cloudfront', region_name='us-east-1',
+                          aws_access_key_id='bench', aws_secret_access_key='bench')
+    stubber = Stubber(client)
+    pages = [dists[i:i + page_size] for i in range(0, len(dists), page_size)] or [[]]
+    for num, page in enumerate(pages):
+        marker = str(num) if num else ''
+        dist_list = {'Marker': marker, 'MaxItems': page_size, 'IsTruncated': num + 1 < len(pages), 'Quantity': len(page)}
+        if page:
+            dist_list['Items'] = page
+        if num + 1 < len(pages):
+            dist_list['NextMarker'] = str(num + 1)
+        stubber.add_response('list_distributions', {'DistributionList': dist_list},
+                             {'Marker': marker} if num else {})
+    stubber.activate()
+    return client, stubber
+
+
+def main():
+    warnings.simplefilter('ignore')
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    dists = []
+    expected = []
+    for idx in range(args.distributions):
+        roll = rnd.random()
+        if roll < 0.1:
+            aliases = []
+        elif roll < 0.2:
+            aliases = ['*.wild%d.example.com' % idx]
+        else:
+            aliases = ['site%d-%d.example.com' % (idx, n) for n in range(rnd.randint(1, 3))]
+        expected.extend(aliases)
+        dists.append(distribution(idx, aliases))
+
+    client, stubber = stubbed_client(dists, args.page_size)
+    start = timeit.default_timer()
+    loaded = list(iter_aliases(client))
+    load_time = timeit.default_timer() - start
+    stubber.assert_no_pending_responses()
+    if sorted(loaded) != sorted(expected):
+        sys.exit("MISMATCH: loaded %d aliases, expected %d" % (len(loaded), len(expected)))
+
+    empty_client, empty_stubber = stubbed_client([], args.page_size)
+    if list(iter_aliases(empty_client)):
+        sys.exit("MISMATCH: account without distributions returned aliases")
+
+    names = []
+    for _ in range(args.lookups):
+        idx = rnd.randrange(args.distributions)
+        names.append(rnd.choice(['site%d-0.example.com' % idx, 'www.wild%d.example.com' % idx,
+                                 'wild%d.example.com' % idx, 'missing%d.example.com' % idx]))
+    start = timeit.default_timer()
+    alias_list = list(set(loaded))
+    list_hits = sum(1 for name in names if name in alias_list)
+    list_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    alias_set = AliasSet(loaded)
+    set_hits = sum(1 for name in names if name in alias_set)
+    set_time = timeit.default_timer() - start
+
+    wildcard_hits = sum(1 for name in names if name.startswith('www.wild') and name in alias_set)
+    if any(name in alias_set for name in names if name.startswith('missing')):
+        sys.exit("MISMATCH: missing name matched")
+
+    pages = (len(dists) + args.page_size - 1) // args.page_size
+    print("distributions: %d aliases: %d pages: %d" % (len(dists), len(loaded), pages))
+    print("paginated load:  %8.3fs" % load_time)
+    print("list lookups:    %8.3fs  %d hits" % (list_time, list_hits))
+    print("AliasSet:        %8.3fs  %d hits (%d via wildcard)  (%.0fx)" % (set_time, set_hits, wildcard_hits, list_time / set_time))
+
+if __name__ == '__main__':
+    main()
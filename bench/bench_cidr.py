@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Benchmark: cidr-convert.py on a synthetic country IP feed, old expansion vs compaction
+# The old code expanded every block on its own (a /25 became 128 /32 lines) without merging
+# duplicate, overlapping or adjacent blocks. Both must cover exactly the same addresses.
+# ./bench/bench_cidr.py --blocks 50000
+
+import os
+import sys
+import random
+import argparse
+import timeit
+import netaddr
+from ipaddress import ip_network
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auditlib import iprange
+from synthetic import synthetic_feed
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--blocks', default=50000, type=int)
+parser.add_argument('--countries', default=40, type=int)
+parser.add_argument('--seed', default=1, type=int)
+
+def legacy_expand(lines):
+    """ The old per-line expansion, returns the output lines """
+    output = []
+    for line in lines:
+        country, ip_addr, mask = line.rstrip().replace('/', ',').split(',')
+        block = str(ip_addr + '/' + mask)
+        mask = int(mask)
+        if mask in [8, 16, 24, 32]:
+            output.append(block)
+        elif mask > 24 and mask < 32:
+            for ip in netaddr.IPNetwork(block):
+                output.append('%s/32' % ip)
+        else:
+            new_prefix = 24 if mask > 16 else 16 if mask > 8 else 8
+            output.extend(str(net) for net in list(ip_network(u'' + block).subnets(new_prefix=new_prefix)))
+    return output
+
+
+def covered(blocks):
+    ranges = []
+    for blk in blocks:
+        version, first, last = iprange.block_to_range(blk)
+        ranges.append((first, last))
+    return iprange.merge_ranges(ranges)
+
+
+def main():
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    lines = synthetic_feed(args.blocks, args.countries, rnd)
+
+    start = timeit.default_timer()
+    legacy = legacy_expand(lines)
+    legacy_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    compacted = list(iprange.compact_blocks(line.split(',', 1)[1] for line in lines))
+    compact_time = timeit.default_timer() - start
+
+    if covered(legacy) != covered(compacted):
+        sys.exit("MISMATCH between old and compacted address coverage")
+
+    print("input lines: %d" % len(lines))
+    print("old expansion: %8.3fs  %8d entries (%d distinct)" % (legacy_time, len(legacy), len(set(legacy))))
+    print("compacted:     %8.3fs  %8d entries  (%.1fx fewer, %.1fx faster)" % (
+        compact_time, len(compacted), float(len(legacy)) / len(compacted), legacy_time / compact_time))
+
+if __name__ == '__main__':
+    main()
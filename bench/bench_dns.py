@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# Benchmark: serial resolution, one gethostbyname_ex at a time, vs DnsPool, against a stub resolver
+# The stub sleeps to simulate resolver latency, no network is used
+# ./bench/bench_dns.py --records 2000 --latency 0.02 --workers 50
+
+import os
+import sys
+import random
+import socket
+import time
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auditlib.resolver import DnsPool
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', default=2000, type=int, help='number of records to resolve')
+parser.add_argument('--latency', default=0.02, type=float, help='simulated seconds per lookup')
+parser.add_argument('--workers', default=50, type=int)
+parser.add_argument('--seed', default=1, type=int)
+
+
+def stub_resolver(latency, rnd):
+    """ Return a gethostbyname_ex stand-in answering from a synthetic zone """
+    def resolve(name):
+        time.sleep(latency)
+        if name.startswith('gone'):
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        if name.startswith('cf'):
+            return 'd%s.cloudfront.net' % name[:6], [name], ['13.32.%d.%d' % (len(name), rnd.randint(1, 254))]
+        return name, [], ['10.0.%d.%d' % (len(name) % 255, rnd.randint(1, 254))]
+    return resolve
+
+
+def serial(names, resolve):
+    results = {}
+    for name in sorted(names):
+        try:
+            results[name] = resolve(name)
+        except Exception:
+            results[name] = (False, False, False)
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    prefixes = ['www', 'api', 'cf', 'gone', 'static']
+    names = ['%s%d.example.com' % (rnd.choice(prefixes), i) for i in range(args.records)]
+    resolve = stub_resolver(args.latency, rnd)
+
+    start = timeit.default_timer()
+    expected = serial(names, resolve)
+    serial_time = timeit.default_timer() - start
+
+    dns = DnsPool(workers=args.workers, timeout=max(1.0, args.latency * 10), retries=0, resolve=resolve)
+    start = timeit.default_timer()
+    resolved = dns.resolve_all(names)
+    pool_time = timeit.default_timer() - start
+
+    if sorted(resolved) != sorted(expected) or \
+            [bool(resolved[n][2]) for n in sorted(names)] != [bool(expected[n][2]) for n in sorted(names)]:
+        sys.exit("MISMATCH between serial and DnsPool results")
+
+    print("records: %d latency: %.3fs workers: %d" % (len(names), args.latency, args.workers))
+    print("serial:   %8.3fs  %8.0f lookups/s" % (serial_time, len(names) / serial_time))
+    print("DnsPool:  %8.3fs  %8.0f lookups/s  (%.1fx)" % (pool_time, len(names) / pool_time, serial_time / pool_time))
+
+if __name__ == '__main__':
+    main()
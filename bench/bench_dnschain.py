@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Benchmark: one uncached lookup per record (gethostbyname_ex against a resolver) vs ChainResolver
+# Both ask a local FakeDns server built from a synthetic account, no network is used. The chain
+# resolver shares one TTL cache across records and takes each record's target or addresses from
+# Route53, so records sharing a target cost one query. Both must agree on every answer, and the chain resolver
+# must report exactly the dangling records the account was generated with.
+# ./bench/bench_dnschain.py --zones 100 --records 100 --latency 0.005 --workers 50
+
+import os
+import sys
+import random
+import socket
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auditlib.resolver import DnsPool
+from auditlib.dnschain import ChainResolver, DnsClient
+from fakedns import FakeDns
+import synthetic
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--zones', default=100, type=int)
+parser.add_argument('--records', default=100, type=int, help='records per zone')
+parser.add_argument('--latency', default=0.005, type=float, help='simulated seconds per query')
+parser.add_argument('--workers', default=50, type=int)
+parser.add_argument('--seed', default=1, type=int)
+
+
+def flat_lookup(client):
+    """ What gethostbyname_ex does: one recursive query per name, chain flattened, no cache """
+    def resolve(name):
+        message = client.query(name)
+        cnames = [rr.name for rr in message.answers if rr.rrtype == 'CNAME']
+        ips = [rr.value for rr in message.answers if rr.rrtype == 'A']
+        if not ips:
+            raise socket.gaierror(getattr(socket, 'EAI_NONAME', -2), 'Name or service not known')
+        host = [rr.value for rr in message.answers if rr.rrtype == 'CNAME'][-1] if cnames else name
+        return host, cnames, ips
+    return resolve
+
+
+def main():
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    zones, distributions, answers = synthetic.synthetic_account('b', args.zones, args.records, rnd)
+    fake = FakeDns(synthetic.dns_zone(zones, answers), args.latency).start()
+    names = [rrset['Name'].rstrip('.') for zone in zones for rrset in zone['records'] if rrset['Type'] in ('A', 'CNAME')]
+    dangling = set(name for zone in zones for rrset in zone['records']
+                   if rrset['Type'] == 'CNAME' and rrset['Name'].rstrip('.') not in answers
+                   for name in [rrset['Name'].rstrip('.')])
+
+    start = timeit.default_timer()
+    flat = DnsPool(args.workers, 0, 0, flat_lookup(DnsClient([fake.address()]))).resolve_all(names)
+    flat_time = timeit.default_timer() - start
+    flat_queries = fake.queries
+
+    chain = ChainResolver(DnsClient([fake.address()]))
+    # what seed_records() in cloudfront-subdomain-audit.py does with the Route53 inventory
+    for zone in zones:
+        for rrset in zone['records']:
+            if rrset['Type'] == 'CNAME':
+                chain.seed(rrset['Name'], target=rrset['ResourceRecords'][0]['Value'])
+            elif rrset['Type'] == 'A' and 'ResourceRecords' in rrset:
+                chain.seed(rrset['Name'], ips=[rr['Value'] for rr in rrset['ResourceRecords']])
+    start = timeit.default_timer()
+    chained = DnsPool(args.workers, 0, 0, chain.gethostbyname_ex).resolve_all(names)
+    chain_time = timeit.default_timer() - start
+    chain_queries = fake.queries - flat_queries
+    fake.stop()
+
+    found = set(name for name, (host, cnames, ips) in chained.items() if cnames and not ips)
+    if found != dangling:
+        sys.exit("MISMATCH dangling records: %d found, %d generated" % (len(found), len(dangling)))
+    for name in names:
+        if name not in dangling and chained[name][2] != flat[name][2]:
+            sys.exit("MISMATCH answers for " + name)
+
+    print("records: %d dangling: %d latency: %.3fs workers: %d" % (len(names), len(dangling), args.latency, args.workers))
+    print("flat lookups:  %8.3fs  %6d queries  (dangling records look like any failure)" % (flat_time, flat_queries))
+    print("chain cache:   %8.3fs  %6d queries  (%.1fx fewer, %.1fx faster)" % (
+        chain_time, chain_queries, float(flat_queries) / max(1, chain_queries), flat_time / chain_time))
+    print(chain.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Micro-benchmark: CloudFront IP matching, original ip_in_block() loop vs PrefixIndex
+# Runs offline against synthetic CIDR blocks, checks both give the same answers
+# ./bench/bench_ipmatch.py --ips 20000 --blocks 100
+
+import os
+import sys
+import random
+import argparse
+import timeit
+import netaddr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auditlib.iprange import PrefixIndex
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--ips', default=20000, type=int, help='number of resolved IPs to classify')
+parser.add_argument('--blocks', default=100, type=int, help='number of synthetic CIDR blocks')
+parser.add_argument('--seed', default=1, type=int)
+
+
+def legacy_ip_in_block(ips, blocks):
+    """ The original loop from cloudfront-subdomain-audit.py """
+    in_block = 'no'
+    for ip in ips:
+        for blk in blocks:
+            if netaddr.IPAddress(ip) in netaddr.IPNetwork(blk):
+                in_block = 'yes'
+    return in_block
+
+
+def synthetic_blocks(count, rnd):
+    blocks = []
+    for _ in range(count):
+        if rnd.random() < 0.8:
+            mask = rnd.choice([13, 15, 16, 18, 19, 20, 22, 24])
+            addr = netaddr.IPAddress(rnd.randint(0x01000000, 0xdfffffff))
+            blocks.append(str(netaddr.IPNetwork('%s/%d' % (addr, mask)).cidr))
+        else:
+            addr = netaddr.IPAddress(rnd.getrandbits(128) | (0x2600 << 112), 6)
+            blocks.append(str(netaddr.IPNetwork('%s/%d' % (addr, rnd.choice([32, 40, 48]))).cidr))
+    return blocks
+
+
+def synthetic_ips(count, blocks, rnd):
+    ips = []
+    for _ in range(count):
+        if rnd.random() < 0.3:
+            net = netaddr.IPNetwork(rnd.choice(blocks))
+            ips.append(str(netaddr.IPAddress(rnd.randint(net.first, net.last), net.version)))
+        else:
+            ips.append(str(netaddr.IPAddress(rnd.randint(0x01000000, 0xdfffffff))))
+    return ips
+
+
+def main():
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    blocks = synthetic_blocks(args.blocks, rnd)
+    ips = synthetic_ips(args.ips, blocks, rnd)
+
+    start = timeit.default_timer()
+    legacy = [legacy_ip_in_block([ip], blocks) == 'yes' for ip in ips]
+    legacy_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    index = PrefixIndex(blocks)
+    build_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    single = [ip in index for ip in ips]
+    single_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    batch = index.classify(ips)
+    batch_time = timeit.default_timer() - start
+
+    if legacy != single or legacy != [batch[ip] for ip in ips]:
+        sys.exit("MISMATCH between legacy loop and PrefixIndex results")
+
+    print("blocks: %d (%d merged ranges) ips: %d matches: %d" % (len(blocks), len(index), len(ips), sum(legacy)))
+    print("legacy loop:       %8.3fs" % legacy_time)
+    print("index build:       %8.3fs" % build_time)
+    print("index per-ip:      %8.3fs  (%.0fx)" % (single_time, legacy_time / single_time))
+    print("index batch:       %8.3fs  (%.0fx)" % (batch_time, legacy_time / batch_time))
+
+if __name__ == '__main__':
+    main()
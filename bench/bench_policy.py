@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Benchmark: bucket policy analysis throughput over a synthetic policy corpus
+# Compares the old Principal == '*' check with auditlib.policy, cold (every policy parsed)
+# and warm (policies seen before come from the cache), and counts what each one flags
+# The hand written CASES are classified first and the run stops if one doesn't match
+# ./bench/bench_policy.py --policies 20000
+
+import os
+import sys
+import json
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auditlib import policy
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--policies', default=20000, type=int)
+parser.add_argument('--templates', default=200, type=int, help='distinct policy shapes, the rest only differ by bucket name')
+parser.add_argument('--seed', default=1, type=int)
+
+PRINCIPALS = ['*', {'AWS': '*'}, {'AWS': ['arn:aws:iam::123456789012:root', '*']},
+              {'AWS': 'arn:aws:iam::123456789012:root'}, {'Service': 'cloudfront.amazonaws.com'}]
+ACTIONS = ['s3:GetObject', ['s3:GetObject', 's3:ListBucket'], 's3:Get*', 's3:*', ['s3:PutObject', 's3:PutObjectAcl']]
+CONDITIONS = [None, None, None, {'IpAddress': {'aws:SourceIp': ['10.0.0.0/8', '192.168.0.0/16']}},
+              {'StringEquals': {'aws:SourceVpce': 'vpce-1a2b3c4d'}}, {'Bool': {'aws:SecureTransport': 'true'}}]
+
+# (name, statements, expected classification)
+CASES = [
+    ('public read', [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::b/*'}],
+     policy.PUBLIC),
+    ('deny on a prefix of the allow', [
+        {'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::b/*'},
+        {'Effect': 'Deny', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::b/private/*'}],
+     policy.PUBLIC),
+    ('deny covering the allow', [
+        {'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::b/public/*'},
+        {'Effect': 'Deny', 'Principal': '*', 'Action': 's3:*', 'Resource': 'arn:aws:s3:::b/*'}],
+     policy.NOT_PUBLIC),
+    ('deny with NotResource', [
+        {'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::b/*'},
+        {'Effect': 'Deny', 'Principal': '*', 'Action': 's3:GetObject', 'NotResource': 'arn:aws:s3:::b/public/*'}],
+     policy.PUBLIC),
+    ('vpce only deny on part of the allow', [
+        {'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': ['arn:aws:s3:::b', 'arn:aws:s3:::b/*']},
+        {'Effect': 'Deny', 'Principal': '*', 'Action': 's3:*', 'Resource': 'arn:aws:s3:::b/*',
+         'Condition': {'StringNotEquals': {'aws:SourceVpce': 'vpce-1a2b3c4d'}}}],
+     policy.PUBLIC),
+    ('vpce only deny covering the allow', [
+        {'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::b/*'},
+        {'Effect': 'Deny', 'Principal': '*', 'Action': 's3:*', 'Resource': ['arn:aws:s3:::b', 'arn:aws:s3:::b/*'],
+         'Condition': {'StringNotEquals': {'aws:SourceVpce': 'vpce-1a2b3c4d'}}}],
+     policy.RESTRICTED),
+]
+
+
+def check_cases():
+    """ Names of the CASES classified differently than expected """
+    failed = []
+    for name, statements, expected in CASES:
+        level = policy.classify(json.dumps({'Version': '2012-10-17', 'Statement': statements}))
+        if level != expected:
+            failed.append("%s: %s, expected %s" % (name, level, expected))
+    return failed
+
+
+def synthetic_statement(rnd, bucket):
+    statement = {'Sid': 'S%d' % rnd.randint(0, 99), 'Effect': 'Allow', 'Principal': rnd.choice(PRINCIPALS),
+                 'Action': rnd.choice(ACTIONS), 'Resource': ['arn:aws:s3:::%s' % bucket, 'arn:aws:s3:::%s/*' % bucket]}
+    condition = rnd.choice(CONDITIONS)
+    if condition:
+        statement['Condition'] = condition
+    return statement
+
+
+def synthetic_corpus(count, templates, rnd):
+    shapes = []
+    for _ in range(templates):
+        statements = [synthetic_statement(rnd, 'BUCKET') for _ in range(rnd.randint(1, 4))]
+        if rnd.random() < 0.2:
+            statements.append({'Effect': 'Deny', 'Principal': '*', 'Action': 's3:*', 'Resource': 'arn:aws:s3:::BUCKET/*',
+                               'Condition': {'StringNotEquals': {'aws:SourceVpce': 'vpce-1a2b3c4d'}}})
+        shapes.append(json.dumps({'Version': '2012-10-17', 'Statement': statements}))
+    # each bucket shows up about 4 times, like a policy checked on every scan
+    buckets = count // 4 or 1
+    return [shapes[(idx % buckets) % len(shapes)].replace('BUCKET', 'bucket-%d' % (idx % buckets)) for idx in range(count)]
+
+
+def legacy_check(policy_text):
+    flagged = 0
+    for p in json.loads(policy_text).get('Statement', []):
+        if p['Principal'] == '*':
+            flagged += 1
+    return flagged
+
+
+def main():
+    args = parser.parse_args()
+    failed = check_cases()
+    if failed:
+        sys.exit("policy cases failed:\n" + "\n".join(failed))
+    print("policy cases: %d ok" % len(CASES))
+    rnd = random.Random(args.seed)
+    corpus = synthetic_corpus(args.policies, args.templates, rnd)
+
+    start = timeit.default_timer()
+    legacy_flagged = sum(1 for text in corpus if legacy_check(text))
+    legacy_time = timeit.default_timer() - start
+
+    policy._ANALYSES.clear()
+    policy._PATTERNS.clear()
+    start = timeit.default_timer()
+    levels = [policy.classify(text) for text in corpus]
+    cold_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    for text in corpus:
+        policy.classify(text)
+    warm_time = timeit.default_timer() - start
+
+    print("policies: %d (%d distinct)" % (len(corpus), len(set(corpus))))
+    print("legacy Principal == '*':  %8.3fs  %8.0f policies/s  public: %d" % (legacy_time, len(corpus) / legacy_time, legacy_flagged))
+    print("analyzer, cold cache:     %8.3fs  %8.0f policies/s  public: %d restricted: %d" % (
+        cold_time, len(corpus) / cold_time, levels.count(policy.PUBLIC), levels.count(policy.RESTRICTED)))
+    print("analyzer, warm cache:     %8.3fs  %8.0f policies/s" % (warm_time, len(corpus) / warm_time))
+
+if __name__ == '__main__':
+    main()
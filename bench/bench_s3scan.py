@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# Benchmark: s3ListPublic.py bucket scanning, serial vs concurrent, against FakeS3
+# Serial mode is the old behaviour: ACL fetched twice per grantee check (4 GetBucketAcl per bucket)
+# plus one GetBucketPolicy, one bucket at a time. Both modes must report the same findings.
+# ./bench/bench_s3scan.py --buckets 500 --latency 0.01 --workers 50
+
+import os
+import sys
+import logging
+import random
+import argparse
+import timeit
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+import s3ListPublic
+from fakeaws import FakeS3
+from synthetic import synthetic_buckets
+from auditlib.s3clients import S3ClientPool
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--buckets', default=500, type=int)
+parser.add_argument('--latency', default=0.01, type=float, help='simulated seconds per API call')
+parser.add_argument('--workers', default=50, type=int)
+parser.add_argument('--seed', default=1, type=int)
+
+def serial_scan(session, buckets):
+    """ Old findBuckets() call pattern, one bucket at a time on the default client """
+    client = session.client('s3')
+    findings = []
+    for bucket in buckets:
+        for grantee in ['AllUsers', 'AuthenticatedUsers']:
+            client.get_bucket_acl(Bucket=bucket)
+            grants = client.get_bucket_acl(Bucket=bucket)['Grants']
+            findings.extend(('high', finding) for finding in s3ListPublic.acl_check(bucket, grants, grantee))
+        findings.extend(s3ListPublic.policy_check(client, bucket))
+    return findings
+
+
+def main():
+    warnings.simplefilter('ignore')
+    logging.basicConfig(level=logging.ERROR)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    buckets = synthetic_buckets(args.buckets, rnd)
+    names = sorted(buckets)
+
+    serial_fake = FakeS3(buckets, args.latency)
+    start = timeit.default_timer()
+    expected = serial_scan(serial_fake.session(), names)
+    serial_time = timeit.default_timer() - start
+
+    fake = FakeS3(buckets, args.latency)
+    clients = S3ClientPool(fake.session(), args.workers)
+    start = timeit.default_timer()
+    found = []
+    for bucket, findings in s3ListPublic.scanBuckets(clients, names, args.workers):
+        found.extend(findings)
+    scan_time = timeit.default_timer() - start
+
+    if sorted(found) != sorted(expected):
+        sys.exit("MISMATCH between serial and concurrent findings")
+
+    print("buckets: %d findings: %d latency: %.3fs workers: %d" % (len(names), len(found), args.latency, args.workers))
+    print("serial:      %8.3fs  %6d API calls" % (serial_time, sum(serial_fake.calls.values())))
+    print("concurrent:  %8.3fs  %6d API calls  (%.1fx)" % (scan_time, sum(fake.calls.values()), serial_time / scan_time))
+
+if __name__ == '__main__':
+    main()
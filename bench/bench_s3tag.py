@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Benchmark: s3Tag.py tagging, old serial flow vs read-once plan/apply, against FakeS3
+# Serial mode is the old behaviour: tags read three times per bucket (list, put, status after update)
+# and every matching bucket is put, even when its tags already match. Both must end with the same tags.
+# ./bench/bench_s3tag.py --buckets 500 --latency 0.01 --workers 50
+
+import os
+import sys
+import copy
+import logging
+import random
+import argparse
+import timeit
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+import s3Tag
+from fakeaws import FakeS3
+from auditlib.s3clients import S3ClientPool
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--buckets', default=500, type=int)
+parser.add_argument('--latency', default=0.01, type=float, help='simulated seconds per API call')
+parser.add_argument('--workers', default=50, type=int)
+parser.add_argument('--seed', default=1, type=int)
+
+NEW_TAGS = [{'Key': 'DataClassification', 'Value': 'Private'}, {'Key': 'Owner', 'Value': 'platform'}]
+
+
+def synthetic_buckets(count, rnd):
+    buckets = {}
+    for idx in range(count):
+        tags = []
+        if rnd.random() < 0.5:
+            tags.append({'Key': 'Team', 'Value': 'team-%d' % rnd.randint(0, 9)})
+        # a third of the buckets were tagged by an earlier run already
+        if rnd.random() < 0.3:
+            tags.extend(NEW_TAGS)
+        elif rnd.random() < 0.2:
+            tags.append({'Key': 'Owner', 'Value': 'someone-else'})
+        buckets['bench-bucket-%05d' % idx] = {'tags': tags}
+    return buckets
+
+
+def serial_tag(session, buckets):
+    """ Old printTags()/putTag()/printTags() call pattern, one bucket at a time """
+    client = session.client('s3')
+    resource = session.resource('s3')
+    for bucket in buckets:
+        s3Tag.getOldTags(client, bucket)
+    for bucket in buckets:
+        combined_tags, _ = s3Tag.planTags(s3Tag.getOldTags(client, bucket), NEW_TAGS)
+        resource.BucketTagging(bucket).put(Tagging={'TagSet': combined_tags})
+    for bucket in buckets:
+        s3Tag.getOldTags(client, bucket)
+
+
+def tag_sets(buckets):
+    return dict((name, sorted((tag['Key'], tag['Value']) for tag in bucket['tags'])) for name, bucket in buckets.items())
+
+
+def main():
+    warnings.simplefilter('ignore')
+    logging.basicConfig(level=logging.ERROR)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    buckets = synthetic_buckets(args.buckets, rnd)
+    names = sorted(buckets)
+    s3Tag.FINDINGS = s3Tag.findings.FindingsWriter('s3Tag', stream=open(os.devnull, 'w'))
+
+    serial_buckets = copy.deepcopy(buckets)
+    serial_fake = FakeS3(serial_buckets, args.latency)
+    start = timeit.default_timer()
+    serial_tag(serial_fake.session(), names)
+    serial_time = timeit.default_timer() - start
+
+    fake = FakeS3(buckets, args.latency)
+    clients = S3ClientPool(fake.session(), args.workers)
+    start = timeit.default_timer()
+    bucket_tags = s3Tag.fetchTags(clients, names, args.workers)
+    plan = s3Tag.planBuckets(names, bucket_tags, NEW_TAGS)
+    applied = s3Tag.applyTags(clients, plan, args.workers)
+    tag_time = timeit.default_timer() - start
+
+    if len(applied) != len(plan) or tag_sets(buckets) != tag_sets(serial_buckets):
+        sys.exit("MISMATCH between serial and plan/apply tags")
+
+    print("buckets: %d updated: %d latency: %.3fs workers: %d" % (
+        len(names), len(applied), args.latency, args.workers))
+    print("serial:      %8.3fs  %6d API calls" % (serial_time, sum(serial_fake.calls.values())))
+    print("plan/apply:  %8.3fs  %6d API calls  (%.1fx)" % (tag_time, sum(fake.calls.values()), serial_time / tag_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+# Benchmark harness: runs each script's main() end to end on a synthetic account, offline
+# AWS calls are answered by the fakes in fakeaws.py (the scripts' boto3 sessions are swapped
+# for fake ones), DNS by a local FakeDns server, and CloudFront IPs and status pages are local.
+# Each script runs in its own python process, so peak memory is per script, and the
+# fastest of --repeat runs is kept. nightly-scripts and aws-audit audit the same accounts
+# (buckets, zones and distributions per profile), the scripts back to back vs aws-audit.py all.
+# --save keeps the results, --baseline compares a later run with them and exits non-zero
+# when a script got slower or bigger by more than --tolerance
+# ./bench/bench_scripts.py --save bench-results.json
+# ./bench/bench_scripts.py --baseline bench-results.json --only s3ListPublic,cidr-convert
+
+import os
+import sys
+import imp
+import json
+import random
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+import timeit
+import warnings
+import boto3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+from fakeaws import FakeS3, FakeRoute53, FakeCloudFront, fake_session
+from fakestatus import FakeStatusPages
+from fakedns import FakeDns
+import synthetic
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--only', default=None, help='comma separated scenarios, default all')
+parser.add_argument('--profiles', default=2, type=int, help='aws profiles for cloudfront-subdomain-audit')
+parser.add_argument('--zones', default=100, type=int, help='route53 zones per profile')
+parser.add_argument('--records', default=50, type=int, help='records per zone')
+parser.add_argument('--buckets', default=1000, type=int)
+parser.add_argument('--rows', default=200000, type=int, help='rows in the cidr-convert feed')
+parser.add_argument('--pages', default=50, type=int, help='status pages')
+parser.add_argument('--latency', default=0.002, type=float, help='simulated seconds per API call or page')
+parser.add_argument('--dns-latency', default=0.002, type=float, help='simulated seconds per DNS lookup')
+parser.add_argument('--workers', default=50, type=int)
+parser.add_argument('--seed', default=1, type=int)
+parser.add_argument('--save', default=None, help='write the results to this json file')
+parser.add_argument('--baseline', default=None, help='json file from an earlier --save to compare with')
+parser.add_argument('--tolerance', default=0.25, type=float, help='allowed slowdown/growth over the baseline')
+parser.add_argument('--repeat', default=3, type=int, help='runs per scenario, the fastest one is kept')
+parser.add_argument('--scenario', default=None, help=argparse.SUPPRESS)
+
+# arguments that change the workload, a baseline is only comparable when they match
+SIZES = ['profiles', 'zones', 'records', 'buckets', 'rows', 'pages', 'latency', 'dns_latency', 'workers', 'seed']
+
+
+def load_script(name):
+    return imp.load_source(name.replace('-', '_'), os.path.join(ROOT, name + '.py'))
+
+
+def main_runner(module, argv):
+    """ Function running module.main() with argv, exit() calls included """
+    def run():
+        sys.argv = [module.__file__] + argv
+        try:
+            module.main()
+        except SystemExit:
+            pass
+    return run
+
+
+def use_sessions(sessions):
+    """ Send every boto3 Session the scripts create to a fake one, sessions is profile: fakes """
+    def session(profile_name=None, **kwargs):
+        return fake_session(*sessions[profile_name or 'default'])
+    boto3.Session = boto3.session.Session = session
+
+
+def calls(fakes):
+    return lambda: sum(sum(fake.calls.values()) for fake in fakes)
+
+
+def cloudfront_audit(args, rnd):
+    sessions = {}
+    dns = {}
+    records = 0
+    for idx in range(args.profiles):
+        zones, distributions, profile_answers = synthetic.synthetic_account(
+            'p%d' % idx, args.zones, args.records, rnd, idx * 1000000)
+        sessions['bench-%d' % idx] = [FakeRoute53(zones, args.latency), FakeCloudFront(distributions, args.latency)]
+        dns.update(synthetic.dns_zone(zones, profile_answers))
+        records += sum(1 for zone in zones for rrset in zone['records'] if rrset['Type'] in ('A', 'CNAME'))
+    use_sessions(sessions)
+    fake_dns = FakeDns(dns, args.dns_latency).start()
+    module = load_script('cloudfront-subdomain-audit')
+    module.get_cf_blks = lambda cache=None: list(synthetic.CF_BLOCKS)
+    argv = ['--profiles', ','.join(sorted(sessions)), '--workers', str(args.workers),
+            '--nameservers', fake_dns.address()]
+    run = main_runner(module, argv)
+
+    def run_and_stop():
+        try:
+            run()
+        finally:
+            fake_dns.stop()
+    return records, 'records', run_and_stop, calls([fake for fakes in sessions.values() for fake in fakes])
+
+
+def account_suite(args, rnd):
+    """ Fakes for --profiles accounts with buckets, zones and distributions, one FakeDns for all of them """
+    sessions = {}
+    dns = {}
+    items = 0
+    for idx in range(args.profiles):
+        zones, distributions, answers = synthetic.synthetic_account(
+            'p%d' % idx, args.zones, args.records, rnd, idx * 1000000)
+        buckets = synthetic.synthetic_buckets(args.buckets, rnd)
+        sessions['bench-%d' % idx] = [FakeS3(buckets, args.latency), FakeRoute53(zones, args.latency),
+                                      FakeCloudFront(distributions, args.latency)]
+        dns.update(synthetic.dns_zone(zones, answers))
+        items += len(buckets) + sum(1 for zone in zones for rrset in zone['records'] if rrset['Type'] in ('A', 'CNAME'))
+    use_sessions(sessions)
+    return sessions, FakeDns(dns, args.dns_latency).start(), items
+
+
+def cf_blocks(cache=None):
+    return list(synthetic.CF_BLOCKS)
+
+
+def nightly_scripts(args, rnd):
+    """ s3ListPublic, s3Tag (audit) per profile and cloudfront-subdomain-audit, in one process unlike cron """
+    sessions, fake_dns, items = account_suite(args, rnd)
+    s3_public = load_script('s3ListPublic')
+    s3_tag = load_script('s3Tag')
+    cloudfront = load_script('cloudfront-subdomain-audit')
+    cloudfront.get_cf_blks = cf_blocks
+
+    def run():
+        try:
+            # the s3 scripts use the default profile, each account's turn to be it
+            for profile in sorted(sessions):
+                use_sessions({'default': sessions[profile]})
+                main_runner(s3_public, ['-w', str(args.workers)])()
+                main_runner(s3_tag, ['--match', '*', '--addtags', 'no', '-w', str(args.workers)])()
+            use_sessions(sessions)
+            main_runner(cloudfront, ['--profiles', ','.join(sorted(sessions)), '--workers', str(args.workers),
+                                     '--nameservers', fake_dns.address()])()
+        finally:
+            fake_dns.stop()
+    return items, 'resources', run, calls([fake for fakes in sessions.values() for fake in fakes])
+
+
+def aws_audit(args, rnd):
+    sessions, fake_dns, items = account_suite(args, rnd)
+    module = load_script('aws-audit')
+    load = module.load_script
+
+    def load_with_fake_ips(script):
+        loaded = load(script)
+        if script == 'cloudfront-subdomain-audit':
+            loaded.get_cf_blks = cf_blocks
+        return loaded
+    module.load_script = load_with_fake_ips
+    run = main_runner(module, ['--profiles', ','.join(sorted(sessions)), '--workers', str(args.workers),
+                               '--nameservers', fake_dns.address(), 'all'])
+
+    def run_and_stop():
+        try:
+            run()
+        finally:
+            fake_dns.stop()
+    return items, 'resources', run_and_stop, calls([fake for fakes in sessions.values() for fake in fakes])
+
+
+def s3_list_public(args, rnd):
+    fake = FakeS3(synthetic.synthetic_buckets(args.buckets, rnd), args.latency)
+    use_sessions({'default': [fake]})
+    argv = ['-w', str(args.workers)]
+    return args.buckets, 'buckets', main_runner(load_script('s3ListPublic'), argv), calls([fake])
+
+
+def s3_tag(args, rnd):
+    fake = FakeS3(synthetic.synthetic_buckets(args.buckets, rnd), args.latency)
+    use_sessions({'default': [fake]})
+    argv = ['--match', 'bench-*', '--addtags', 'yes', '--tag', 'Owner=platform', '-w', str(args.workers)]
+    return args.buckets, 'buckets', main_runner(load_script('s3Tag'), argv), calls([fake])
+
+
+def s3_enable_versioning(args, rnd):
+    fake = FakeS3(synthetic.synthetic_buckets(args.buckets, rnd), args.latency)
+    use_sessions({'default': [fake]})
+    argv = ['--match', 'bench-*', '--days', '90', '-w', str(args.workers), '--apply-workers', str(args.workers)]
+    return args.buckets, 'buckets', main_runner(load_script('s3EnableVersioning'), argv), calls([fake])
+
+
+def cidr_convert(args, rnd):
+    feed = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+    for line in synthetic.synthetic_feed(args.rows, 40, rnd):
+        feed.write(line + '\n')
+    feed.close()
+    run = main_runner(load_script('cidr-convert'), [feed.name, '--format', 'waf'])
+
+    def run_and_clean():
+        try:
+            run()
+        finally:
+            os.unlink(feed.name)
+    return args.rows, 'rows', run_and_clean, lambda: 0
+
+
+def status_page_check(args, rnd):
+    fake = FakeStatusPages(synthetic.synthetic_pages(args.pages, rnd), args.latency).start()
+    pages = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    for page_id in sorted(fake.pages):
+        pages.write(fake.url(page_id) + ' API operational\n')
+    pages.close()
+    run = main_runner(load_script('status-page-check'), ['--pages', pages.name, '--workers', str(args.workers)])
+
+    def run_and_stop():
+        try:
+            run()
+        finally:
+            fake.stop()
+            os.unlink(pages.name)
+    return args.pages, 'pages', run_and_stop, lambda: fake.requests
+
+
+# name: function(args, rnd) returning (items, unit, run, api call counter)
+SCENARIOS = [
+    ('cloudfront-subdomain-audit', cloudfront_audit),
+    ('s3ListPublic', s3_list_public),
+    ('s3Tag', s3_tag),
+    ('s3EnableVersioning', s3_enable_versioning),
+    ('cidr-convert', cidr_convert),
+    ('status-page-check', status_page_check),
+    ('nightly-scripts', nightly_scripts),
+    ('aws-audit', aws_audit),
+]
+
+
+def peak_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def run_scenario(name, args):
+    """ Child process: build the fixtures, time main(), print the result as one json line """
+    warnings.simplefilter('ignore')
+    logging.disable(logging.CRITICAL)
+    stdout = sys.stdout
+    # findings and the scripts' prints go nowhere, only the result line is written
+    sys.stdout = open(os.devnull, 'w')
+    items, unit, run, api_calls = dict(SCENARIOS)[name](args, random.Random(args.seed))
+    setup_mb = peak_mb()
+    start = timeit.default_timer()
+    run()
+    wall = timeit.default_timer() - start
+    stdout.write(json.dumps({'scenario': name, 'items': items, 'unit': unit, 'wall_s': round(wall, 3),
+                             'per_s': round(items / wall, 1) if wall else 0, 'setup_mb': round(setup_mb, 1),
+                             'peak_mb': round(peak_mb(), 1), 'api_calls': api_calls()}) + '\n')
+
+
+def run_child(name):
+    """ Run one scenario in a fresh interpreter, returns its result or {'scenario', 'error'} """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--scenario', name],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    lines = out.decode('utf-8').strip().splitlines()
+    if proc.returncode or not lines:
+        errors = err.decode('utf-8').strip().splitlines() or ['exit code %d' % proc.returncode]
+        return {'scenario': name, 'error': errors[-1]}
+    return json.loads(lines[-1])
+
+
+def regressions(results, baseline, tolerance):
+    previous = dict((result['scenario'], result) for result in baseline['results'] if 'error' not in result)
+    for result in results:
+        old = previous.get(result['scenario'])
+        if 'error' in result or old is None:
+            continue
+        for key in ('wall_s', 'peak_mb'):
+            if old[key] and result[key] > old[key] * (1 + tolerance):
+                yield "REGRESSION %s %s: %.3f -> %.3f (+%.0f%%)" % (
+                    result['scenario'], key, old[key], result[key], (result[key] / old[key] - 1) * 100)
+
+
+def main():
+    args = parser.parse_args()
+    if args.scenario:
+        run_scenario(args.scenario, args)
+        return
+    names = [name for name, scenario in SCENARIOS]
+    if args.only:
+        names = [name for name in names if name in args.only.split(',')]
+    sizes = dict((key, getattr(args, key)) for key in SIZES)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['sizes'] != sizes:
+            sys.exit("MISMATCH baseline was run with %s" % json.dumps(baseline['sizes'], sort_keys=True))
+
+    print("%-28s %9s %-8s %9s %11s %9s %9s" % ('scenario', 'items', '', 'wall s', 'items/s', 'peak MB', 'api calls'))
+    results = []
+    for name in names:
+        runs = [run_child(name) for _ in range(max(1, args.repeat))]
+        finished = [run for run in runs if 'error' not in run]
+        result = min(finished, key=lambda run: run['wall_s']) if finished else runs[-1]
+        results.append(result)
+        if 'error' in result:
+            print("%-28s failed: %s" % (name, result['error']))
+            continue
+        print("%-28s %9d %-8s %9.3f %11.1f %9.1f %9d" % (
+            name, result['items'], result['unit'], result['wall_s'], result['per_s'], result['peak_mb'],
+            result['api_calls']))
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump({'sizes': sizes, 'results': results}, save_file, indent=2, sort_keys=True)
+            save_file.write('\n')
+    failed = [result['scenario'] for result in results if 'error' in result]
+    slower = list(regressions(results, baseline, args.tolerance)) if baseline else []
+    for line in slower:
+        print(line)
+    if failed or slower:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Benchmark: status-page-check.py, one page per request (old per-process behaviour) vs check_pages
+# Pages come from a local FakeStatusPages server, no network is used. Serial mode fetches each
+# page with its own connection and parses the json twice, like the old get_summary/check_status.
+# Both modes must find the same failing components.
+# ./bench/bench_statuspages.py --pages 30 --latency 0.1 --workers 10
+
+import os
+import sys
+import imp
+import random
+import argparse
+import timeit
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+statuscheck = imp.load_source('statuscheck', os.path.join(ROOT, 'status-page-check.py'))
+from auditlib import findings
+from fakestatus import FakeStatusPages
+from synthetic import synthetic_pages
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pages', default=30, type=int)
+parser.add_argument('--latency', default=0.1, type=float, help='simulated seconds per page')
+parser.add_argument('--workers', default=10, type=int)
+parser.add_argument('--seed', default=1, type=int)
+
+def serial_check(pages):
+    failing = []
+    for page in pages:
+        summary = requests.get(page['url'])
+        summary.json().get('page').get('name')
+        for item in summary.json().get('components'):
+            if item['name'] in page['components'] and item['status'] not in page['okstatus']:
+                failing.append((page['url'], item['name']))
+    return failing
+
+
+def main():
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    fake = FakeStatusPages(synthetic_pages(args.pages, rnd), args.latency).start()
+    pages = [{'url': fake.url(page_id), 'components': ['API'], 'okstatus': ['operational']}
+             for page_id in sorted(fake.pages)]
+
+    start = timeit.default_timer()
+    expected = serial_check(pages)
+    serial_time = timeit.default_timer() - start
+
+    statuscheck.FINDINGS = findings.FindingsWriter('status-page-check', stream=open(os.devnull, 'w'))
+    start = timeit.default_timer()
+    code, results = statuscheck.check_pages(pages, args.workers)
+    pooled_time = timeit.default_timer() - start
+    fake.stop()
+
+    if [url for url, result in results if result != statuscheck.OK] != sorted(set(url for url, name in expected)):
+        sys.exit("MISMATCH between serial and concurrent results")
+
+    print("pages: %d failing: %d latency: %.3fs workers: %d exit code: %d" % (
+        len(pages), len(expected), args.latency, args.workers, code))
+    print("serial:      %8.3fs" % serial_time)
+    print("concurrent:  %8.3fs  (%.1fx)" % (pooled_time, serial_time / pooled_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# Offline stand-ins for AWS, used by the benchmarks
+# Handlers hook botocore's before-call event the same way botocore.stub.Stubber does,
+# but answer from an in-memory account instead of a fixed queue, so they work with
+# concurrent callers and any call order. An optional sleep simulates API latency.
+
+import time
+import threading
+from boto3.session import Session
+from botocore.awsrequest import AWSResponse
+
+
+def response(parsed, status=200):
+    return AWSResponse(None, status, {}, None), parsed
+
+
+def error(code, message='', status=404):
+    return response({'Error': {'Code': code, 'Message': message},
+                     'ResponseMetadata': {'HTTPStatusCode': status}}, status)
+
+
+def fake_session(*fakes):
+    """ boto3 Session whose clients for each fake's service are answered by that fake """
+    session = Session(aws_access_key_id='bench', aws_secret_access_key='bench', region_name='us-east-1')
+    for fake in fakes:
+        fake.register(session)
+    return session
+
+
+class FakeService(object):
+    """
+    Base for the fakes, dispatches each operation to op_<OperationName>(params)
+    and counts calls per operation in self.calls
+    """
+    service = None
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def session(self):
+        """ boto3 Session whose clients for this service are answered by this fake """
+        return fake_session(self)
+
+    def register(self, session):
+        session.events.register_first('before-parameter-build.' + self.service, self.keep_params)
+        session.events.register_first('before-call.' + self.service, self.handle)
+
+    def keep_params(self, params, context, **kwargs):
+        # before-call only sees the serialized request, so keep the API parameters for handle()
+        context['fake_params'] = dict(params)
+
+    def called(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def handle(self, model, context, **kwargs):
+        self.called(model.name)
+        handler = getattr(self, 'op_' + model.name, None)
+        if handler is None:
+            raise NotImplementedError("%s does not answer %s" % (type(self).__name__, model.name))
+        return handler(context.get('fake_params', {}))
+
+
+class FakeS3(FakeService):
+    """
+    In-memory S3 account, buckets is dict of name: {'region', 'grants', 'policy', 'tags', 'versioning', 'rules'}
+    e.g. session = FakeS3(buckets, latency=0.02).session()
+    """
+    service = 's3'
+
+    def __init__(self, buckets, latency=0.0):
+        super(FakeS3, self).__init__(latency)
+        self.buckets = buckets
+
+    def handle(self, model, context, **kwargs):
+        params = context.get('fake_params', {})
+        self.called(model.name)
+        if model.name == 'ListBuckets':
+            return response({'Buckets': [{'Name': name} for name in sorted(self.buckets)]})
+        bucket = self.buckets.get(params.get('Bucket'))
+        if bucket is None:
+            return error('NoSuchBucket')
+        handler = getattr(self, 'op_' + model.name, None)
+        if handler is None:
+            raise NotImplementedError("FakeS3 does not answer " + model.name)
+        return handler(bucket, params)
+
+    def op_GetBucketLocation(self, bucket, params):
+        region = bucket.get('region', 'us-east-1')
+        return response({'LocationConstraint': None if region == 'us-east-1' else region})
+
+    def op_GetBucketAcl(self, bucket, params):
+        return response({'Owner': {'ID': 'owner'}, 'Grants': bucket.get('grants', [])})
+
+    def op_GetBucketPolicy(self, bucket, params):
+        if not bucket.get('policy'):
+            return error('NoSuchBucketPolicy')
+        return response({'Policy': bucket['policy']})
+
+    def op_GetBucketTagging(self, bucket, params):
+        if not bucket.get('tags'):
+            return error('NoSuchTagSet')
+        return response({'TagSet': [dict(tag) for tag in bucket['tags']]})
+
+    def op_PutBucketTagging(self, bucket, params):
+        bucket['tags'] = [dict(tag) for tag in params['Tagging']['TagSet']]
+        return response({'ResponseMetadata': {'HTTPStatusCode': 204}}, 204)
+
+    def op_GetBucketVersioning(self, bucket, params):
+        return response(dict(Status=bucket['versioning']) if bucket.get('versioning') else {})
+
+    def op_PutBucketVersioning(self, bucket, params):
+        bucket['versioning'] = params['VersioningConfiguration']['Status']
+        return response({})
+
+    def op_GetBucketLifecycleConfiguration(self, bucket, params):
+        if not bucket.get('rules'):
+            return error('NoSuchLifecycleConfiguration')
+        return response({'Rules': [dict(rule) for rule in bucket['rules']]})
+
+    def op_PutBucketLifecycleConfiguration(self, bucket, params):
+        bucket['rules'] = [dict(rule) for rule in params['LifecycleConfiguration']['Rules']]
+        return response({})
+
+
+class FakeRoute53(FakeService):
+    """
+    In-memory hosted zones, zones is a list of {'Id', 'Name', 'records': [ResourceRecordSet]} and optionally 'private'
+    Both list calls page like the real API (100 zones, 300 record sets a page by default)
+    """
+    service = 'route53'
+
+    def __init__(self, zones, latency=0.0, zone_page=100, record_page=300):
+        super(FakeRoute53, self).__init__(latency)
+        self.zones = zones
+        self.by_id = dict((zone['Id'].split('/')[-1], zone) for zone in zones)
+        self.zone_page = zone_page
+        self.record_page = record_page
+
+    def op_ListHostedZones(self, params):
+        start = int(params.get('Marker') or 0)
+        page = self.zones[start:start + self.zone_page]
+        result = {'HostedZones': [{'Id': zone['Id'], 'Name': zone['Name'], 'CallerReference': zone['Id'],
+                                   'Config': {'PrivateZone': zone.get('private', False)}, 'ResourceRecordSetCount': len(zone['records'])}
+                                  for zone in page],
+                  'Marker': params.get('Marker', ''), 'MaxItems': str(self.zone_page),
+                  'IsTruncated': start + self.zone_page < len(self.zones)}
+        if result['IsTruncated']:
+            result['NextMarker'] = str(start + self.zone_page)
+        return response(result)
+
+    def op_ListResourceRecordSets(self, params):
+        zone = self.by_id.get(params['HostedZoneId'].split('/')[-1])
+        if zone is None:
+            return error('NoSuchHostedZone')
+        records = zone['records']
+        start = 0
+        if params.get('StartRecordName'):
+            # the fake pages by position, the next record's name/type is only a cursor
+            start = int(params.get('StartRecordIdentifier') or 0)
+        page = records[start:start + self.record_page]
+        result = {'ResourceRecordSets': page, 'MaxItems': str(self.record_page),
+                  'IsTruncated': start + self.record_page < len(records)}
+        if result['IsTruncated']:
+            following = records[start + self.record_page]
+            result.update(NextRecordName=following['Name'], NextRecordType=following['Type'],
+                          NextRecordIdentifier=str(start + self.record_page))
+        return response(result)
+
+
+class FakeCloudFront(FakeService):
+    """ In-memory distributions, a list of DistributionSummary dicts, paged 100 at a time """
+    service = 'cloudfront'
+
+    def __init__(self, distributions, latency=0.0, page_size=100):
+        super(FakeCloudFront, self).__init__(latency)
+        self.distributions = distributions
+        self.page_size = page_size
+
+    def op_ListDistributions(self, params):
+        start = int(params.get('Marker') or 0)
+        page = self.distributions[start:start + self.page_size]
+        dist_list = {'Marker': params.get('Marker', ''), 'MaxItems': self.page_size,
+                     'IsTruncated': start + self.page_size < len(self.distributions), 'Quantity': len(page)}
+        if page:
+            dist_list['Items'] = page
+        if dist_list['IsTruncated']:
+            dist_list['NextMarker'] = str(start + self.page_size)
+        return response({'DistributionList': dist_list})
@@ -0,0 +1,90 @@
+# Local recursive-resolver stand-in, used by the benchmarks
+# Answers A queries over UDP on 127.0.0.1 from a dict of name: ('CNAME', target) or ('A', [ips]),
+# following CNAMEs within the zone like a recursive resolver does, NXDOMAIN (with an SOA for
+# the negative TTL) when the chain ends at a missing name, SERVFAIL for names in servfail.
+# An optional sleep simulates resolver latency, queries counts every question answered.
+
+import time
+import struct
+import threading
+
+try:
+    from SocketServer import ThreadingUDPServer, BaseRequestHandler
+except ImportError:
+    from socketserver import ThreadingUDPServer, BaseRequestHandler
+
+from auditlib.dnschain import TYPES, encode_name, read_name, NXDOMAIN, SERVFAIL
+
+
+def record(name, rrtype, ttl, rdata):
+    return encode_name(name) + struct.pack('>HHIH', TYPES[rrtype], 1, ttl, len(rdata)) + rdata
+
+
+class FakeDns(object):
+    """
+    e.g. fake = FakeDns({'www.example.com': ('CNAME', 'd1.cloudfront.net'), 'd1.cloudfront.net': ('A', ['13.32.0.1'])})
+    fake.start(); DnsClient([fake.address()])
+    """
+
+    def __init__(self, zone, latency=0.0, ttl=300, servfail=()):
+        self.zone = zone
+        self.latency = latency
+        self.ttl = ttl
+        self.servfail = set(servfail)
+        self.queries = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                sock.sendto(fake.answer(bytearray(data)), self.client_address)
+
+        self.server = ThreadingUDPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def address(self):
+        return '127.0.0.1:%d' % self.server.server_address[1]
+
+    def answer(self, data):
+        with self.lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        query_id = struct.unpack('>H', bytes(data[:2]))[0]
+        name, end = read_name(data, 12)
+        question = bytes(data[12:end + 4])
+        answers = []
+        authority = []
+        rcode = 0
+        current = name
+        for _ in range(16):
+            if current in self.servfail:
+                rcode, answers = SERVFAIL, []
+                break
+            entry = self.zone.get(current)
+            if entry is None:
+                rcode = NXDOMAIN
+                soa = encode_name('ns.invalid') + encode_name('hostmaster.invalid') + struct.pack('>5I', 1, 7200, 900, 1209600, 60)
+                authority.append(record(current.split('.', 1)[-1], 'SOA', 900, soa))
+                break
+            if entry[0] == 'CNAME':
+                answers.append(record(current, 'CNAME', self.ttl, encode_name(entry[1])))
+                current = entry[1]
+                continue
+            for ip in entry[1]:
+                answers.append(record(current, 'A', self.ttl, struct.pack('>4B', *[int(part) for part in ip.split('.')])))
+            break
+        header = struct.pack('>HHHHHH', query_id, 0x8180 | rcode, 1, len(answers), len(authority), 0)
+        return header + question + b''.join(answers) + b''.join(authority)
@@ -0,0 +1,99 @@
+# Local statuspage.io stand-in, used by the benchmarks
+# Serves /<page>/api/v2/summary.json for synthetic pages from a threaded HTTP server on
+# 127.0.0.1, with an ETag per page so conditional GETs get 304 Not Modified. An optional
+# sleep simulates a slow vendor, and component status can be changed while it runs.
+
+import json
+import time
+import hashlib
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops concurrent connects, which then wait a second to retry
+    request_queue_size = 128
+
+
+class FakeStatusPages(object):
+    """
+    pages is dict of page id: {'name': 'Vendor', 'components': {'API': 'operational', ...}}
+    e.g. fake = FakeStatusPages(pages, latency=0.05); fake.start(); requests.get(fake.url('vendor-1'))
+    """
+
+    def __init__(self, pages, latency=0.0):
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, page_id):
+        return 'http://127.0.0.1:%d/%s/api/v2/summary.json' % (self.server.server_address[1], page_id)
+
+    def set_status(self, page_id, component, status):
+        with self.lock:
+            self.pages[page_id]['components'][component] = status
+
+    def summary(self, page_id):
+        page = self.pages[page_id]
+        return json.dumps({
+            'page': {'id': page_id, 'name': page['name']},
+            'components': [{'name': name, 'status': status} for name, status in sorted(page['components'].items())],
+            'status': {'indicator': 'none'},
+        }, sort_keys=True).encode('utf-8')
+
+    def handle(self, request):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        page_id = request.path.strip('/').split('/')[0]
+        if page_id not in self.pages:
+            request.send_response(404)
+            request.end_headers()
+            return
+        with self.lock:
+            body = self.summary(page_id)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if request.headers.get('If-None-Match') == etag:
+            with self.lock:
+                self.not_modified += 1
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.end_headers()
+            return
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.send_header('ETag', etag)
+        request.end_headers()
+        request.wfile.write(body)
@@ -0,0 +1,162 @@
+# Synthetic inputs for the benchmarks, all generated from a seeded random.Random
+# Country feeds for cidr-convert.py, status pages, s3 buckets with ACLs/policies/tags, and
+# Route53 zones with CloudFront distributions plus the DNS answers their records resolve to,
+# or the same as a zone for bench/fakedns.py
+
+import json
+from auditlib import iprange
+
+# roughly the prefix mix of a country allocation feed
+PREFIX_WEIGHTS = [(24, 40), (23, 10), (22, 15), (21, 10), (20, 8), (19, 5), (18, 2), (16, 4),
+                  (14, 1), (12, 1), (25, 1), (26, 1), (27, 1), (28, 1), (29, 1)]
+
+STATUSES = ['operational'] * 8 + ['degraded_performance', 'major_outage']
+
+GROUP = 'http://acs.amazonaws.com/groups/global/'
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'eu-central-1']
+
+# a few real CloudFront ranges, records pointing at cloudfront resolve into the first one
+CF_BLOCKS = ['13.32.0.0/15', '52.84.0.0/15', '54.182.0.0/16', '54.192.0.0/16', '54.230.0.0/16',
+             '54.239.128.0/18', '99.84.0.0/16', '204.246.164.0/22', '205.251.192.0/19', '216.137.32.0/19']
+
+
+def synthetic_feed(count, countries, rnd):
+    """ country,block lines, each country allocated from a few /8s so blocks sit next to each other """
+    prefixes = [prefix for prefix, weight in PREFIX_WEIGHTS for _ in range(weight)]
+    homes = dict(('C%02d' % idx, rnd.sample(range(1, 224), 3)) for idx in range(countries))
+    lines = []
+    for _ in range(count):
+        country = rnd.choice(sorted(homes))
+        prefix = rnd.choice(prefixes)
+        value = (rnd.choice(homes[country]) << 24) | rnd.getrandbits(24)
+        size = 1 << (32 - prefix)
+        value -= value % size
+        lines.append('%s,%s/%d' % (country, iprange.int_to_ip(4, value), prefix))
+        if rnd.random() < 0.05:
+            # same block listed again, sometimes under another country
+            lines.append('%s,%s/%d' % (rnd.choice(sorted(homes)), iprange.int_to_ip(4, value), prefix))
+    return lines
+
+
+def synthetic_pages(count, rnd):
+    """ FakeStatusPages pages, 3 to 20 components each plus API """
+    pages = {}
+    for idx in range(count):
+        components = dict(('Component %d' % c, rnd.choice(STATUSES)) for c in range(rnd.randint(3, 20)))
+        components['API'] = rnd.choice(STATUSES)
+        pages['vendor-%03d' % idx] = {'name': 'Vendor %d' % idx, 'components': components}
+    return pages
+
+
+def synthetic_buckets(count, rnd):
+    """ FakeS3 buckets, some public by ACL or policy, some tagged, versioned or with lifecycle rules """
+    buckets = {}
+    for idx in range(count):
+        grants = [{'Grantee': {'Type': 'CanonicalUser', 'ID': 'owner'}, 'Permission': 'FULL_CONTROL'}]
+        if rnd.random() < 0.1:
+            grants.append({'Grantee': {'Type': 'Group', 'URI': GROUP + 'AllUsers'}, 'Permission': 'READ'})
+        if rnd.random() < 0.05:
+            grants.append({'Grantee': {'Type': 'Group', 'URI': GROUP + 'AuthenticatedUsers'}, 'Permission': 'WRITE'})
+        policy = None
+        if rnd.random() < 0.3:
+            principal = '*' if rnd.random() < 0.3 else {'AWS': 'arn:aws:iam::123456789012:root'}
+            policy = json.dumps({'Statement': [{'Effect': 'Allow', 'Principal': principal,
+                                                'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::b%d/*' % idx}]})
+        buckets['bench-bucket-%05d' % idx] = {
+            'region': rnd.choice(REGIONS), 'grants': grants, 'policy': policy,
+            'tags': [{'Key': 'Team', 'Value': 'team-%d' % rnd.randint(0, 9)}] if rnd.random() < 0.5 else [],
+            'versioning': 'Enabled' if rnd.random() < 0.3 else None,
+            'rules': [{'ID': 'archive', 'Prefix': 'logs/', 'Status': 'Enabled'}] if rnd.random() < 0.05 else []}
+    return buckets
+
+
+def distribution(idx, aliases):
+    """ Minimal valid DistributionSummary """
+    return {
+        'Id': 'E%012d' % idx, 'ARN': 'arn:aws:cloudfront::123456789012:distribution/E%012d' % idx,
+        'Status': 'Deployed', 'LastModifiedTime': '2017-06-06T00:00:00Z', 'DomainName': 'd%d.cloudfront.net' % idx,
+        'Aliases': {'Quantity': len(aliases), 'Items': aliases} if aliases else {'Quantity': 0},
+        'Origins': {'Quantity': 1, 'Items': [{'Id': 'origin', 'DomainName': 'origin.s3.amazonaws.com'}]},
+        'DefaultCacheBehavior': {'TargetOriginId': 'origin', 'ViewerProtocolPolicy': 'allow-all'},
+        'CacheBehaviors': {'Quantity': 0}, 'CustomErrorResponses': {'Quantity': 0}, 'Comment': '',
+        'PriceClass': 'PriceClass_All', 'Enabled': True, 'ViewerCertificate': {},
+        'Restrictions': {'GeoRestriction': {'RestrictionType': 'none', 'Quantity': 0}},
+        'WebACLId': '', 'HttpVersion': 'http2', 'IsIPV6Enabled': False}
+
+
+def record_set(name, rrtype, value):
+    if rrtype == 'ALIAS':
+        return {'Name': name, 'Type': 'A',
+                'AliasTarget': {'HostedZoneId': 'Z2FDTNDATAQYW2', 'DNSName': value, 'EvaluateTargetHealth': False}}
+    return {'Name': name, 'Type': rrtype, 'TTL': 300, 'ResourceRecords': [{'Value': value}]}
+
+
+def synthetic_account(prefix, zones, records, rnd, first_distribution=0):
+    """
+    Route53 zones of records per zone and the CloudFront distributions behind them
+    Returns (zones, distributions, answers), answers is record name: gethostbyname_ex answer,
+    names missing from answers don't resolve. Record mix: plain A records, A aliases and CNAMEs
+    to cloudfront with a registered alias, CNAMEs to cloudfront without one (the RISK findings),
+    CNAMEs to other hosts and dangling CNAMEs
+    """
+    hosted_zones = []
+    aliases = []
+    answers = {}
+    cf_hosts = [('d%d.cloudfront.net' % idx, '13.32.%d.%d' % (idx // 250 % 256, idx % 250 + 1))
+                for idx in range(first_distribution, first_distribution + max(1, zones * records // 10))]
+    for zone_idx in range(zones):
+        domain = '%s-zone%04d.com' % (prefix, zone_idx)
+        rrsets = [{'Name': domain + '.', 'Type': 'SOA', 'TTL': 900,
+                   'ResourceRecords': [{'Value': 'ns-1.awsdns-01.org. hostmaster.%s. 1 7200 900 1209600 86400' % domain}]},
+                  {'Name': domain + '.', 'Type': 'NS', 'TTL': 172800,
+                   'ResourceRecords': [{'Value': 'ns-%d.awsdns-%02d.org.' % (n, n)} for n in range(4)]}]
+        for rec_idx in range(records):
+            name = 'host%04d.%s' % (rec_idx, domain)
+            roll = rnd.random()
+            cf_host, cf_ip = rnd.choice(cf_hosts)
+            if roll < 0.4:
+                ip = '10.%d.%d.%d' % (zone_idx % 256, rec_idx // 256 % 256, rec_idx % 256)
+                rrsets.append(record_set(name + '.', 'A', ip))
+                answers[name] = (name, [], [ip])
+            elif roll < 0.5:
+                rrsets.append(record_set(name + '.', 'ALIAS', cf_host + '.'))
+                answers[name] = (name, [], [cf_ip])
+                aliases.append(name)
+            elif roll < 0.8:
+                rrsets.append(record_set(name + '.', 'CNAME', cf_host))
+                answers[name] = (cf_host, [name], [cf_ip])
+                aliases.append(name)
+            elif roll < 0.85:
+                rrsets.append(record_set(name + '.', 'CNAME', cf_host))
+                answers[name] = (cf_host, [name], [cf_ip])
+            elif roll < 0.95:
+                lb = rnd.randint(0, 999)
+                target = 'lb-%d.elb.example.net' % lb
+                rrsets.append(record_set(name + '.', 'CNAME', target))
+                answers[name] = (target, [name], ['198.51.%d.%d' % (lb // 254, lb % 254 + 1)])
+            else:
+                rrsets.append(record_set(name + '.', 'CNAME', 'gone-%d.herokuapp.com' % rnd.randint(0, 999)))
+        hosted_zones.append({'Id': '/hostedzone/Z%s%05d' % (prefix.upper(), zone_idx), 'Name': domain + '.',
+                             'records': rrsets})
+    rnd.shuffle(aliases)
+    distributions = []
+    for idx in range(len(cf_hosts)):
+        dist = distribution(first_distribution + idx, aliases[idx::len(cf_hosts)])
+        distributions.append(dist)
+    return hosted_zones, distributions, answers
+
+
+def dns_zone(zones, answers):
+    """ FakeDns zone for synthetic_account output, dangling CNAMEs point at names it doesn't have """
+    zone = {}
+    for hosted in zones:
+        for rrset in hosted['records']:
+            name = rrset['Name'].rstrip('.')
+            if rrset['Type'] == 'CNAME':
+                zone[name] = ('CNAME', rrset['ResourceRecords'][0]['Value'].rstrip('.'))
+            elif rrset['Type'] == 'A':
+                zone[name] = ('A', answers[name][2])
+    for host, cnames, ips in answers.values():
+        if cnames:
+            zone[host] = ('A', ips)
+    return zone
@@ -1,49 +1,143 @@
 #!/usr/bin/env python
 
-from netaddr import *
-from ipaddress import *
+import sys
+import csv
+import socket
+import json
+import fnmatch
+import argparse
+from auditlib.iprange import block_to_range, compact_ranges, int_to_ip
 
 # This converts a list of CIDR blocks into 8, 16, 24, or 32 networks (e.g. /17 is broken down into 128 /24 networks)
 # WAF IPSet rules can only accept standard that network notation
+# Duplicate, overlapping and adjacent blocks (also across countries) are merged first, then each merged
+# range is written as the fewest /8, /16, /24 and /32 blocks that cover exactly the same addresses
+# A merged range that needs more blocks than fit in one IPSet (an IPv6 /100 is 2^28 /128s) is
+# skipped with a message on stderr instead of being written out
+# Input is read one row at a time from a csv file or stdin and output is written as it is produced,
+# memory only grows with the number of input blocks (and stays constant with --sorted input)
 # http://docs.aws.amazon.com/waf/latest/APIReference/API_IPSet.html
 # http://bradthemad.org/tech/notes/cidr_subnets.php
 # https://docs.python.org/3/library/ipaddress.html
 
+# WAF limits: addresses per UpdateIPSet call and per IPSet
+WAF_UPDATE_LIMIT = 1000
+WAF_IPSET_LIMIT = 10000
+
+parser = argparse.ArgumentParser()
+parser.add_argument('file', nargs='?', default='EmbargoedCountries_20170606.csv', help='csv of country,block, - for stdin')
+parser.add_argument('--country-column', default=0, type=int, help='csv column with the country, 0 based')
+parser.add_argument('--block-column', default=1, type=int, help='csv column with the CIDR block, a one column csv is always just blocks')
+parser.add_argument('--country', action='append', default=[], help='only these countries, glob e.g. IR or "Korea*", repeat for more')
+parser.add_argument('--exclude-country', action='append', default=[], help='skip these countries, e.g. "*Republic*", repeat for more')
+parser.add_argument('--sorted', action='store_true', help='input is sorted by address, merge while reading in constant memory')
+parser.add_argument('--format', default='text', choices=['text', 'waf'],
+                    help='text, one block per line (default), or waf, one json UpdateIPSet Updates batch per line')
+parser.add_argument('--batch-size', default=WAF_UPDATE_LIMIT, type=int, help='blocks per waf batch')
+parser.add_argument('--ipset-size', default=WAF_IPSET_LIMIT, type=int, help='blocks per IPSet, batches never span two IPSets')
+parser.add_argument('--stats', action='store_true', help='print entry counts before/after compaction on stderr')
+
+def read_lines(path):
+    if path == '-':
+        return sys.stdin
+    return open(path, 'r')
+
+def country_filter(include, exclude):
+    include = [pattern.lower() for pattern in include]
+    exclude = [pattern.lower() for pattern in exclude]
+
+    def allowed(country):
+        country = country.lower()
+        if include and not any(fnmatch.fnmatchcase(country, pattern) for pattern in include):
+            return False
+        return not any(fnmatch.fnmatchcase(country, pattern) for pattern in exclude)
+    return allowed
+
 # format of file IR,5.202.0.0/16
-EMBARGOED_FILE = open('EmbargoedCountries_20170606.csv', 'r')
-
-def smallblocks(block, smallermask):
-    networks = list(ip_network(unicode(block)).subnets(new_prefix=smallermask))
-    return networks
-
-def checkmask(block, mask):
-    networks = []
-    if mask > 16 and mask < 24:
-        networks = smallblocks(block, 24)
-    elif mask > 8 and mask < 16:
-        networks = smallblocks(block, 16)
-    elif mask > 0 and mask < 8:
-        networks = smallblocks(block, 8)
+# yields (version, first, last) for each CIDR block, counting rows in stats, rows whose block isn't an address (headers) are skipped
+def read_blocks(lines, country_column, block_column, allowed, stats):
+    for row in csv.reader(line for line in lines if not line.startswith("#")):
+        if not row:
+            continue
+        stats['rows'] += 1
+        if len(row) == 1:
+            country, block = '', row[0].strip()
+        elif len(row) > max(country_column, block_column):
+            country, block = row[country_column].strip(), row[block_column].strip()
+        else:
+            country, block = '', ''
+        if country and not allowed(country):
+            stats['filtered'] += 1
+            continue
+        try:
+            block_range = block_to_range(block)
+        except (ValueError, socket.error):
+            stats['skipped'] += 1
+            sys.stderr.write("Skipping row %d, not a CIDR block: %s\n" % (stats['rows'], ','.join(row)))
+            continue
+        stats['blocks'] += 1
+        yield block_range
+
+# yields (ipset number, list of at most batch_size blocks), a new IPSet every ipset_size blocks
+def batches(blocks, batch_size, ipset_size):
+    batch = []
+    ipset = 0
+    in_ipset = 0
+    for block in blocks:
+        if in_ipset == ipset_size:
+            if batch:
+                yield ipset, batch
+            batch = []
+            ipset += 1
+            in_ipset = 0
+        batch.append(block)
+        in_ipset += 1
+        if len(batch) == batch_size:
+            yield ipset, batch
+            batch = []
+    if batch:
+        yield ipset, batch
+
+def waf_updates(batch):
+    return [{'Action': 'INSERT', 'IPSetDescriptor': {'Type': 'IPV6' if ':' in block else 'IPV4', 'Value': block}}
+            for block in batch]
+
+def report_oversized(stats, ipset_size):
+    def oversized(version, first, last, count):
+        stats['oversized'] += 1
+        sys.stderr.write("Skipping %s - %s, needs %d WAF entries, more than --ipset-size %d\n"
+                         % (int_to_ip(version, first), int_to_ip(version, last), count, ipset_size))
+    return oversized
+
+def counted(blocks, stats):
+    for block in blocks:
+        version, first, last = block_to_range(block)
+        stats['entries'] += 1
+        stats['addresses'] += last - first + 1
+        yield block
+
+def main():
+    args = parser.parse_args()
+    stats = {'rows': 0, 'filtered': 0, 'skipped': 0, 'blocks': 0, 'oversized': 0, 'entries': 0, 'addresses': 0}
+    lines = read_lines(args.file)
+    blocks = read_blocks(lines, args.country_column, args.block_column,
+                         country_filter(args.country, args.exclude_country), stats)
+    ipset_size = max(1, args.ipset_size)
+    compacted = compact_ranges(blocks, presorted=args.sorted, limit=ipset_size,
+                               oversized=report_oversized(stats, ipset_size))
+    if args.stats:
+        compacted = counted(compacted, stats)
+    if args.format == 'text':
+        for block in compacted:
+            print block
     else:
-        print "Invalid mask for breaking down to smaller mask: " + block + str(mask)
-        exit(1)
-    return networks
-
-for line in EMBARGOED_FILE:
-    if not line.startswith("#"):
-        if not 'Republic' in line:
-            country, ip_addr, mask = line.rstrip().replace('/', ',').split(',')
-            block = str(ip_addr + '/' + mask)
-            mask = int(mask)
-            if mask in [8, 16, 24, 32]:
-                print block
-            elif mask > 24 and mask < 32:
-                for ip in IPNetwork(block):
-                    print '%s/32' % ip
-            elif mask > 0 and mask < 24:
-                networks = checkmask(block, mask)
-                for net in networks:
-                    print net
-            else:
-                print "Something went wrong: " + block + str(mask)
-                exit(1)
+        for ipset, batch in batches(compacted, max(1, args.batch_size), ipset_size):
+            print json.dumps({'ipset': ipset, 'updates': waf_updates(batch)})
+    if lines is not sys.stdin:
+        lines.close()
+    if args.stats:
+        sys.stderr.write("rows: %(rows)d, filtered by country: %(filtered)d, skipped: %(skipped)d, "
+                         "input blocks: %(blocks)d, too large: %(oversized)d, WAF entries: %(entries)d, addresses: %(addresses)d\n" % stats)
+
+if __name__ == '__main__':
+    main()
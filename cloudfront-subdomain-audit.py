@@ -3,128 +3,297 @@
 # Audit Subdomain Takeover risk from 1 or more AWS accounts
 # Find Route53 records pointing to CloudFront and whether or not all CF Aliases are registered
 # Note: All aliases in chain are found by DNS resolution and Cloudfront status checked by CIDR block
+# CNAME chains are walked hop by hop through one TTL cache for all profiles (auditlib/dnschain.py),
+# a record whose chain ends at a name that doesn't exist (NXDOMAIN) is reported as dangling
 # Option to provide list of aws profiles from ~/.aws/credentials if desired
 # https://labs.detectify.com/2014/10/21/hostile-subdomain-takeover-using-herokugithubdesk-more/
 
 import json
 import logging
 import argparse
-import socket
+import time
 import urllib
-import netaddr
+from functools import partial
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import docstring
-import boto3
+from auditlib.iprange import PrefixIndex
+from auditlib.resolver import DnsPool
+from auditlib import resolver
+from auditlib.sessions import SessionPool
+from auditlib import route53
+from auditlib.cloudfront import AliasSet, iter_aliases
+from auditlib.cache import FileCache, parse_max_age
+from auditlib.incremental import AuditState
+from auditlib import findings
+from auditlib import profiling
 
 # get AWS accounts to run on
 PARSER = argparse.ArgumentParser()
 PARSER.add_argument(
     '--profiles', default='default',
     help='List of comma separated aws profiles "dev,stage,prod"')
+PARSER.add_argument(
+    '--workers', default=20, type=int,
+    help='Number of concurrent DNS lookups')
+PARSER.add_argument(
+    '--profile-workers', default=8, type=int,
+    help='Number of AWS profiles to collect CloudFront and Route53 data from at once')
+PARSER.add_argument(
+    '--cache-dir', default=None,
+    help='Directory to cache the CloudFront IP list and AWS inventory in, e.g. ~/.cache/aws-audit')
+PARSER.add_argument(
+    '--max-age', default=None,
+    help='Seconds cached data stays fresh, "900" for all or per source "cf-ips=86400,cloudfront=900,route53=900"')
+PARSER.add_argument(
+    '--refresh', action='store_true',
+    help='Ignore cached data and fetch everything again, still updates the cache')
+PARSER.add_argument(
+    '--incremental', default=None, metavar='STATE_FILE',
+    help='Only re-resolve added/modified records plus a sample of the rest, '
+         'print only new and resolved RISK findings since the run that wrote STATE_FILE')
+PARSER.add_argument(
+    '--sample-percent', default=5, type=int,
+    help='With --incremental, percent of unchanged records re-resolved each run in rotation')
+PARSER.add_argument(
+    '-l', '--log', default='WARNING',
+    help='loglevel, eg DEBUG, INFO (shows per profile timings), WARNING, ERROR')
+resolver.add_arguments(PARSER)
+findings.add_arguments(PARSER)
+profiling.add_arguments(PARSER)
+
+# RISK findings go through this writer, replaced in main() when --output is set
+FINDINGS = findings.FindingsWriter('cloudfront-subdomain-audit')
 
-def get_cf_blks():
+# phase timings and AWS call counts, only collected with --profile-report
+PROFILE = profiling.Profiler()
+
+# one session per profile and one client per (profile, service), reused for every call in the run
+# aws-audit.py replaces it with the pool its other checks use
+SESSIONS = SessionPool(PROFILE)
+
+def get_cf_blks(cache=None):
     """
     Download CloudFront CIDR blocks
     http://docs.aws.amazon.com/AmazonCloudFront/latest/DeveloperGuide/LocationsOfEdgeServers.html
+    With a cache, a stale copy is revalidated with ETag/If-Modified-Since instead of re-downloaded
     """
     url = 'http://d7uri8nf7uskq.cloudfront.net/tools/list-cloudfront-ips'
+    if cache:
+        return cache.fetch_url('cf-ips', url, lambda body: json.loads(body)['CLOUDFRONT_GLOBAL_IP_LIST'])
     response = urllib.urlopen(url)
     data = json.loads(response.read())
     return data['CLOUDFRONT_GLOBAL_IP_LIST']
 
+def get_client(profile, service):
+    """ Return the cached boto3 client for this profile and service """
+    return SESSIONS.client(profile, service)
+
+@PROFILE.timed('ip_in_block')
 def ip_in_block(ips, blocks):
-    """ Pass list of IPs and CIDR blocks, check if one or more IP is in a CIDR block """
+    """
+    Pass list of IPs and CIDR blocks (or a PrefixIndex built from them),
+    check if one or more IP is in a CIDR block
+    """
+    if not isinstance(blocks, PrefixIndex):
+        blocks = PrefixIndex(blocks)
     in_block = 'no'
     for ip in ips:
         logging.debug("ip: " + ip)
-        for blk in blocks:
-            if netaddr.IPAddress(ip) in netaddr.IPNetwork(blk):
-                in_block = 'yes'
+        if ip in blocks:
+            in_block = 'yes'
+            break
     return in_block
 
 def add_cf_aliases(profile):
-    """ Gets all CF distributions from AWS and adds DNS aliases to list """
-    cfaliases = []
-    boto3.setup_default_session(profile_name=profile)
-    client = boto3.client('cloudfront')
-    response = client.list_distributions()
-    distributions = response['DistributionList']['Items']
-    for dist in distributions:
-        if dist['Aliases']['Quantity'] > 0:
-            cfaliases[1:1] = (dist['Aliases']['Items'])
-            logging.debug(str(dist['Aliases']['Items']))
-    return cfaliases
-
-def return_a_and_cnames(profile):
-    """ Gets all route53 zones, calls get_records, returns A and CNAME records lists """
-    boto3.setup_default_session(profile_name=profile)
-    client = boto3.client('route53')
-    response = client.list_hosted_zones()
-    zones = response['HostedZones']
-    cname_records = []
-    a_records = []
-    for zone in zones:
-        logging.info("Retrieving R53 Zone: " + str(zone))
-        cname_records = cname_records + get_records(profile, zone['Id'], 'CNAME')
-        a_records = a_records + get_records(profile, zone['Id'], 'A')
-    return a_records, cname_records
-
-def get_records(profile, zoneid, rrtype):
-    """ get records for specified ID and record type """
-    boto3.setup_default_session(profile_name=profile)
-    client = boto3.client('route53')
-    response = client.list_resource_record_sets(HostedZoneId=zoneid)
-    rrs = response['ResourceRecordSets']
-    record_list = []
-    for rr in rrs:
-        if rr['Type'] == rrtype:
-            record_list.append(rr['Name'])
-    return record_list
-
-def get_dns(domain):
-    """
-    inspired by LoanWolffe http://stackoverflow.com/questions/3837744/how-to-resolve-dns-in-python
-    This method returns 3 lists, hostname, aliases/cnames,
-    and one or more IP address strings that respond
-    as the given domain name
+    """ Pages through all CF distributions from AWS and returns their DNS aliases as a list """
+    return list(iter_aliases(get_client(profile, 'cloudfront')))
+
+def get_zone_records(profile):
+    """ Pages through all route53 zones once, returns dict of 'A'/'CNAME': [Record] """
+    return route53.collect_records(get_client(profile, 'route53'))
+
+@PROFILE.timed('collect profile')
+def collect_profile(profile, cache=None):
+    """
+    Fetch CloudFront aliases and Route53 A/CNAME records for one profile, from cache if fresh
+    returns cf_aliases, dict of 'A'/'CNAME': [Record]
     """
+    start = time.time()
+    if cache:
+        cf_aliases = cache.fetch('cloudfront-' + profile, partial(add_cf_aliases, profile), 'cloudfront')
+        # keyed apart from older cache files, whose records don't say if their zone is private
+        cached = cache.fetch('route53-rrsets-' + profile, partial(get_zone_records, profile), 'route53')
+        records = dict((rrtype, [route53.Record(*rec) for rec in recs]) for rrtype, recs in cached.items())
+    else:
+        cf_aliases = add_cf_aliases(profile)
+        records = get_zone_records(profile)
+    elapsed = time.time() - start
+    logging.info("Collected profile %s in %.1fs: %d aliases, %d A, %d CNAME records",
+                 profile, elapsed, len(cf_aliases), len(records['A']), len(records['CNAME']))
+    return cf_aliases, records
+
+def collect_profiles(profiles, workers, cache=None):
+    """ Collect all profiles concurrently, returns OrderedDict of profile: (cf_aliases, records) """
+    pool = ThreadPool(max(1, min(workers, len(profiles))))
     try:
-        data = socket.gethostbyname_ex(domain)
-        host = data[0]
-        cnames = data[1]
-        ipx = data[2]
-        return host, cnames, ipx
-    except Exception:
-        return [False, False, False]
+        results = pool.map(partial(collect_profile, cache=cache), profiles, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return OrderedDict(zip(profiles, results))
 
-def audit_records(records, cfcidrblocks, cf_aliases):
+def seed_records(chain, inventory):
     """
-    Pass list or records, Cloudfront CIDR blocks, and list of Cloudfront Aliases
+    Give the chain resolver the CNAME target or addresses of every public Route53 record, so many
+    records sharing a target cost one query for it; alias records and names with several (weighted etc)
+    record sets are left to DNS. Private zone records aren't seeded, their targets are usually
+    only resolvable inside the VPC and would look dangling from here
+    """
+    values = {}
+    for profile in inventory:
+        records = inventory[profile][1]
+        for rec in records['A'] + records['CNAME']:
+            if rec.private:
+                continue
+            values.setdefault(rec.name.rstrip('.').lower(), set()).add((rec.rrtype, rec.value))
+    for name, found in values.items():
+        if len(found) != 1:
+            continue
+        rrtype, value = found.pop()
+        if rrtype == 'CNAME':
+            chain.seed(name, target=value)
+        elif not value.startswith('ALIAS '):
+            chain.seed(name, ips=value.split(','))
+
+def check_record(rec, answer, cfcidrblocks, cf_aliases, private=False):
+    """
+    Pass a record name, its DNS answer (host, cnames, ips), Cloudfront CIDR blocks and AliasSet
+    returns list of RISK findings if it points at cloudfront without a registered alias
+    private is True for names only in private zones, which are never reported as dangling
+    """
+    risks = []
+    host, cnames, ipx = answer
+    logging.debug(host, cnames, ipx)
+    # only the chain resolver answers like this, a CNAME chain ending at a name that doesn't exist
+    if cnames and not ipx and not private:
+        risks.append("RISK: " + rec + ": dangling CNAME to " + host.rstrip('.') + " which does not exist")
+    # if not empty
+    if ipx:
+        # convert to unicode
+        uipx = [unicode(item) for item in ipx]
+        if ip_in_block(uipx, cfcidrblocks) == 'yes':
+            logging.info(rec + ": points to cloudfront")
+            if cnames:
+                for cname in cnames:
+                    cname = cname.rstrip('.')
+                    if cname in cf_aliases:
+                        logging.info(rec + ": alias: " + cname + " is in our CF Distros")
+                    else:
+                        risks.append("RISK: " + rec + ": alias: " + cname + " not in our CF Distros")
+            else:
+                if rec in cf_aliases:
+                    logging.info("OK: " + rec + " is in our CF Distros")
+                else:
+                    risks.append("RISK: " + rec + " not in our CF Distros")
+    return risks
+
+def audit_records(records, cfcidrblocks, cf_aliases, dns=None, profile='', private=()):
+    """
+    Pass list or records, Cloudfront CIDR blocks (PrefixIndex), and Cloudfront Aliases (AliasSet)
     It'll check if it's pointed at cloudfront and if we have all DNS entries
     registered as a cloudfront domain alias
+    All records are resolved up front on the DnsPool, then audited in sorted order
+    private is the set of names only found in private zones (private_names)
     """
-    for rec in sorted(records):
-        rec = rec.rstrip('.')
-        logging.debug("Getting DNS info for: " + rec)
-        host, cnames, ipx = get_dns(rec)
-        logging.debug(host, cnames, ipx)
-        # if not empty
-        if ipx:
-            # convert to unicode
-            uipx = [unicode(item) for item in ipx]
-            if ip_in_block(uipx, cfcidrblocks) == 'yes':
-                logging.info(rec + ": points to cloudfront")
-                if cnames:
-                    for cname in cnames:
-                        cname = cname.rstrip('.')
-                        if cname in cf_aliases:
-                            logging.info(rec + ": alias: " + cname + " is in our CF Distros")
-                        else:
-                            print "RISK: " + rec + ": alias: " + cname + " not in our CF Distros"
-                else:
-                    if rec in cf_aliases:
-                        logging.info("OK: " + rec + " is in our CF Distros")
-                    else:
-                        print "RISK: " + rec + " not in our CF Distros"
+    if dns is None:
+        dns = DnsPool()
+    records = [rec.rstrip('.') for rec in sorted(records)]
+    logging.debug("Resolving %d records", len(records))
+    with PROFILE.phase('resolve records'):
+        resolved = dns.resolve_all(records)
+    with PROFILE.phase('check records'):
+        for rec in records:
+            logging.debug("Getting DNS info for: " + rec)
+            for finding in check_record(rec, resolved[rec], cfcidrblocks, cf_aliases, rec in private):
+                FINDINGS.emit(rec, 'high', finding, profile)
+
+def private_names(inventory):
+    """ Set of record names that are only in private hosted zones, across all profiles """
+    private = set()
+    public = set()
+    for profile in inventory:
+        records = inventory[profile][1]
+        for rec in records['A'] + records['CNAME']:
+            (private if rec.private else public).add(rec.name.rstrip('.'))
+    return private - public
+
+def record_signatures(inventory):
+    """
+    Returns dict of record name: 'TYPE target|...' across all profiles, used to spot modified records,
+    and dict of record name: profile it was first found in
+    """
+    signatures = {}
+    owners = {}
+    for profile in sorted(inventory):
+        records = inventory[profile][1]
+        for rrtype in sorted(records):
+            for rec in records[rrtype]:
+                name = rec.name.rstrip('.')
+                signatures.setdefault(name, []).append(rec.rrtype + ' ' + rec.value)
+                owners.setdefault(name, profile)
+    return dict((name, '|'.join(sorted(values))) for name, values in signatures.items()), owners
+
+def incremental_audit(inventory, cfcidrblocks, cf_aliases, dns, state):
+    """
+    Re-resolve only added/modified records plus a rotating sample of unchanged ones,
+    reuse the previous DNS answers for the rest, and print only findings that are
+    new (RISK: ...) or gone (RESOLVED: ...) since the previous run
+    """
+    signatures, owners = record_signatures(inventory)
+    private = private_names(inventory)
+    changed, sampled = state.plan(signatures, cf_aliases)
+    resolved = dict((name, state.resolved[name]) for name in signatures if name in state.resolved)
+    with PROFILE.phase('resolve records'):
+        resolved.update(dns.resolve_all(changed + sampled))
+    risks = []
+    with PROFILE.phase('check records'):
+        for rec in sorted(signatures):
+            for finding in check_record(rec, resolved[rec], cfcidrblocks, cf_aliases, rec in private):
+                risks.append((rec, finding))
+    new, gone = state.diff_findings(risks)
+    for rec, finding in new:
+        FINDINGS.emit(rec, 'high', finding, owners.get(rec, ''))
+    for rec, finding in gone:
+        FINDINGS.emit(rec, 'info', "RESOLVED: " + finding[len("RISK: "):], owners.get(rec, ''))
+    state.save(signatures, resolved, cf_aliases, risks)
+
+def audit_inventory(inventory, cfcidrblocks, dns, chain=None, seed=True, state=None):
+    """
+    Audit every profile's records from collect_profiles against the CF aliases of all of them
+    chain is the ChainResolver behind dns if any, seeded with the Route53 records unless seed is False,
+    with an AuditState only changed and sampled records are resolved (incremental_audit)
+    """
+    if chain and seed:
+        seed_records(chain, inventory)
+    # collect CF aliases from all profiles into 1 set, wildcard aliases included
+    cf_aliases = AliasSet()
+    for profile in inventory:
+        cf_aliases.update(inventory[profile][0])
+    logging.debug(sorted(cf_aliases))
+    # audit records
+    logging.debug("#### CNAME and A records ####")
+    if state:
+        incremental_audit(inventory, cfcidrblocks, cf_aliases, dns, state)
+    else:
+        private = private_names(inventory)
+        for profile in inventory:
+            FINDINGS.note("Auditing " + profile + " records")
+            records = inventory[profile][1]
+            audit_records([rec.name for rec in records['A']], cfcidrblocks, cf_aliases, dns, profile, private)
+            audit_records([rec.name for rec in records['CNAME']], cfcidrblocks, cf_aliases, dns, profile, private)
+    if chain:
+        logging.info(chain.stats())
 
 def main():
     """
@@ -132,30 +301,34 @@ def main():
     Checks if any Route53 record resolved to cloudfront CIDR blocks
     If so checks our cloudfront domain aliases list to see if it is registered
     """
-    logging.basicConfig(level=logging.WARN)
+    global FINDINGS
+    args = PARSER.parse_args()
+    FINDINGS = findings.from_args(args, 'cloudfront-subdomain-audit')
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.WARN))
     logging.getLogger('boto3').setLevel(logging.WARN)
     logging.getLogger('botocore').setLevel(logging.WARN)
+    if args.profile_report:
+        PROFILE.start(args.profile_report)
 
-    args = PARSER.parse_args()
     profiles = args.profiles.replace(" ", "").split(",")
+    cache = None
+    if args.cache_dir:
+        cache = FileCache(args.cache_dir, parse_max_age(args.max_age), args.refresh)
     # get List of CF CIDR blocks
     logging.info("Downloading CloudFront CIDR blocks")
-    cfcidrblocks = get_cf_blks()
-    cf_aliases = []
-    # collect CF aliases from all profiles into 1 list
-    for profile in profiles:
-        print "Retrieving CloudFront data from AWS profile: " + profile
-        cf_aliases = cf_aliases + add_cf_aliases(profile)
-    # remove duplicates
-    cf_aliases = list(set(cf_aliases))
-    logging.debug(cf_aliases)
-    # audit records
-    logging.debug("#### CNAME and A records ####")
+    with PROFILE.phase('cloudfront ips'):
+        cfcidrblocks = PrefixIndex(get_cf_blks(cache))
+    dns, chain = resolver.from_args(args, args.workers, PROFILE)
     for profile in profiles:
-        print "Auditing " + profile + " records"
-        a_records, cname_records = return_a_and_cnames(profile)
-        audit_records(a_records, cfcidrblocks, cf_aliases)
-        audit_records(cname_records, cfcidrblocks, cf_aliases)
+        FINDINGS.note("Retrieving CloudFront data from AWS profile: " + profile)
+    start = time.time()
+    with PROFILE.phase('collect profiles'):
+        inventory = collect_profiles(profiles, args.profile_workers, cache)
+    logging.info("Collected %d profiles in %.1fs", len(profiles), time.time() - start)
+    if cache:
+        logging.info(cache.stats())
+    state = AuditState(args.incremental, args.sample_percent) if args.incremental else None
+    audit_inventory(inventory, cfcidrblocks, dns, chain, not args.no_route53_seed, state)
 
 if __name__ == '__main__':
     main()
@@ -4,17 +4,36 @@ import boto3
 import re
 import argparse
 import logging
-from botocore.client import Config
+from multiprocessing.pool import ThreadPool
+from auditlib import discovery
+from auditlib import profiling
+from auditlib.journal import ProgressJournal
+from auditlib.s3clients import S3ClientPool
 
 # This script enables s3 bucket versioning and sets a LifeCycle policy to remove old versions after X days
 # Some AWS regions e.g. eu-central-1 need different parameters for s3v4, option to override that
 # When applying LifeCycle policies it's dangeorus as it is an all or nothing override, so there is a failsafe to not apply policy if other ones already exist
+# With --pattern or --bucket-file it rolls out to many buckets in one run: status is checked concurrently,
+# compliant buckets are skipped and --journal records progress so an interrupted rollout picks up where it stopped
 
 # attempts to put policies on a bucket and test result
 parser = argparse.ArgumentParser()
 parser.add_argument('-l', '--log', default='WARNING', help='loglevel, eg DEBUG, INFO, WARNING, ERROR, CRITICAL')
 parser.add_argument('--bucket', default='adobespark-dev-mpatters')
+parser.add_argument('-p', '--pattern', default=None, help='roll out to every bucket with pattern in its name, instead of --bucket')
+parser.add_argument('--bucket-file', default=None, help='roll out to the buckets listed in this file, one per line')
 parser.add_argument('--days', default=90)
+parser.add_argument('-w', '--workers', default=20, type=int, help='number of buckets to check at once')
+parser.add_argument('--apply-workers', default=5, type=int, help='number of buckets to change at once')
+parser.add_argument('--journal', default=None, help='progress journal, buckets finished by an earlier run are skipped')
+discovery.add_arguments(parser)
+profiling.add_arguments(parser)
+
+# id of the rule this script puts, a bucket whose only rule is this one can be updated safely
+RULE_ID = 'expireVersionedWholeBucket'
+
+# phase timings and AWS call counts, only collected with --profile-report
+PROFILE = profiling.Profiler()
 
 # convert lower to upper case if passed
 def initLogging(loglevel):
@@ -23,59 +42,157 @@ def initLogging(loglevel):
         raise ValueError('Invalid log level: %s' % loglevel)
     logging.basicConfig(level=numeric_level)
 
-def bucketVersioning(s3resource,bucket,action):
-    s3 = s3resource
-    bucket_versioning = s3.BucketVersioning(bucket)
+def bucketVersioning(s3client,bucket,action):
     if action=='status':
-        bucket_versioning.load()
-        return "Bucket versioning status: %s", bucket_versioning.status
+        status = s3client.get_bucket_versioning(Bucket=bucket).get('Status')
+        logging.debug("Bucket versioning status: %s", status)
+        return status
     elif action=='enable':
-       bucket_versioning.enable(bucket)
+       s3client.put_bucket_versioning(Bucket=bucket, VersioningConfiguration={'Status': 'Enabled'})
        logging.info("Versioning is enabled on %s", bucket)
        return 0
     elif action=='disable':
-       bucket_versioning.disable(bucket)
+       s3client.put_bucket_versioning(Bucket=bucket, VersioningConfiguration={'Status': 'Suspended'})
        return 0
     else:
         logging.error("No match on %s", bucket)
         return 0
-        
-    
-# count existing rules on bucket prior to making changes
-def bucketPolicyRuleCount(bucket,s3conn):
-    logging.debug("bucket: %s, s3conn: %s", bucket, s3conn)
-    bucket_lifecycle = s3conn.BucketLifecycle(bucket)
+
+# existing lifecycle rules on bucket, read once
+def bucketLifecycleRules(bucket,s3client):
     try:
-        bucket_lifecycle.load()
+        rules = s3client.get_bucket_lifecycle_configuration(Bucket=bucket)['Rules']
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchLifecycleConfiguration':
             logging.debug("Rule length: 0")
-            return 0
+            return []
         elif e.response['Error']['Code'] == 'PermanentRedirect':
             logging.warn("PermanentRedirect, not a blocker, but investigate this bucket offline - may be a duplicte bucket: %s", bucket)
-            return 0
+            return []
         else:
             raise Exception("Unexpected error: %s" % e)
-            
-    bucket_lifecycle.load()
-    rules = bucket_lifecycle.rules
     logging.debug("Rules: %s", str(rules))
     logging.debug("Rule length: %s", str(len(rules)))
-    return len(rules)
+    return rules
+
+# count existing rules on bucket prior to making changes
+def bucketPolicyRuleCount(bucket,s3client):
+    return len(bucketLifecycleRules(bucket, s3client))
 
-def versionExpirePolicy(s3client, s3conn, bucket, days):
-    if bucketPolicyRuleCount(bucket,s3conn) > 0:
+def versionExpireRule(days):
+    return { 'ID':RULE_ID, 'Prefix':'', 'Status':'Enabled', 'NoncurrentVersionExpiration': { 'NoncurrentDays': days }, 'Expiration': { 'ExpiredObjectDeleteMarker': True }}
+
+# rules is what the bucket has now when the caller already read it, so it isn't read again
+def versionExpirePolicy(s3client, bucket, days, rules=None):
+    if rules is None:
+        rules = bucketLifecycleRules(bucket, s3client)
+    if [rule for rule in rules if rule.get('ID') != RULE_ID]:
         logging.error("There are already LifeCycle policies on this bucket, too dangerous, exiting, manual review needed on: %s", bucket)
         return False
-    expireVersionDays =  { 'ID':'expireVersionedWholeBucket', 'Prefix':'', 'Status':'Enabled', 'NoncurrentVersionExpiration': { 'NoncurrentDays': days }, 'Expiration': { 'ExpiredObjectDeleteMarker': True }}
-    rules = [expireVersionDays]
     response = s3client.put_bucket_lifecycle_configuration(
         Bucket=bucket,
-        LifecycleConfiguration={ 'Rules':rules }
+        LifecycleConfiguration={ 'Rules':[versionExpireRule(days)] }
     )
     print("Success, note: if this bucket was created by cloudformation, you should update that CF template also.")
     return response
-    
+
+# current state of one bucket, dict with region, versioning status, lifecycle rules and what needs doing
+@PROFILE.timed('checkBucket')
+def checkBucket(clients, bucket, days):
+    client = clients.bucket_client(bucket)
+    state = {'bucket': bucket, 'client': client, 'versioning': bucketVersioning(client, bucket, 'status'),
+             'rules': bucketLifecycleRules(bucket, client)}
+    ours = [rule for rule in state['rules'] if rule.get('ID') == RULE_ID]
+    state['enable'] = state['versioning'] != 'Enabled'
+    state['blocked'] = len(ours) != len(state['rules'])
+    state['lifecycle'] = not state['blocked'] and not (
+        ours and ours[0].get('Status') == 'Enabled'
+        and ours[0].get('NoncurrentVersionExpiration', {}).get('NoncurrentDays') == days)
+    return state
+
+# enable versioning and put the lifecycle rule where needed, returns journal status
+@PROFILE.timed('applyBucket')
+def applyBucket(state, days):
+    bucket = state['bucket']
+    if state['enable']:
+        bucketVersioning(state['client'], bucket, 'enable')
+    if state['blocked']:
+        logging.error("There are already LifeCycle policies on this bucket, too dangerous, exiting, manual review needed on: %s", bucket)
+        return 'blocked'
+    if state['lifecycle']:
+        versionExpirePolicy(state['client'], bucket, days, state['rules'])
+    return 'applied'
+
+# one bucket name per line, blank lines and # comments skipped
+def readBucketFile(path):
+    with open(path) as bucket_file:
+        buckets = [line.split('#', 1)[0].strip() for line in bucket_file]
+    return [bucket for bucket in buckets if bucket]
+
+# check every bucket, then change the ones that need it, returns number of buckets that failed or need review
+def rollout(clients, buckets, days, workers, apply_workers, journal=None):
+    if journal:
+        todo = [bucket for bucket in buckets if not journal.finished(bucket, days=days)]
+        if len(todo) != len(buckets):
+            print("Skipping %d buckets finished by an earlier run" % (len(buckets) - len(todo)))
+        buckets = todo
+    failed = []
+    pending = []
+
+    def check(bucket):
+        try:
+            return checkBucket(clients, bucket, days)
+        except Exception as e:
+            return {'bucket': bucket, 'error': e}
+
+    def apply(state):
+        try:
+            return state['bucket'], applyBucket(state, days), None
+        except Exception as e:
+            return state['bucket'], 'failed', e
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        for state in pool.imap_unordered(check, buckets):
+            bucket = state['bucket']
+            if 'error' in state:
+                logging.error("Can't check %s: %s", bucket, state['error'])
+                failed.append(bucket)
+                if journal:
+                    journal.record(bucket, 'failed', days=days, error=str(state['error']))
+            elif state['enable'] or state['lifecycle']:
+                pending.append(state)
+            elif state['blocked']:
+                logging.error("There are already LifeCycle policies on this bucket, too dangerous, exiting, manual review needed on: %s", bucket)
+                failed.append(bucket)
+                if journal:
+                    journal.record(bucket, 'blocked', days=days)
+            else:
+                print("%s already compliant, versioning Enabled, old versions expire after %s days" % (bucket, days))
+                if journal:
+                    journal.record(bucket, 'compliant', days=days)
+    finally:
+        pool.close()
+        pool.join()
+
+    print("%d buckets to update" % len(pending))
+    pool = ThreadPool(max(1, apply_workers))
+    try:
+        for bucket, status, error in pool.imap_unordered(apply, sorted(pending, key=lambda state: state['bucket'])):
+            if error:
+                logging.error("Update failed on %s: %s", bucket, error)
+            print("%s %s" % (bucket, status))
+            if status != 'applied':
+                failed.append(bucket)
+            if journal and error:
+                journal.record(bucket, status, days=days, error=str(error))
+            elif journal:
+                journal.record(bucket, status, days=days)
+    finally:
+        pool.close()
+        pool.join()
+    return len(failed)
+
 
 def main ():
     args = parser.parse_args()
@@ -83,10 +200,26 @@ def main ():
     bucket = args.bucket
     days = int(args.days)
     initLogging(loglevel)
-    client=boto3.client('s3', config=Config(signature_version='s3v4'))
-    resource = boto3.resource('s3', config=Config(signature_version='s3v4'))
-    bucketVersioning(resource, bucket,'enable')
-    versionExpirePolicy(client, resource, bucket,days)
-    
+    if args.profile_report:
+        PROFILE.start(args.profile_report)
+    session = PROFILE.instrument(boto3.session.Session())
+    clients = S3ClientPool(session, max(args.workers, args.apply_workers))
+    if args.bucket_file:
+        buckets = readBucketFile(args.bucket_file)
+    elif args.pattern is not None or args.match or args.bucket_region or args.bucket_tag:
+        with PROFILE.phase('discover buckets'):
+            found = discovery.from_args(args, clients, [args.pattern], args.workers, session.profile_name)
+        buckets = [found_bucket.name for found_bucket in found]
+    else:
+        buckets = [bucket]
+    if not buckets:
+        exit('No buckets found')
+    journal = ProgressJournal(args.journal) if args.journal else None
+    with PROFILE.phase('rollout'):
+        failed = rollout(clients, buckets, days, args.workers, args.apply_workers, journal)
+    clients.report()
+    if failed:
+        exit(1)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
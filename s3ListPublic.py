@@ -5,15 +5,28 @@ import re
 import json
 import argparse
 import logging
-from botocore.client import Config
+from multiprocessing.pool import ThreadPool
+from auditlib import discovery
+from auditlib import findings
+from auditlib import policy
+from auditlib import profiling
+from auditlib.s3clients import S3ClientPool
 
 # This script is designed audit for buckets with Public ACL or Policy that are Public
 # I took pieces from: https://whiletrue.run/2017/07/20/list-aws-s3-buckets-with-public-acls/
+# Buckets are scanned concurrently, each with a client for its own region, findings print as each bucket finishes
 
 # default args will list all public/open acls and policies
 parser = argparse.ArgumentParser()
 parser.add_argument('-l', '--log', default='ERROR', help='loglevel, eg DEBUG, INFO, WARNING, ERROR, CRITICAL')
 parser.add_argument('-p', '--pattern', default='', help='pattern in bucket name, eg static or leave blank for all buckets')
+parser.add_argument('-w', '--workers', default=20, type=int, help='number of buckets to scan at once')
+discovery.add_arguments(parser)
+findings.add_arguments(parser)
+profiling.add_arguments(parser)
+
+# phase timings and AWS call counts, only collected with --profile-report
+PROFILE = profiling.Profiler()
 
 # convert lower to upper case if passed
 def initLogging(loglevel):
@@ -22,59 +35,79 @@ def initLogging(loglevel):
         raise ValueError('Invalid log level: %s' % loglevel)
     logging.basicConfig(level=numeric_level)
 
-def acl_check(client, bucket, grantee):
-    uri = 'http://acs.amazonaws.com/groups/global/' + str(grantee) + '/'
-    try:
-        acl = bucket.Acl()
-        logging.warn( bucket.Acl() )
-        for grant in acl.grants:
-            logging.warn(str(bucket.name) + "grant: " + str(grant['Grantee']))
-            if grant['Grantee']['Type'].lower() == 'group':
-                if grantee in grant['Grantee']['URI']:
-                    # the grant is assigned to All Users (so it is public!!!)
-                    grant_permission = grant['Permission'].lower()
-                    if grant_permission == 'read':
-                        print(bucket.name + ' Read - ' + grantee + ' Access: List Objects')
-                    elif grant_permission == 'write':
-                        print(bucket.name + ' Write - ' + grantee + ' Access: Write Objects')
-                    elif grant_permission == 'read_acp':
-                        print(bucket.name + ' Read - ' + grantee + ' Access: Read Bucket Permissions')
-                    elif grant_permission == 'write_acp':
-                        print(bucket.name + ' Write - ' + grantee + ' Access: Write Bucket Permissions')
-                    elif grant_permission == 'full_control':
-                        print(bucket.name + ' Public ' + grantee + ': Full Control')
-                    else:
-                        print(bucket.name + ' Wha Happen?' + str(grant) + " " + str(grant_permission))
-    except client.exceptions.NoSuchBucket as e:
-        print "NoSuchBucket Error: " + bucket.name
+# grants come from a single get_bucket_acl per bucket, shared by the AllUsers and AuthenticatedUsers checks
+def acl_check(bucket, grants, grantee):
+    results = []
+    for grant in grants:
+        logging.warn(str(bucket) + " grant: " + str(grant['Grantee']))
+        if grant['Grantee']['Type'].lower() == 'group':
+            if grantee in grant['Grantee']['URI']:
+                # the grant is assigned to All Users (so it is public!!!)
+                grant_permission = grant['Permission'].lower()
+                if grant_permission == 'read':
+                    results.append(bucket + ' Read - ' + grantee + ' Access: List Objects')
+                elif grant_permission == 'write':
+                    results.append(bucket + ' Write - ' + grantee + ' Access: Write Objects')
+                elif grant_permission == 'read_acp':
+                    results.append(bucket + ' Read - ' + grantee + ' Access: Read Bucket Permissions')
+                elif grant_permission == 'write_acp':
+                    results.append(bucket + ' Write - ' + grantee + ' Access: Write Bucket Permissions')
+                elif grant_permission == 'full_control':
+                    results.append(bucket + ' Public ' + grantee + ': Full Control')
+                else:
+                    results.append(bucket + ' Wha Happen?' + str(grant) + " " + str(grant_permission))
+    return results
 
+# returns (severity, finding) for every statement open to anyone ('*', {"AWS": "*"}, NotPrincipal ...)
+# after Deny statements, 'medium' when conditions like aws:SourceIp or aws:SourceVpce restrict it
 def policy_check(client, bucket):
+    results = []
     try:
-        bucket_policy = client.get_bucket_policy(Bucket=bucket.name)
+        bucket_policy = client.get_bucket_policy(Bucket=bucket)
         policy_obj = bucket_policy['Policy']
-        policy = json.loads(policy_obj)
-        if 'Statement' in policy:
-            for p in policy['Statement']:
-                if p['Principal'] == '*': # any public anonymous users!
-                    print bucket.name + " " + str(p['Principal']) + " has : " + str(p['Action'])
+        for exposure in policy.analyze(policy_obj):
+            principal = exposure.principal if exposure.principal == '*' else json.dumps(exposure.principal, sort_keys=True)
+            open_actions = sorted(policy.action_name(a) for a, keys in exposure.actions.items() if not keys)
+            if exposure.level == policy.PUBLIC and exposure.complete and len(open_actions) == len(exposure.actions):
+                results.append(('high', bucket + " " + principal + " has : " + str(exposure.raw_action)))
+            elif exposure.level == policy.PUBLIC:
+                results.append(('high', bucket + " " + principal + " has : " + ", ".join(open_actions)))
+            else:
+                actions = sorted(policy.action_name(a) for a in exposure.actions)
+                results.append(('medium', bucket + " " + principal + " has : " + ", ".join(actions)
+                                + " only with " + ", ".join(sorted(exposure.restrictions))))
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchBucketPolicy':
             logging.warn("No policy is applied to bucket - it's OK for bucket to not have policy")
-            return 0
         else:
             raise Exception("Unexpected error: %s" % e)
+    return results
 
-#return list of bucket _objects_ emtpy list matches all buckets
-def findBuckets(client, resource, pattern):
-    buckets=[]
-    for bucket in resource.buckets.all():
-        logging.debug("bucket found: %s" , bucket.name)
-        if pattern in str(bucket.name):
-            logging.warn("bucket matching: %s pattern: %s", bucket.name, pattern)
-            buckets.append(bucket)
-            acl_check(client, bucket, 'AllUsers')
-            acl_check(client, bucket, 'AuthenticatedUsers')
-            policy_check(client, bucket)
+# ACL and policy checks for one bucket, against a client in the bucket's region
+# returns list of (severity, finding)
+@PROFILE.timed('scanBucket')
+def scanBucket(clients, bucket):
+    try:
+        client = clients.bucket_client(bucket)
+        grants = client.get_bucket_acl(Bucket=bucket)['Grants']
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchBucket':
+            return [('warning', "NoSuchBucket Error: " + bucket)]
+        raise
+    results = acl_check(bucket, grants, 'AllUsers')
+    results = results + acl_check(bucket, grants, 'AuthenticatedUsers')
+    results = [('high', finding) for finding in results]
+    return results + policy_check(client, bucket)
+
+# yields (bucket, [(severity, finding)]) in the order buckets finish, workers buckets at a time
+def scanBuckets(clients, buckets, workers):
+    pool = ThreadPool(max(1, workers))
+    try:
+        for result in pool.imap_unordered(lambda bucket: (bucket, scanBucket(clients, bucket)), buckets):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
 
 
 def main ():
@@ -82,9 +115,19 @@ def main ():
     pattern = args.pattern
     loglevel = args.log
     initLogging(loglevel)
-    client=boto3.client('s3', config=Config(signature_version='s3v4'))
-    resource = boto3.resource('s3', config=Config(signature_version='s3v4'))
-    findBuckets(client, resource, pattern)
-    
+    if args.profile_report:
+        PROFILE.start(args.profile_report)
+    session = PROFILE.instrument(boto3.session.Session())
+    writer = findings.from_args(args, 's3ListPublic', session.profile_name)
+    clients = S3ClientPool(session, args.workers)
+    # emtpy pattern matches all buckets
+    with PROFILE.phase('discover buckets'):
+        buckets = [bucket.name for bucket in discovery.from_args(args, clients, [pattern], args.workers, session.profile_name)]
+    with PROFILE.phase('scan buckets'):
+        for bucket, bucket_findings in scanBuckets(clients, buckets, args.workers):
+            for severity, finding in bucket_findings:
+                writer.emit(bucket, severity, finding)
+    clients.report()
+
 if __name__ == '__main__':
     main()
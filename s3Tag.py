@@ -4,20 +4,36 @@ import boto3
 import re
 import argparse
 import logging
-from botocore.client import Config
+from multiprocessing.pool import ThreadPool
+from auditlib import discovery
+from auditlib import findings
+from auditlib import profiling
+from auditlib.s3clients import S3ClientPool
 
 # This script is designed to add tags to s3 buckets matching naming conventions
 # Because bucket_tagging.put overrides all existing tags, it checks for old ones and combines tags before putting
-# If you just want to audit, set addtags to 'no'
-# ./s3Tag.py --pattern [matchingstring in bucketname] --addtags <yes|no> --tagkey <keyname> --tagvalue <keyvalue>
+# If you just want to audit, set addtags to 'no', passing tags with addtags 'no' shows the plan w/o updating
+# Tags are read once per bucket (concurrently), only buckets whose tags would change are updated
+# ./s3Tag.py --pattern [matchingstring in bucketname] --addtags <yes|no> --tag <key>=<value> [--tag <key>=<value> ...]
 
 # attempts to put policies on a bucket and test result
 parser = argparse.ArgumentParser()
 parser.add_argument('-l', '--log', default='CRITICAL', help='loglevel, eg DEBUG, INFO, WARNING, ERROR, CRITICAL')
 parser.add_argument('-p', '--pattern', default='mikepatterson', help='pattern in bucket name, eg static')
 parser.add_argument('-a', '--addtags', default='no', help='add/update tags on bucket yes or no')
+parser.add_argument('-t', '--tag', action='append', default=[], help='key=value tag, repeat for more e.g. \"Adobe:DataClassification=Private\"')
 parser.add_argument('-k', '--tagkey', default='', help='key for tag e.g. \"Adobe:DataClassification\"')
 parser.add_argument('-v', '--tagvalue', default='', help='value for tag e.g. \"Private\"')
+parser.add_argument('-w', '--workers', default=20, type=int, help='number of buckets to read/tag at once')
+discovery.add_arguments(parser)
+findings.add_arguments(parser)
+profiling.add_arguments(parser)
+
+# tag listings and warnings go through this writer, replaced in main() when --output is set
+FINDINGS = findings.FindingsWriter('s3Tag')
+
+# phase timings and AWS call counts, only collected with --profile-report
+PROFILE = profiling.Profiler()
 
 # convert lower to upper case if passed
 def initLogging(loglevel):
@@ -26,84 +42,175 @@ def initLogging(loglevel):
         raise ValueError('Invalid log level: %s' % loglevel)
     logging.basicConfig(level=numeric_level)
 
-#return list of buckets matching string
-def findBuckets(resource, pattern):
-    if not pattern:
-        exit('pattern can not be empty')
-    buckets=[]
-    for bucket in resource.buckets.all():
-        logging.debug("bucket found: %s" , bucket.name)
-        if pattern in str(bucket.name):
-            logging.warn("bucket matching: %s pattern: %s", bucket.name, pattern)
-            buckets.append(bucket.name)
-    return buckets
-
-# return existing tags if there are any
+# --tag key=value pairs plus the older --tagkey/--tagvalue, later values win for a repeated key
+def parseTags(tag_args, tagkey='', tagvalue=''):
+    pairs = []
+    for tag in tag_args:
+        if '=' not in tag:
+            exit("tag must be key=value: " + tag)
+        pairs.append(tuple(tag.split('=', 1)))
+    if tagkey or tagvalue:
+        pairs.append((tagkey, tagvalue))
+    new_tags = []
+    for key, value in pairs:
+        if key == '' or value == '':
+            FINDINGS.note("Can't update with blank tag key or value")
+            exit(1)
+        new_tags = [tag for tag in new_tags if tag['Key'] != key] + [{'Key': key, 'Value': value}]
+    return new_tags
+
+# return existing tags if there are any, None if they couldn't be read (so they won't be overwritten)
 def getOldTags(client, bucket):
     old_tags = []
     try:
         tags = client.get_bucket_tagging(Bucket=bucket)
         if tags:
             old_tags = old_tags + tags['TagSet']
-    except:
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'NoSuchTagSet':
+            logging.warn("Can't read tags on bucket %s: %s", bucket, e)
+            return None
         logging.warn("No tags on bucket: " + bucket)
     logging.warn("old_tags: " + str(old_tags) )
     return old_tags
 
-def printTags(client, buckets):
+# tags read with a client in the bucket's own region, None when even its region can't be found
+@PROFILE.timed('bucketTags')
+def bucketTags(clients, bucket):
+    try:
+        client = clients.bucket_client(bucket)
+    except botocore.exceptions.ClientError as e:
+        logging.warn("Can't find region of bucket %s: %s", bucket, e)
+        return None
+    return getOldTags(client, bucket)
+
+# dict of bucket: TagSet, one get_bucket_tagging per bucket, workers at a time
+def fetchTags(clients, buckets, workers):
+    pool = ThreadPool(max(1, workers))
+    try:
+        return dict(zip(buckets, pool.map(lambda bucket: bucketTags(clients, bucket), buckets)))
+    finally:
+        pool.close()
+        pool.join()
+
+def printTags(buckets, bucket_tags):
     if not buckets:
          exit('No buckets found')
     for bucket in buckets:
-        logging.warn("bucket: " + str(bucket) )
-        old_tags = getOldTags(client, str(bucket))
-        logging.warn("old_tags: " + str(old_tags) )
-        if old_tags:
+        old_tags = bucket_tags.get(bucket)
+        if old_tags is None:
+            FINDINGS.emit(bucket, 'warning', "WARN: cannot read tags on " + bucket)
+        elif old_tags:
             for tag in old_tags:
-                print bucket + " " + str(tag['Key']) + " " + str(tag['Value'])
-        else: 
-            print str(bucket) + " NO TAGS"
-
-# put tags on buckets, unless it already has tags starting with 'aws:' since we cannot reapply those
-def putTag(client, resource, buckets, key, value):
-    new_tags = [{'Key': key, 'Value': value}]
-    if key is '' or value is '':
-        print "Can't update with blank tag key or value"
-        exit(1)
+                FINDINGS.emit(bucket, 'info', bucket + " " + str(tag['Key']) + " " + str(tag['Value']))
+        else:
+            FINDINGS.emit(bucket, 'info', str(bucket) + " NO TAGS")
+
+# returns (combined TagSet, list of changes), no changes means the bucket already has every tag
+def planTags(old_tags, new_tags):
+    old_values = dict((tag['Key'], tag['Value']) for tag in old_tags)
+    new_keys = set(tag['Key'] for tag in new_tags)
+    combined_tags = list(new_tags)
+    changes = []
+    for tag in new_tags:
+        if tag['Key'] not in old_values:
+            changes.append("add " + tag['Key'] + "=" + tag['Value'])
+        elif old_values[tag['Key']] != tag['Value']:
+            changes.append("update " + tag['Key'] + ": " + old_values[tag['Key']] + " -> " + tag['Value'])
+    for tag in old_tags:
+        if tag['Key'] not in new_keys:
+            combined_tags.append({'Key': tag['Key'], 'Value': tag['Value']})
+    return combined_tags, changes
+
+# dict of bucket: combined TagSet for buckets that need updating, printing the plan for each
+# skips buckets that already match, couldn't be read, or have tags starting with 'aws' since we cannot reapply those
+def planBuckets(buckets, bucket_tags, new_tags):
+    plan = {}
     for bucket in buckets:
-        aws_tagged = False
-        combined_tags = list(new_tags)
-        old_tags = getOldTags(client, bucket)
-        logging.warn("old_tags: " + str(old_tags) )
-        for tag in old_tags:
-            if tag['Key'] != key:
-                combined_tags.append({'Key': tag['Key'], 'Value': tag['Value']})
-            if 'aws' in tag['Key']:
-                aws_tagged = True
-        logging.warn("Updating tags on bucket: %s", bucket)
-        bucket_tagging = resource.BucketTagging(bucket)
-        if aws_tagged is False:
-            puttag_result = bucket_tagging.put( Tagging={ 'TagSet': combined_tags } )
-            logging.debug(puttag_result)
+        old_tags = bucket_tags.get(bucket)
+        if old_tags is None:
+            continue
+        combined_tags, changes = planTags(old_tags, new_tags)
+        if not changes:
+            FINDINGS.note("PLAN: " + bucket + " already tagged, no change")
+        elif any('aws' in tag['Key'] for tag in old_tags):
+            FINDINGS.emit(bucket, 'warning', "WARN: cannot apply tags on " + bucket)
+        else:
+            FINDINGS.note("PLAN: " + bucket + " " + ", ".join(changes))
+            plan[bucket] = combined_tags
+    return plan
+
+# put the planned TagSet on one bucket, returns the TagSet s3 accepted or None
+@PROFILE.timed('putTags')
+def putTags(client, bucket, combined_tags):
+    logging.warn("Updating tags on bucket: %s", bucket)
+    try:
+        result = client.put_bucket_tagging(Bucket=bucket, Tagging={'TagSet': combined_tags})
+    except botocore.exceptions.ClientError as e:
+        logging.warn("Tagging failed on bucket %s: %s", bucket, e)
+        return None
+    logging.debug(result)
+    if result.get('ResponseMetadata', {}).get('HTTPStatusCode') not in [200, 204]:
+        return None
+    return combined_tags
+
+# apply the plan workers buckets at a time, returns dict of bucket: TagSet now on the bucket
+# put_bucket_tagging replaces the whole TagSet, so a successful put is the new state and nothing is re-read
+def applyTags(clients, plan, workers):
+    pool = ThreadPool(max(1, workers))
+    try:
+        results = pool.map(lambda bucket: (bucket, putTags(clients.bucket_client(bucket), bucket, plan[bucket])), sorted(plan))
+    finally:
+        pool.close()
+        pool.join()
+    applied = {}
+    for bucket, tags in results:
+        if tags is None:
+            FINDINGS.emit(bucket, 'warning', "WARN: tag update failed on " + bucket)
         else:
-            print "WARN: cannot apply tags on " + bucket
+            applied[bucket] = tags
+    return applied
 
 def main ():
+    global FINDINGS
     args = parser.parse_args()
     pattern = args.pattern
-    addtags = args.addtags
-    tagkey = args.tagkey
-    tagvalue = args.tagvalue
+    addtags = args.addtags in ['yes','y','Yes','YES']
     loglevel = args.log
     initLogging(loglevel)
-    client=boto3.client('s3', config=Config(signature_version='s3v4'))
-    resource = boto3.resource('s3', config=Config(signature_version='s3v4'))
-    matching_buckets = findBuckets(resource, pattern)
-    printTags(client, matching_buckets)
-    if addtags in ['yes','y','Yes','YES']:
-        print "Planning to add/update this tag: " + tagkey + " value: " + tagvalue + " to the matching buckets shown" 
-        putTag(client, resource, matching_buckets, tagkey, tagvalue)
-        print "########## status after update ##########"
-        printTags(client, matching_buckets)
-    
+    if args.profile_report:
+        PROFILE.start(args.profile_report)
+    session = PROFILE.instrument(boto3.session.Session())
+    clients = S3ClientPool(session, args.workers)
+    FINDINGS = findings.from_args(args, 's3Tag', session.profile_name)
+    new_tags = []
+    if addtags or args.tag or args.tagkey or args.tagvalue:
+        new_tags = parseTags(args.tag, args.tagkey, args.tagvalue)
+    if addtags and not new_tags:
+        FINDINGS.note("Can't update with blank tag key or value")
+        exit(1)
+    if not pattern and not args.match:
+        exit('pattern can not be empty')
+    with PROFILE.phase('discover buckets'):
+        matching_buckets = [bucket.name for bucket in discovery.from_args(args, clients, [pattern], args.workers, session.profile_name)]
+    with PROFILE.phase('fetch tags'):
+        bucket_tags = fetchTags(clients, matching_buckets, args.workers)
+    printTags(matching_buckets, bucket_tags)
+    if not new_tags:
+        clients.report()
+        return
+    FINDINGS.note("Planning to add/update these tags: " + ", ".join(tag['Key'] + "=" + tag['Value'] for tag in new_tags)
+                  + " to the matching buckets shown")
+    plan = planBuckets(matching_buckets, bucket_tags, new_tags)
+    if not addtags:
+        FINDINGS.note("Dry run, " + str(len(plan)) + " buckets would be updated, set --addtags yes to apply")
+        clients.report()
+        return
+    with PROFILE.phase('apply tags'):
+        bucket_tags.update(applyTags(clients, plan, args.workers))
+    FINDINGS.note("########## status after update ##########")
+    printTags(matching_buckets, bucket_tags)
+    clients.report()
+
 if __name__ == '__main__':
     main()
@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 
 # Audit a specific components on a statuspage.io Status Page
+# With --pages (or several comma separated --sum_url) all pages are fetched concurrently over one
+# pooled session, and the exit code is the worst result of all of them, so one Nagios check covers every vendor
+# With --watch it keeps running instead: each page is polled on its own interval with conditional GETs,
+# only status changes are written, and --listen serves the current state for Prometheus or a quick curl
 
 import json, requests, argparse
+import time
+import random
+import threading
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from auditlib import findings
+from auditlib import metrics
 
 # parameters for status to check
 parser = argparse.ArgumentParser()
 parser.add_argument(
     '--sum_url', default='https://unsplash.statuspage.io/api/v2/summary.json',
-    help='e.g. summary API URL')
+    help='e.g. summary API URL, comma separated for more than one page')
 
 parser.add_argument(
     '--components', default='API',
@@ -18,49 +29,327 @@ parser.add_argument(
     '--okstatus', default='operational',
     help='List of comma separated acceptable status codes "operational,degraded_performance"')
 
-def get_summary(url):
+parser.add_argument(
+    '--pages', default=None,
+    help='File of pages to check instead of --sum_url, one "url [components] [okstatus] [interval]" per line '
+         'or a json list of {"url", "components", "okstatus", "interval"}, --components/--okstatus/--interval are the defaults')
+
+parser.add_argument(
+    '--workers', default=10, type=int,
+    help='Number of pages to fetch at once')
+
+parser.add_argument(
+    '--timeout', default=10, type=float,
+    help='Seconds to wait for each page')
+
+parser.add_argument(
+    '--watch', action='store_true',
+    help='Keep running, poll every page and only write status changes')
+
+parser.add_argument(
+    '--interval', default=60, type=float,
+    help='Seconds between polls of each page in --watch mode')
+
+parser.add_argument(
+    '--max-backoff', default=900, type=float,
+    help='Longest wait between polls of a page that keeps failing in --watch mode')
+
+parser.add_argument(
+    '--listen', default=None,
+    help='Serve /metrics (Prometheus) and /status (json) on host:port in --watch mode, e.g. 127.0.0.1:9101')
+
+findings.add_arguments(parser)
+
+# component results go through this writer, replaced in main() when --output is set
+FINDINGS = findings.FindingsWriter('status-page-check')
+
+# Nagios exit codes, a page that can't be fetched or is missing a component is UNKNOWN
+OK, WARNING, CRITICAL, UNKNOWN = 0, 1, 2, 3
+# worst first, used to combine every page into one exit code
+SEVERITY_ORDER = [CRITICAL, WARNING, UNKNOWN, OK]
+
+def split_list(value):
+    if isinstance(value, list):
+        return value
+    return [item for item in value.replace(" ", "").split(",") if item]
+
+def worst(codes):
+    """
+    Most severe of a list of exit codes, OK for an empty list
+    """
+    codes = set(codes)
+    for code in SEVERITY_ORDER:
+        if code in codes:
+            return code
+    return OK
+
+def load_pages(path, components, okstatus):
     """
-    Download Summary JSON from status page api URL
+    Read the --pages file into a list of {'url', 'components', 'okstatus'}
+    Blank lines and lines starting with # are skipped in the line format
     """
-    summary = requests.get(url)
+    with open(path) as pages_file:
+        text = pages_file.read()
+    if text.lstrip().startswith('['):
+        rows = json.loads(text)
+    else:
+        rows = []
+        for line in text.splitlines():
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            rows.append(dict(zip(['url', 'components', 'okstatus', 'interval'], fields)))
+    return [{'url': row['url'],
+             'components': split_list(row.get('components') or components),
+             'okstatus': split_list(row.get('okstatus') or okstatus),
+             'interval': float(row['interval']) if row.get('interval') else None} for row in rows]
+
+def make_session(workers):
+    """
+    One requests Session for every page, with a connection pool big enough for the workers
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max(1, workers), pool_maxsize=max(1, workers))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_summary(url, session=None, timeout=10):
+    """
+    Download Summary JSON from status page api URL, returns the parsed summary
+    Raises requests.RequestException (or ValueError for a body that isn't json) on failure
+    """
+    summary = (session or requests).get(url, timeout=timeout)
     if summary.status_code != 200:
-        exit("Non 200 status code downloading summary API URL")
-    name = summary.json().get('page').get('name')
-    if name:
-        print 'Retrieved status for: ' + str(name) + ' At: ' + url
-    return summary
+        raise requests.HTTPError("Non 200 status code downloading summary API URL: %d" % summary.status_code)
+    return summary.json()
 
 def check_status(summary, components, okstatus):
     """
     Look at specific components to see if expected status matches
-    If one or more components has not okstatus exit non-zero
+    Returns CRITICAL if one or more components has not okstatus, UNKNOWN if one wasn't found
     """
-    status_code = 0
-    items = summary.json().get('components')
+    status_code = OK
+    page = (summary.get('page') or {}).get('name', '')
+    found = set()
+    items = summary.get('components') or []
     for item in items:
         if item['name'] in components:
+            found.add(item['name'])
+            resource = page + '/' + item['name'] if page else item['name']
             if item['status'] in okstatus:
-                print "OK: " + item['name'] + " " + item['status']
+                FINDINGS.emit(resource, 'ok', "OK: " + item['name'] + " " + item['status'])
             else:
-                print "CRIT: " + item['name'] + " " + item['status']
-                status_code = 2
-    exit(status_code)
+                FINDINGS.emit(resource, 'critical', "CRIT: " + item['name'] + " " + item['status'])
+                status_code = worst([status_code, CRITICAL])
+    for component in components:
+        if component not in found:
+            resource = page + '/' + component if page else component
+            FINDINGS.emit(resource, 'unknown', "UNKNOWN: " + component + " not found")
+            status_code = worst([status_code, UNKNOWN])
+    return status_code
 
+def fetch_page(session, page, timeout):
+    """
+    (page, summary, error) for one page, run on the worker threads
+    """
+    try:
+        return page, get_summary(page['url'], session, timeout), None
+    except (requests.RequestException, ValueError) as e:
+        return page, None, e
 
-def main():
+def check_pages(pages, workers=10, timeout=10, session=None):
     """
-    Parses args, gets summary status JSON from sum_url
-    Compares components you're checking vs expected result 
+    Fetch every page concurrently and check each one as it arrives, in page order
+    Returns (exit code of the worst page, list of (url, exit code))
     """
+    session = session or make_session(workers)
+    results = []
+    pool = ThreadPool(max(1, min(workers, len(pages))))
+    try:
+        for page, summary, error in pool.imap(lambda page: fetch_page(session, page, timeout), pages):
+            if error is not None:
+                FINDINGS.emit(page['url'], 'unknown', "UNKNOWN: " + page['url'] + " " + str(error))
+                results.append((page['url'], UNKNOWN))
+                continue
+            name = (summary.get('page') or {}).get('name')
+            if name:
+                FINDINGS.note('Retrieved status for: ' + str(name) + ' At: ' + page['url'])
+            results.append((page['url'], check_status(summary, page['components'], page['okstatus'])))
+    finally:
+        pool.close()
+        pool.join()
+    return worst(code for url, code in results), results
+
+class PageWatch(object):
+    """
+    Polling state of one page in --watch mode
+    Keeps the page's ETag, so an unchanged page costs a 304 and no parsing, and the last
+    status of each component, so only transitions are written
+    """
+
+    def __init__(self, page, interval=60, max_backoff=900):
+        self.url = page['url']
+        self.components = page['components']
+        self.okstatus = page['okstatus']
+        self.interval = float(page.get('interval') or interval)
+        self.max_backoff = max_backoff
+        self.name = ''
+        self.etag = None
+        self.states = {}
+        self.reachable = None
+        self.failures = 0
+        self.polls = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.last_success = 0
 
+    def resource(self, component):
+        return self.name + '/' + component if self.name else component
+
+    def severity(self, status):
+        if status is None:
+            return 'unknown'
+        return 'ok' if status in self.okstatus else 'critical'
+
+    def poll(self, session, timeout=10):
+        """
+        One conditional GET, returns seconds to wait before the next one
+        Errors back off exponentially from the interval up to max_backoff, with jitter
+        """
+        self.polls += 1
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        try:
+            response = session.get(self.url, headers=headers, timeout=timeout)
+            if response.status_code == 304:
+                self.not_modified += 1
+                summary = None
+            elif response.status_code != 200:
+                raise requests.HTTPError("Non 200 status code downloading summary API URL: %d" % response.status_code)
+            else:
+                summary = response.json()
+                self.etag = response.headers.get('ETag')
+        except (requests.RequestException, ValueError) as e:
+            self.errors += 1
+            self.failures += 1
+            if self.reachable is not False:
+                FINDINGS.emit(self.url, 'unknown', "UNKNOWN: " + self.url + " " + str(e))
+            self.reachable = False
+            return min(self.max_backoff, self.interval * 2 ** self.failures) * random.uniform(0.5, 1.0)
+        if self.reachable is False:
+            FINDINGS.emit(self.url, 'ok', "RECOVERED: " + self.url)
+        self.reachable = True
+        self.failures = 0
+        self.last_success = time.time()
+        if summary is not None:
+            self.update(summary)
+        return self.interval * random.uniform(0.9, 1.1)
+
+    def update(self, summary):
+        """ Write a line for each component whose status changed, the first poll writes them all """
+        self.name = (summary.get('page') or {}).get('name', '')
+        current = dict((item['name'], item['status']) for item in summary.get('components') or []
+                       if item['name'] in self.components)
+        for component in self.components:
+            old, new = self.states.get(component), current.get(component)
+            if component in self.states and old == new:
+                continue
+            label = {'ok': 'OK', 'critical': 'CRIT', 'unknown': 'UNKNOWN'}[self.severity(new)]
+            change = str(new or 'not found') if component not in self.states else str(old or 'not found') + " -> " + str(new or 'not found')
+            FINDINGS.emit(self.resource(component), self.severity(new), label + ": " + component + " " + change)
+        self.states = dict((component, current.get(component)) for component in self.components)
+
+    def status(self):
+        return {'url': self.url, 'name': self.name, 'reachable': self.reachable, 'components': dict(self.states),
+                'polls': self.polls, 'not_modified': self.not_modified, 'errors': self.errors,
+                'last_success': self.last_success}
+
+def render_metrics(watchers):
+    """
+    Prometheus text for the current state of every watched page
+    """
+    lines = ['# TYPE statuspage_up gauge', '# TYPE statuspage_component_ok gauge',
+             '# TYPE statuspage_component_status gauge', '# TYPE statuspage_polls_total counter',
+             '# TYPE statuspage_not_modified_total counter', '# TYPE statuspage_errors_total counter',
+             '# TYPE statuspage_last_success_timestamp_seconds gauge']
+    for watcher in watchers:
+        page = {'page': watcher.name, 'url': watcher.url}
+        lines.append(metrics.sample('statuspage_up', page, 1 if watcher.reachable else 0))
+        lines.append(metrics.sample('statuspage_polls_total', page, watcher.polls))
+        lines.append(metrics.sample('statuspage_not_modified_total', page, watcher.not_modified))
+        lines.append(metrics.sample('statuspage_errors_total', page, watcher.errors))
+        lines.append(metrics.sample('statuspage_last_success_timestamp_seconds', page, '%.3f' % watcher.last_success))
+        for component, status in sorted(watcher.states.items()):
+            labels = {'page': watcher.name, 'component': component}
+            lines.append(metrics.sample('statuspage_component_ok', labels, 1 if watcher.severity(status) == 'ok' else 0))
+            labels['status'] = status or 'not_found'
+            lines.append(metrics.sample('statuspage_component_status', labels, 1))
+    return '\n'.join(lines) + '\n'
+
+def watch_page(watcher, session, timeout, stop):
+    # spread the first polls out so every page isn't fetched in the same second
+    stop.wait(random.uniform(0, min(watcher.interval, 10) / 2))
+    while not stop.is_set():
+        stop.wait(watcher.poll(session, timeout))
+
+def watch(pages, interval=60, max_backoff=900, timeout=10, listen=None, stop=None):
+    """
+    Poll every page on its own thread until stop is set (or ctrl-c), writing only status changes
+    """
+    stop = stop or threading.Event()
+    session = make_session(len(pages))
+    watchers = [PageWatch(page, interval, max_backoff) for page in pages]
+    server = None
+    if listen:
+        server = metrics.serve(listen, {
+            '/metrics': lambda: (metrics.PROMETHEUS_TYPE, render_metrics(watchers)),
+            '/status': lambda: (metrics.JSON_TYPE, json.dumps([w.status() for w in watchers], sort_keys=True)),
+        })
+        FINDINGS.note("Serving /metrics and /status on " + listen)
+    threads = [threading.Thread(target=watch_page, args=(watcher, session, timeout, stop)) for watcher in watchers]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while not stop.is_set():
+            # a timeout keeps ctrl-c working on python 2
+            stop.wait(1)
+    except KeyboardInterrupt:
+        stop.set()
+    for thread in threads:
+        thread.join()
+    if server:
+        server.shutdown()
+        server.server_close()
+    return watchers
+
+
+def main():
+    """
+    Parses args, gets summary status JSON from sum_url or every page in --pages
+    Compares components you're checking vs expected result
+    Exits with the worst result of all pages
+    """
+    global FINDINGS
     args = parser.parse_args()
-    components = args.components.replace(" ", "").split(",")
-    okstatus = args.okstatus.replace(" ", "").split(",")
-    sum_url = args.sum_url
+    FINDINGS = findings.from_args(args, 'status-page-check')
+    components = split_list(args.components)
+    okstatus = split_list(args.okstatus)
+    if args.pages:
+        pages = load_pages(args.pages, components, okstatus)
+    else:
+        pages = [{'url': url, 'components': components, 'okstatus': okstatus} for url in split_list(args.sum_url)]
 
-    summary = get_summary(sum_url)
-    check_status(summary, components, okstatus)
+    if args.watch:
+        watch(pages, args.interval, args.max_backoff, args.timeout, args.listen)
+        return
+
+    status_code, results = check_pages(pages, args.workers, args.timeout)
+    if len(results) > 1:
+        FINDINGS.note("%d pages: %d OK, %d not OK" % (
+            len(results), len([code for url, code in results if code == OK]),
+            len([code for url, code in results if code != OK])))
+    exit(status_code)
 
 if __name__ == '__main__':
     main()
-